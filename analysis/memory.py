@@ -3,6 +3,7 @@
 import gc
 import getopt
 import os
+import numpy as np
 import psutil
 import sys
 import time
@@ -18,8 +19,20 @@ def memory_usage():
     return mem
 
 
+def tables_size(ast):
+    """Returns the size in MB of the tables the AST consists of, both as they are stored
+    and as they would be if stored in np.int (which is what EASA used to do)."""
+    arrays = [array for name, array in ast._serialize().iteritems() if name != "string"]
+    actual = sum(array.nbytes for array in arrays)
+    wide = sum(array.size * np.dtype(np.int).itemsize for array in arrays)
+    return actual / float(2 ** 20), wide / float(2 ** 20)
+
+
 def main(args):
-    opts, args = getopt.getopt(args, "")
+    opts, args = getopt.getopt(args, "c")
+    opts = dict(opts)
+    # NOTE(msdubov): The -c option turns on the one-byte LCP encoding in EASA.
+    ast_kwargs = {"compact_lcptab": True} if "-c" in opts else {}
 
     ast_algorithm = args[0]
     n_from = int(args[1])
@@ -34,9 +47,11 @@ def main(args):
         asts = []
         for _ in xrange(repeats):
             strings_collection = utils.worst_case_strings_collection(m, n)
-            ast = base.AST.get_ast(strings_collection, ast_algorithm)
+            ast = base.AST.get_ast(strings_collection, ast_algorithm, **ast_kwargs)
             asts.append(ast)
-        print("%i\t%.2f" % (n, memory_usage() / repeats))
+        tables, tables_wide = tables_size(asts[0])
+        print("%i\t%.2f\t%.2f\t%.2f\t%.1f%%" % (n, memory_usage() / repeats, tables,
+                                             tables_wide, 100 * (1 - tables / tables_wide)))
         for ast in asts:
             del ast
         gc.collect()
@@ -1,15 +1,24 @@
 # -*- coding: utf-8 -*
 
 import itertools
+import multiprocessing
 import sys
 
+import numpy as np
+
 from east import consts
 from east import logging
 from east import relevance
+from east import tables
 from east import utils
 
+
+# Maximal number of scores in a block of the keyphrases table computed at once
+TABLE_BLOCK_SIZE = 2 ** 20
+
+
 def keyphrases_table(keyphrases, texts, similarity_measure=None, synonimizer=None,
-                     language=consts.Language.ENGLISH):
+                     language=consts.Language.ENGLISH, workers=1):
     """
     Constructs the keyphrases table, containing their matching scores in a set of texts.
 
@@ -23,42 +32,262 @@ def keyphrases_table(keyphrases, texts, similarity_measure=None, synonimizer=Non
     :param similarity_measure: similarity measure to use
     :param synonimizer: SynonymExtractor object to be used
     :param language: Language of the text collection / keyphrases
+    :param workers: number of processes to compute the matching scores in
 
     :returns: dictionary of dictionaries, having keyphrases on its first level and texts
               on the second level.
     """
 
+    res = {keyphrase: {} for keyphrase in keyphrases if keyphrase}
+    for text_name, scores in keyphrases_table_rows(keyphrases, texts, similarity_measure,
+                                                   synonimizer, language, workers,
+                                                   by_texts=True):
+        for keyphrase, score in scores.iteritems():
+            res[keyphrase][text_name] = score
+    return res
+
+
+def keyphrases_table_rows(keyphrases, texts, similarity_measure=None, synonimizer=None,
+                          language=consts.Language.ENGLISH, workers=1, by_texts=False):
+    """
+    Generator variant of keyphrases_table(), which yields the table row by row.
+
+    The rows go in the sorted order of the keyphrases and have the form
+    (keyphrase, {text_name: score}); if by_texts is True, they go in the sorted order
+    of the text names instead and have the form (text_name, {keyphrase: score}).
+    Only a block of rows is kept in memory at a time (see TABLE_BLOCK_SIZE).
+
+    The parameters are the same as for keyphrases_table().
+    """
+
+    keyphrases, text_titles = _table_labels(keyphrases, texts)
+    for block_keyphrases, block_texts, scores in _table_blocks(
+                                                     keyphrases, text_titles, texts,
+                                                     similarity_measure, synonimizer, language,
+                                                     workers, by_texts):
+        if by_texts:
+            for j, text_scores in itertools.izip(block_texts, scores.T.tolist()):
+                yield text_titles[j], dict(itertools.izip(keyphrases, text_scores))
+        else:
+            for i, keyphrase_scores in itertools.izip(block_keyphrases, scores.tolist()):
+                yield keyphrases[i], dict(itertools.izip(text_titles, keyphrase_scores))
+
+
+def keyphrases_matrix(keyphrases, texts, similarity_measure=None, synonimizer=None,
+                      language=consts.Language.ENGLISH, workers=1, threshold=None):
+    """
+    Variant of keyphrases_table() that stores the table as a matrix of float32 scores.
+
+    The parameters are the same as for keyphrases_table(); if a threshold is given,
+    only the scores that are at least that threshold get stored.
+
+    :returns: tables.KeyphrasesTable with the keyphrases and the text names in sorted order,
+              or tables.SparseKeyphrasesTable if the threshold is given
+    """
+
+    keyphrases, text_titles = _table_labels(keyphrases, texts)
+    blocks = _table_blocks(keyphrases, text_titles, texts, similarity_measure, synonimizer,
+                           language, workers)
+
+    if threshold is None:
+        matrix = np.zeros((len(keyphrases), len(text_titles)), dtype=np.float32)
+        for block_keyphrases, _, scores in blocks:
+            matrix[block_keyphrases] = scores
+        return tables.KeyphrasesTable(keyphrases, text_titles, matrix)
+
+    # NOTE(msdubov): The scores get compared with the threshold before they get rounded
+    #                to float32.
+    counts = [np.zeros(0, dtype=np.int64)]
+    indices = [np.zeros(0, dtype=np.int64)]
+    data = [np.zeros(0, dtype=np.float32)]
+    for _, _, scores in blocks:
+        mask = scores >= threshold
+        counts.append(mask.sum(axis=1))
+        indices.append(np.nonzero(mask)[1])
+        data.append(scores[mask].astype(np.float32))
+    indptr = np.concatenate(([0], np.cumsum(np.concatenate(counts))))
+    return tables.SparseKeyphrasesTable(keyphrases, text_titles, indptr,
+                                        np.concatenate(indices), np.concatenate(data),
+                                        threshold)
+
+
+def _table_labels(keyphrases, texts):
+    """Returns the sorted lists of the (distinct, non-empty) keyphrases and of the text names."""
+    return (sorted(set(keyphrase for keyphrase in keyphrases if keyphrase)),
+            sorted(texts.keys()))
+
+
+def _table_blocks(keyphrases, text_titles, texts, similarity_measure=None, synonimizer=None,
+                  language=consts.Language.ENGLISH, workers=1, by_texts=False):
+    """Computes the keyphrases table block by block.
+
+    The blocks consist either of whole rows for some keyphrases or, if by_texts is True,
+    of whole columns for some texts (see TABLE_BLOCK_SIZE).
+
+    :param keyphrases: list of the keyphrases, as returned by _table_labels()
+    :param text_titles: list of the text names, as returned by _table_labels()
+
+    :returns: generator of tuples (keyphrase indices, text indices, matrix of the scores)
+    """
+
     similarity_measure = similarity_measure or relevance.ASTRelevanceMeasure()
+    similarity_measure.set_text_collection([texts[title] for title in text_titles], language)
 
-    text_titles = texts.keys()
-    text_collection = texts.values()
-    similarity_measure.set_text_collection(text_collection, language)
-
-    i = 0
-    keyphrases_prepared = {keyphrase: utils.prepare_text(keyphrase)
-                           for keyphrase in keyphrases}
-    total_keyphrases = len(keyphrases)
-    total_scores = len(text_collection) * total_keyphrases
-    res = {}
-    for keyphrase in keyphrases:
-        if not keyphrase:
-            continue
-        res[keyphrase] = {}
-        for j in xrange(len(text_collection)):
-            i += 1
-            logging.progress("Calculating matching scores", i, total_scores)
-            res[keyphrase][text_titles[j]] = similarity_measure.relevance(
-                                                        keyphrases_prepared[keyphrase],
-                                                        text=j, synonimizer=synonimizer)
-
-    logging.clear()
+    keyphrases_prepared = [utils.prepare_text(keyphrase) for keyphrase in keyphrases]
 
-    return res
+    total_rows = len(text_titles) if by_texts else len(keyphrases)
+    row_length = len(keyphrases) if by_texts else len(text_titles)
+    block_rows = max(TABLE_BLOCK_SIZE // max(row_length, 1), 1)
+
+    pool = (multiprocessing.Pool(workers, _init_scoring_worker,
+                                 (similarity_measure, synonimizer))
+            if workers > 1 and keyphrases and text_titles else None)
+    try:
+        for rows_start, rows_end in utils.ranges(total_rows, (total_rows - 1) // block_rows + 1):
+            if by_texts:
+                block_keyphrases = range(len(keyphrases))
+                block_texts = range(rows_start, rows_end)
+            else:
+                block_keyphrases = range(rows_start, rows_end)
+                block_texts = range(len(text_titles))
+            scores = _scores([keyphrases_prepared[i] for i in block_keyphrases], block_texts,
+                             similarity_measure, synonimizer, pool, workers)
+            yield block_keyphrases, block_texts, scores
+            logging.progress("Calculating matching scores", rows_end, total_rows)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        logging.clear()
+
+
+def _scores(keyphrases, texts, similarity_measure, synonimizer, pool=None, workers=1):
+    """Computes the matrix of matching scores of the keyphrases in the texts.
+
+    If a process pool is given, the (keyphrase, text) grid gets split into blocks which are
+    scored by its worker processes; the workers get forked from this one, so that they share
+    the (memory-mapped) index arrays of the similarity measure instead of copying them.
+    The score cache of the similarity measure (if any) is used by this process only: the blocks
+    get restricted to the keyphrases and texts having scores missing in the cache, and
+    the scores computed by the workers get put into the cache.
+
+    :param keyphrases: list of prepared keyphrases
+    :param texts: list of text indices
+    :returns: numpy array of shape (len(keyphrases), len(texts))
+    """
+    scores = np.zeros((len(keyphrases), len(texts)), dtype=np.float)
+    if not keyphrases or not texts:
+        return scores
+    if pool is None:
+        # NOTE(msdubov): Scoring all the keyphrases against the texts in a single call
+        #                allows the relevance measure to share the work between them.
+        return similarity_measure.relevance_table(keyphrases, texts, synonimizer)
+    missing = np.ones((len(keyphrases), len(texts)), dtype=np.bool)
+    if similarity_measure.score_cache is not None:
+        for k, j in enumerate(texts):
+            cached_scores = similarity_measure.get_cached_scores(keyphrases, j, synonimizer)
+            for i, score in enumerate(cached_scores):
+                if score is not None:
+                    scores[i, k] = score
+                    missing[i, k] = False
+    blocks = _grid_blocks(len(keyphrases), len(texts), workers * 4,
+                          similarity_measure.scores_all_texts_at_once)
+    tasks = []
+    for (keyphrases_start, keyphrases_end), (texts_start, texts_end) in blocks:
+        block_missing = missing[keyphrases_start:keyphrases_end, texts_start:texts_end]
+        # NOTE(msdubov): The keyphrases get scored against the texts in batches, so the blocks
+        #                are the keyphrases and texts having at least one missing score.
+        block_keyphrases = (keyphrases_start + np.nonzero(block_missing.any(axis=1))[0]).tolist()
+        block_texts = (texts_start + np.nonzero(block_missing.any(axis=0))[0]).tolist()
+        if block_keyphrases:
+            tasks.append(((block_keyphrases, block_texts),
+                          [keyphrases[i] for i in block_keyphrases],
+                          [texts[k] for k in block_texts]))
+    for (block_keyphrases, block_texts), block_scores in pool.imap_unordered(_score_block,
+                                                                              tasks):
+        cells = np.ix_(block_keyphrases, block_texts)
+        block_missing = missing[cells]
+        scores[cells] = np.where(block_missing, block_scores, scores[cells])
+        for k, j in enumerate(block_texts):
+            rows = np.nonzero(block_missing[:, k])[0]
+            similarity_measure.put_cached_scores([keyphrases[block_keyphrases[i]] for i in rows],
+                                                 texts[j], block_scores[rows, k], synonimizer)
+    return scores
+
+
+def _grid_blocks(keyphrases_count, texts_count, blocks_count, split_keyphrases_only=False):
+    """Splits the (keyphrase, text) grid into about blocks_count blocks.
+
+    The texts get split first, so that each block shares the work between as many
+    keyphrases as possible (see RelevanceMeasure.relevance_many()); the keyphrases get split
+    only when there are not enough texts, or when the scores for all the texts get computed
+    at once anyway.
+
+    :returns: list of tuples ((keyphrases_start, keyphrases_end), (texts_start, texts_end))
+    """
+    texts_blocks = 1 if split_keyphrases_only else min(blocks_count, texts_count)
+    keyphrases_blocks = min(max(blocks_count // texts_blocks, 1), keyphrases_count)
+    return list(itertools.product(utils.ranges(keyphrases_count, keyphrases_blocks),
+                                  utils.ranges(texts_count, texts_blocks)))
+
+
+# State of a worker process scoring the keyphrases (see _init_scoring_worker())
+_scoring_worker = {}
+
+
+def _init_scoring_worker(similarity_measure, synonimizer):
+    # NOTE(msdubov): The score cache of the parent process (possibly backed by a file)
+    #                must not be shared between the processes.
+    similarity_measure.score_cache = None
+    _scoring_worker["similarity_measure"] = similarity_measure
+    _scoring_worker["synonimizer"] = synonimizer
+
+
+def _score_block(task):
+    block, keyphrases, texts = task
+    similarity_measure = _scoring_worker["similarity_measure"]
+    synonimizer = _scoring_worker["synonimizer"]
+    return block, similarity_measure.relevance_table(keyphrases, texts, synonimizer)
+
+
+def keyphrases_top(keyphrases, texts, k=10, similarity_measure=None, synonimizer=None,
+                   language=consts.Language.ENGLISH):
+    """
+    Finds the k texts each of the keyphrases is the most relevant to.
+
+    Unlike keyphrases_table(), does not compute all the matching scores: the texts
+    that cannot get into the top k for a keyphrase get skipped where the relevance measure
+    can bound their scores (see RelevanceMeasure.top_texts_many()).
+
+    :param keyphrases: list of strings
+    :param texts: dictionary of form {text_name: text}
+    :param k: number of texts to find for each keyphrase
+    :param similarity_measure: similarity measure to use
+    :param synonimizer: SynonymExtractor object to be used
+    :param language: Language of the text collection / keyphrases
+
+    :returns: dictionary of form {keyphrase: [(text_name, score), ...]}, with the lists
+              in the descending order of the scores (the ties get broken by the text names).
+    """
+
+    similarity_measure = similarity_measure or relevance.ASTRelevanceMeasure()
+
+    # NOTE(msdubov): The texts get indexed in the order of their names, so that
+    #                the measure breaks the ties between the scores by the names.
+    text_titles = sorted(texts.keys())
+    similarity_measure.set_text_collection([texts[title] for title in text_titles], language)
+
+    keyphrases = sorted(set(keyphrase for keyphrase in keyphrases if keyphrase))
+    keyphrases_prepared = [utils.prepare_text(keyphrase) for keyphrase in keyphrases]
+    tops = similarity_measure.top_texts_many(keyphrases_prepared, k, synonimizer)
+
+    return {keyphrase: [(text_titles[j], score) for j, score in top]
+            for keyphrase, top in itertools.izip(keyphrases, tops)}
 
 
 def keyphrases_graph(keyphrases, texts, referral_confidence=0.6, relevance_threshold=0.25,
                      support_threshold=1, similarity_measure=None, synonimizer=None,
-                     language=consts.Language.ENGLISH):
+                     language=consts.Language.ENGLISH, workers=1):
     """
     Constructs the keyphrases relation graph based on the given texts corpus.
 
@@ -80,6 +309,7 @@ def keyphrases_graph(keyphrases, texts, referral_confidence=0.6, relevance_thres
     :param similarity_measure: Similarity measure to use
     :param synonimizer: SynonymExtractor object to be used
     :param language: Language of the text collection / keyphrases
+    :param workers: number of processes to compute the matching scores in
 
     :returns: graph dictionary in a the following format:
                 {
@@ -102,15 +332,37 @@ def keyphrases_graph(keyphrases, texts, referral_confidence=0.6, relevance_thres
                 }
     """
 
-    similarity_measure = similarity_measure or relevance.ASTRelevanceMeasure()
+    # NOTE(msdubov): Only the scores reaching the relevance threshold are needed.
+    table = keyphrases_matrix(keyphrases, texts, similarity_measure, synonimizer, language,
+                              workers, threshold=relevance_threshold)
 
-    # Keyphrases table
-    table = keyphrases_table(keyphrases, texts, similarity_measure, synonimizer, language)
-    
-    # Dictionary { "keyphrase" => set(names of texts containing "keyphrase") }
-    keyphrase_texts = {keyphrase: set([text for text in texts
-                                       if table[keyphrase][text] >= relevance_threshold])
-                       for keyphrase in keyphrases}
+    return keyphrases_graph_from_table(table, referral_confidence, relevance_threshold,
+                                       support_threshold,
+                                       [keyphrase for keyphrase in keyphrases if keyphrase])
+
+
+def keyphrases_graph_from_table(table, referral_confidence=0.6, relevance_threshold=0.25,
+                                support_threshold=1, keyphrases=None):
+    """
+    Constructs the keyphrases relation graph based on an already computed keyphrases table.
+
+    :param table: keyphrases table, either as returned by keyphrases_table() or by
+                  keyphrases_matrix(); for a sparse table, the scores not stored are
+                  considered to be below the relevance threshold
+    :param keyphrases: list of the keyphrases to become the graph nodes, in the order
+                       of their ids (all the keyphrases of the table in sorted order by default)
+
+    The other parameters and the result are the same as for keyphrases_graph().
+    """
+
+    if keyphrases is None:
+        keyphrases = sorted(table.keys())
+
+    # Occurrences of the keyphrases in the texts, as a boolean (keyphrase x text) matrix
+    # in the compressed sparse row format
+    labels, indptr, indices = _occurrences(table, relevance_threshold)
+    rows = np.array([labels[keyphrase] for keyphrase in keyphrases], dtype=np.int64)
+    support = np.diff(indptr)[rows]
 
     # Initializing the graph object with nodes
     graph = {
@@ -118,8 +370,9 @@ def keyphrases_graph(keyphrases, texts, referral_confidence=0.6, relevance_thres
             {
                 "id": i,
                 "label": keyphrase,
-                "support": len(keyphrase_texts[keyphrase])
-            } for i, keyphrase in enumerate(keyphrases)
+                "support": node_support
+            } for i, (keyphrase, node_support) in enumerate(itertools.izip(keyphrases,
+                                                                            support.tolist()))
         ],
         "edges": [],
         "referral_confidence": referral_confidence,
@@ -128,22 +381,109 @@ def keyphrases_graph(keyphrases, texts, referral_confidence=0.6, relevance_thres
     }
 
     # Removing nodes with small support after we've numbered all nodes
-    graph["nodes"] = [n for n in graph["nodes"]
-                      if len(keyphrase_texts[n["label"]]) >= support_threshold]
-    
+    graph["nodes"] = [n for n in graph["nodes"] if n["support"] >= support_threshold]
+
     # Creating edges
-    # NOTE(msdubov): permutations(), unlike combinations(), treats (1,2) and (2,1) as different
-    for i1, i2 in itertools.permutations(range(len(graph["nodes"])), 2):
-        node1 = graph["nodes"][i1]
-        node2 = graph["nodes"][i2]
-        confidence = (float(len(keyphrase_texts[node1["label"]] &
-                                keyphrase_texts[node2["label"]])) /
-                      max(len(keyphrase_texts[node1["label"]]), 1))
-        if confidence >= referral_confidence:
+    node_ids = np.array([node["id"] for node in graph["nodes"]], dtype=np.int64)
+    for sources, targets, confidences in _edges(indptr, indices, rows[node_ids],
+                                                referral_confidence):
+        for source, target, confidence in itertools.izip(node_ids[sources].tolist(),
+                                                         node_ids[targets].tolist(),
+                                                         confidences.tolist()):
             graph["edges"].append({
-                "source": node1["id"],
-                "target": node2["id"],
+                "source": source,
+                "target": target,
                 "confidence": confidence
             })
-            
+
     return graph
+
+
+# Maximal size of a block of the co-occurrence matrix computed at once
+COOCCURRENCES_BLOCK_SIZE = 2 ** 22
+
+
+def _edges(indptr, indices, rows, referral_confidence):
+    """Computes the edges of the keyphrases graph in blocks of nodes.
+
+    The confidence of the edge (i1, i2) is the number of texts containing both keyphrases
+    divided by the number of texts containing the first one (or by 1 if there are none).
+    The numbers of the texts containing both keyphrases make up the co-occurrence matrix,
+    which is the product of the occurrence matrix by its transpose; the product gets computed
+    through the lists of the keyphrases occurring in each text, so that the cost depends on
+    the number of occurrences rather than on the size of the matrices.
+
+    :param indptr: row pointers of the occurrence matrix (see _occurrences())
+    :param indices: column indices of the occurrence matrix
+    :param rows: the rows of the occurrence matrix for the graph nodes
+
+    :returns: generator of tuples (source nodes, target nodes, confidences) in the order
+              of the sources and then of the targets (excluding the loops)
+    """
+    nodes_count = len(rows)
+    # Occurrences of the nodes, as (node, text) pairs
+    counts = np.diff(indptr)[rows]
+    cell_nodes = np.repeat(np.arange(nodes_count), counts)
+    cell_texts = indices[utils.ranges_concatenation(indptr[rows], counts)]
+    # The same occurrences grouped by texts (the columns of the occurrence matrix)
+    order = np.argsort(cell_texts, kind="mergesort")
+    text_nodes = cell_nodes[order]
+    texts_indptr = np.searchsorted(cell_texts[order],
+                                   np.arange((cell_texts.max() + 2) if len(cell_texts) else 1))
+    cells_indptr = np.concatenate(([0], np.cumsum(counts)))
+
+    block_rows = max(COOCCURRENCES_BLOCK_SIZE // max(nodes_count, 1), 1)
+    for start in xrange(0, nodes_count, block_rows):
+        end = min(start + block_rows, nodes_count)
+        cells = slice(cells_indptr[start], cells_indptr[end])
+        texts = cell_texts[cells]
+        texts_counts = texts_indptr[texts + 1] - texts_indptr[texts]
+        # NOTE(msdubov): For each occurrence of a source node in a text, all the nodes
+        #                occurring in that text get counted as co-occurring with it.
+        sources = np.repeat(cell_nodes[cells] - start, texts_counts)
+        targets = text_nodes[utils.ranges_concatenation(texts_indptr[texts], texts_counts)]
+        cooccurrences = np.bincount(sources * nodes_count + targets,
+                                    minlength=(end - start) * nodes_count)
+        cooccurrences = cooccurrences.reshape(end - start, nodes_count)
+        confidences = (cooccurrences.astype(np.float) /
+                       np.maximum(counts[start:end], 1)[:, np.newaxis])
+        edges = confidences >= referral_confidence
+        edges[np.arange(end - start), np.arange(start, end)] = False
+        sources, targets = np.nonzero(edges)
+        yield sources + start, targets, confidences[sources, targets]
+
+
+def _occurrences(table, relevance_threshold):
+    """Finds the texts each of the keyphrases of the table occurs in (i.e. has a score
+    reaching the relevance threshold for).
+
+    :returns: tuple ({keyphrase: row}, indptr, indices) describing the boolean
+              (keyphrase x text) occurrence matrix in the compressed sparse row format
+    """
+    if isinstance(table, tables.SparseKeyphrasesTable):
+        # NOTE(msdubov): The scores stored in the sparse table have been compared with
+        #                its threshold before they got rounded to float32.
+        if relevance_threshold == table.threshold:
+            indptr, indices = table.indptr, table.indices
+        else:
+            mask = table.data >= relevance_threshold
+            indptr = np.concatenate(([0], np.cumsum(mask)))[table.indptr]
+            indices = table.indices[mask]
+        keyphrases = table.keyphrases
+    elif isinstance(table, tables.KeyphrasesTable):
+        mask = table.scores >= relevance_threshold
+        indptr = np.concatenate(([0], np.cumsum(mask.sum(axis=1))))
+        indices = np.nonzero(mask)[1]
+        keyphrases = table.keyphrases
+    else:
+        keyphrases = table.keys()
+        texts = {text: j for j, text in enumerate(set(itertools.chain.from_iterable(
+                                                          table.itervalues())))}
+        keyphrase_indices = [[texts[text] for text in table[keyphrase]
+                              if table[keyphrase][text] >= relevance_threshold]
+                             for keyphrase in keyphrases]
+        indptr = np.cumsum([0] + [len(row) for row in keyphrase_indices])
+        indices = np.array(list(itertools.chain.from_iterable(keyphrase_indices)),
+                           dtype=np.int64)
+    return ({keyphrase: i for i, keyphrase in enumerate(keyphrases)},
+            np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64))
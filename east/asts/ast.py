@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*
 
 import abc
+import itertools
+
+import numpy as np
 
 from east.asts import base
 from east.asts import utils
@@ -30,47 +33,76 @@ class AnnotatedSuffixTree(base.AST):
         
         """
         
-        query = query.replace(" ", "")
-        result = 0
-        suffix_scores = {}
-    
-        # For each suffix of the string:
-        for suffix_start in xrange(len(query)):
-            
-            suffix = query[suffix_start:]
-            suffix_score = 0
-            suffix_result = 0
-            matched_chars = 0
-            nodes_matched = 0
-            
-            child_node = self.root.chose_arc(suffix)
-            while child_node:
-                nodes_matched += 1
-                (str_ind, substr_start, substr_end) = child_node.arc()
-                match = utils.match_strings(
-                            suffix, self.strings_collection[str_ind][substr_start:substr_end])
-                suffix_score += child_node.conditional_probability()
-                matched_chars += match
-                suffix = suffix[match:]
-                if suffix and match == substr_end - substr_start:
-                    child_node = child_node.chose_arc(suffix)
-                else:
-                    break
-            
-            if matched_chars:
-                suffix_result = (suffix_score + matched_chars - nodes_matched)
-                if normalized:
-                    suffix_result /= matched_chars
-                result += suffix_result
+        if synonimizer:
+            return self._score_synonyms(query, synonimizer, normalized)
+        return self._score(query.replace(" ", ""), normalized, return_suffix_scores)
 
-            suffix_scores[query[suffix_start:]] = suffix_result
-                    
-        result /= len(query)
+    def _serialize(self):
+        # NOTE(msdubov): Nodes get numbered in pre-order, so that parents precede children.
+        nodes = []
+        node_ids = {}
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node_ids[id(node)] = len(nodes)
+            nodes.append(node)
+            stack.extend(node.children.itervalues())
+        return {
+            "strings": utils.encode_string("".join(self.strings_collection)).astype("<u4"),
+            "strings_lengths": np.array([len(string) for string in self.strings_collection],
+                                        dtype=np.int),
+            "parents": np.array([-1] + [node_ids[id(node.parent)] for node in nodes[1:]],
+                                dtype=np.int),
+            "arcs": np.array([(0, 0, 0)] + [node.arc() for node in nodes[1:]],
+                             dtype=np.int).reshape(-1, 3),
+            "weights": np.array([node.weight for node in nodes], dtype=np.int),
+            "suffix_links": np.array([node_ids[id(node.suffix_link)] if node.suffix_link else -1
+                                      for node in nodes], dtype=np.int)
+        }
 
-        if return_suffix_scores:
-            result = result, suffix_scores
-        
-        return result
+    @classmethod
+    def _deserialize(cls, arrays):
+        ast = cls.__new__(cls)
+        strings = utils.decode_string(arrays["strings"])
+        ast.strings_collection = []
+        start = 0
+        for length in arrays["strings_lengths"].tolist():
+            ast.strings_collection.append(strings[start:start + length])
+            start += length
+        strings_collection = utils.make_unique_endings(ast.strings_collection)
+        nodes = []
+        for parent, arc, weight in itertools.izip(arrays["parents"].tolist(),
+                                                  arrays["arcs"].tolist(),
+                                                  arrays["weights"].tolist()):
+            node = AnnotatedSuffixTree.Node()
+            node.strings_collection = strings_collection
+            node.weight = weight
+            if parent >= 0:
+                node._arc = tuple(arc)
+                nodes[parent].add_child(node)
+            nodes.append(node)
+        for node, suffix_link in itertools.izip(nodes, arrays["suffix_links"].tolist()):
+            if suffix_link >= 0:
+                node.suffix_link = nodes[suffix_link]
+        ast.root = nodes[0]
+        ast._update_node_depth()
+        return ast
+
+    def _root(self):
+        return self.root
+
+    def _child(self, node, char):
+        return node.children.get(char)
+
+    def _arc(self, node, child_node):
+        (str_ind, substr_start, substr_end) = child_node.arc()
+        return child_node.strings_collection[str_ind], substr_start, substr_end
+
+    def _conditional_probability(self, node, child_node):
+        return child_node.conditional_probability()
+
+    def _path_scores(self, node):
+        return node.path_probability, node.depth
 
     def traverse_depth_first_pre_order(self, callback):
         """Traverses the annotated suffix tree in depth-first pre-order."""
@@ -90,9 +122,14 @@ class AnnotatedSuffixTree(base.AST):
     
     def _update_node_depth(self):
         self.root.depth = 0
+        self.root.path_probability = 0
         def _calculate_depth(node):
             for k in node.children:
-                node.children[k].depth = node.depth + 1
+                child_node = node.children[k]
+                child_node.depth = node.depth + 1
+                # NOTE(msdubov): Summed in the same order as while matching, from the root.
+                child_node.path_probability = (node.path_probability +
+                                               child_node.conditional_probability())
         self.traverse(_calculate_depth, consts.TraversalOrder.DEPTH_FIRST_PRE_ORDER)
 
     class Node:
@@ -206,3 +206,6 @@ class LinearAnnotatedSuffixTree(ast.AnnotatedSuffixTree):
         _annotate(root)
         
         return root
+
+    def _suffix_link(self, node):
+        return node.suffix_link
@@ -1,22 +1,129 @@
 # -*- coding: utf-8 -*
 
 import abc
+import errno
 import inspect
+import itertools
+import json
+import os
+import shutil
+import tempfile
 
+import numpy as np
+
+from east.asts import utils as ast_utils
 from east import consts
 from east import exceptions
 from east import utils
 
+
+# Version of the on-disk AST format (see AST.save()); to be increased on incompatible changes
+INDEX_FORMAT_VERSION = 2
+
+
 class AST(object):
     __metaclass__ = abc.ABCMeta
 
     @staticmethod
-    def get_ast(strings_collection, ast_algorithm="easa"):
+    def get_ast(strings_collection, ast_algorithm="easa", **kwargs):
+        return AST._get_ast_class(ast_algorithm)(strings_collection, **kwargs)
+
+    @staticmethod
+    def _get_ast_class(ast_algorithm):
         for ast_cls in utils.itersubclasses(AST):
             if not inspect.isabstract(ast_cls) and ast_algorithm == ast_cls.__algorithm__:
-                return ast_cls(strings_collection)
+                return ast_cls
         raise exceptions.NoSuchASTAlgorithm(name=ast_algorithm)
 
+    @staticmethod
+    def load(path, mmap_mode="r"):
+        """Loads an AST saved with save() from the given directory.
+
+        The arrays get memory-mapped by default (see numpy.load()), so that even a huge
+        index opens instantly and its pages get loaded lazily, as they get accessed.
+        """
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            raise exceptions.IndexNotFoundException(path=path)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("format_version") != INDEX_FORMAT_VERSION:
+            raise exceptions.IndexFormatException(version=meta.get("format_version"), path=path)
+        arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode)
+                  for name in meta["arrays"]}
+        return AST._get_ast_class(meta["algorithm"])._deserialize(arrays)
+
+    @staticmethod
+    def is_saved(path):
+        """Checks whether there is an AST of the current format saved in the given directory,
+        without loading it."""
+        try:
+            with open(os.path.join(path, "meta.json")) as f:
+                return json.load(f).get("format_version") == INDEX_FORMAT_VERSION
+        except (IOError, ValueError):
+            return False
+
+    def save(self, path):
+        """Saves the AST to the given directory.
+
+        The directory contains a versioned "meta.json" descriptor and a .npy file
+        for each of the arrays the AST consists of.
+
+        The AST gets written to a temporary directory next to the given one, which then gets
+        renamed, so that neither concurrent save()s of the same AST nor the processes reading
+        (or memory-mapping) an AST saved there ever see partially written files. If there is
+        an AST of the current format in the directory already, it is kept (the paths
+        are supposed to identify the ASTs, e.g. by the hashes of their strings).
+        """
+        parent_path = os.path.dirname(os.path.abspath(path))
+        try:
+            os.makedirs(parent_path)
+        except OSError as e:
+            # NOTE(msdubov): Another process may have created the directory concurrently.
+            if e.errno != errno.EEXIST:
+                raise
+        tmp_path = tempfile.mkdtemp(dir=parent_path, prefix=".tmp-")
+        try:
+            arrays = self._serialize()
+            for name, array in arrays.iteritems():
+                np.save(os.path.join(tmp_path, name + ".npy"), array)
+            with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+                json.dump({"format_version": INDEX_FORMAT_VERSION,
+                           "algorithm": self.__algorithm__,
+                           "arrays": sorted(arrays.keys())}, f)
+            if not AST._rename_directory(tmp_path, path) and not AST.is_saved(path):
+                # NOTE(msdubov): An AST of an old format (or a broken one) gets replaced.
+                old_path = tempfile.mkdtemp(dir=parent_path, prefix=".old-")
+                os.rename(path, old_path)
+                shutil.rmtree(old_path, ignore_errors=True)
+                if not AST._rename_directory(tmp_path, path) and not AST.is_saved(path):
+                    raise exceptions.IndexSaveException(path=path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @staticmethod
+    def _rename_directory(src, dst):
+        """Renames the src directory to dst unless dst is a non-empty directory.
+
+        :returns: True if the directory has been renamed
+        """
+        try:
+            os.rename(src, dst)
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            return False
+
+    @abc.abstractmethod
+    def _serialize(self):
+        """Returns a dictionary {name: numpy array} that fully describes the AST."""
+
+    @classmethod
+    def _deserialize(cls, arrays):
+        """Restores the AST from the arrays returned by _serialize()."""
+        raise NotImplementedError
+
     def __init__(self, strings_collection):
         if not strings_collection:
             raise exceptions.EmptyStringsCollectionException()
@@ -25,6 +132,352 @@ class AST(object):
     def score(self, query, normalized=True, synonimizer=None, return_suffix_scores=False):
         """Computes the matching score for the given string against the AST."""
 
+    def score_many(self, queries, normalized=True, synonimizer=None):
+        """Computes the matching scores for a batch of strings against the AST.
+
+        The queries get deduplicated, and the suffixes of all the queries are matched
+        against the AST at once, by traversing the trie of these suffixes (see
+        utils.QueryTrie) in parallel with the AST; the work for the common prefixes
+        of the suffixes is thus shared. The scores are equal to those of score().
+
+        :param queries: list of strings, or a QueryTrie built for them (which allows
+                        to reuse the trie while scoring the same batch against many ASTs)
+
+        :returns: numpy array of the scores, in the order of the queries
+                  (the score for an empty query is 0)
+        """
+        if isinstance(queries, ast_utils.QueryTrie):
+            trie = queries
+        elif synonimizer:
+            return np.array([self.score(query, normalized, synonimizer) for query in queries])
+        else:
+            trie = ast_utils.QueryTrie(queries)
+
+        suffix_results = np.zeros(trie.slots_count)
+
+        def _suffix_result(suffix_score, matched_chars, nodes_matched):
+            suffix_result = 0
+            if matched_chars:
+                suffix_result = (suffix_score + matched_chars - nodes_matched)
+                if normalized:
+                    suffix_result /= matched_chars
+            return suffix_result
+
+        # State: trie node, AST node, the arc being matched (the AST node is its end; the
+        # current position in the arc is buf[arc_pos] and arc_pos == arc_end at the node),
+        # number of matched characters, sum of conditional probabilities & nodes matched.
+        stack = [(0, self._root(), None, 0, 0, 0, 0, 0)]
+        while stack:
+            (trie_node, node, buf, arc_pos, arc_end,
+             matched_chars, suffix_score, nodes_matched) = stack.pop()
+            suffix_result = _suffix_result(suffix_score, matched_chars, nodes_matched)
+            if trie.slots_own_hi[trie_node] > trie.slots_lo[trie_node]:
+                suffix_results[trie.slots_lo[trie_node]:trie.slots_own_hi[trie_node]] = \
+                    suffix_result
+            for char, trie_child in trie.children[trie_node]:
+                if arc_pos < arc_end:
+                    if buf[arc_pos] == char:
+                        stack.append((trie_child, node, buf, arc_pos + 1, arc_end,
+                                      matched_chars + 1, suffix_score, nodes_matched))
+                        continue
+                else:
+                    child_node = self._child(node, char)
+                    if child_node is not None:
+                        (child_buf, substr_start, substr_end) = self._arc(node, child_node)
+                        stack.append((trie_child, child_node, child_buf, substr_start + 1,
+                                      substr_end, matched_chars + 1,
+                                      suffix_score +
+                                      self._conditional_probability(node, child_node),
+                                      nodes_matched + 1))
+                        continue
+                # NOTE(msdubov): Mismatch: the match stops here for the whole subtree.
+                suffix_results[trie.slots_lo[trie_child]:trie.slots_hi[trie_child]] = \
+                    suffix_result
+
+        # NOTE(msdubov): Summing up in the same order as in _score() gives the same results.
+        suffix_results = suffix_results.tolist()
+        scores = []
+        for query, slots in itertools.izip(trie.queries, trie.query_slots):
+            result = 0
+            for slot in slots:
+                result += suffix_results[slot]
+            scores.append(float(result) / len(query) if query else 0.0)
+        return np.array([scores[query_id] for query_id in trie.query_ids])
+
+    def _score_synonyms(self, query, synonimizer, normalized=True):
+        """Computes the maximum matching score over the variants of the query
+        in which the words get replaced by their synonyms (see _best_query_variants())."""
+        variant = self._best_query_variants(
+                        query, synonimizer, normalized,
+                        lambda string, count: [np.array([suffix_result]) for suffix_result
+                                               in self._suffix_results(string, normalized,
+                                                                       count)])[0]
+        return self._score(variant, normalized) if variant else 0
+
+    def _best_query_variants(self, query, synonimizer, normalized, suffix_results,
+                             documents_count=1):
+        """Finds the best-scoring variant of the query in which each word may be replaced
+        by any of its synonyms, for each of the documents (there is one for an AST).
+
+        The variants form a lattice with a layer of alternatives per word, explored from
+        the last word to the first one. A match starting before a partial variant can only
+        extend into its longest prefix present in the AST, so the scores of the suffixes
+        starting in the preceding words depend on the partial variant only through that
+        prefix (the context). The partial variants with the same context and length thus
+        get merged, keeping the best one for each document; the ones that cannot beat
+        the query itself (by an upper bound on their score) get pruned.
+
+        :param suffix_results: function (string, count) returning the scores of the first
+                               count suffixes of the string (numpy arrays with a score for
+                               each of the documents)
+
+        :returns: list of the best variants, one per document
+        """
+        synonyms = synonimizer.get_synonyms()
+        choices = []
+        for word in utils.tokenize(query):
+            choices.append([word])
+            for synonym in synonyms.get(word, []):
+                if synonym not in choices[-1]:
+                    choices[-1].append(synonym)
+        query = "".join(word_choices[0] for word_choices in choices)
+        if not query:
+            return [query] * documents_count
+        max_match = self._max_match_length()
+
+        # Lower bound: the scores of the query itself
+        best_scores = 0
+        for suffix_result in suffix_results(query, len(query)):
+            best_scores = best_scores + suffix_result
+        best_scores = best_scores / float(len(query))
+        # The shortest and the longest possible lengths of the first k words
+        min_lengths, max_lengths = [0], [0]
+        for word_choices in choices:
+            min_lengths.append(min_lengths[-1] + min(len(choice) for choice in word_choices))
+            max_lengths.append(max_lengths[-1] + max(len(choice) for choice in word_choices))
+
+        # State: (context, length) => (sums of the suffix scores, indices of the best variants)
+        variants = [""]
+        states = {("", 0): (np.zeros(documents_count),
+                            np.zeros(documents_count, dtype=np.int))}
+        for k in xrange(len(choices) - 1, -1, -1):
+            new_states = {}
+            for (context, length), (scores_sums, variant_ids) in states.iteritems():
+                for choice in choices[k]:
+                    string = choice + context
+                    new_scores_sums = scores_sums.copy()
+                    for suffix_result in suffix_results(string, len(choice)):
+                        new_scores_sums += suffix_result
+                    new_length = length + len(choice)
+                    upper_bounds = _variant_score_bounds(new_scores_sums, new_length,
+                                                         min_lengths[k], max_lengths[k],
+                                                         normalized, max_match)
+                    new_scores_sums[upper_bounds <= best_scores] = -np.inf
+                    if np.isneginf(new_scores_sums).all():
+                        continue
+                    ids, inverse = np.unique(variant_ids, return_inverse=True)
+                    new_variant_ids = len(variants) + inverse
+                    variants.extend(choice + variants[i] for i in ids)
+                    key = (string[:self._prefix_match_length(string)], new_length)
+                    if key not in new_states:
+                        new_states[key] = (new_scores_sums, new_variant_ids)
+                    else:
+                        old_scores_sums, old_variant_ids = new_states[key]
+                        better = new_scores_sums > old_scores_sums
+                        old_scores_sums[better] = new_scores_sums[better]
+                        old_variant_ids[better] = new_variant_ids[better]
+            states = new_states
+
+        best_variants = [query] * documents_count
+        for (_, length), (scores_sums, variant_ids) in states.iteritems():
+            scores = scores_sums / length
+            for document in np.flatnonzero(scores > best_scores):
+                best_scores[document] = scores[document]
+                best_variants[document] = variants[variant_ids[document]]
+        return best_variants
+
+    def score_upper_bound(self, query, normalized=True):
+        """Computes an upper bound on the matching score of the string, much faster than score().
+
+        Each suffix of the query that gets matched contributes (p + m - 1) to the sum of
+        the conditional probabilities along its match, where p is the probability of its first
+        character (the annotation of the corresponding child of the root) and m is the length
+        of the match (see _suffix_results()); m is at most the length of the suffix, as well
+        as the length of the longest string in the AST.
+        """
+        query = query.replace(" ", "")
+        if not query:
+            return 0.0
+        max_match = self._max_match_length()
+        result = 0.0
+        for suffix_start in xrange(len(query)):
+            probability = self._first_char_probability(query[suffix_start])
+            if probability:
+                match = min(len(query) - suffix_start, max_match)
+                suffix_result = probability + match - 1
+                if normalized:
+                    suffix_result /= match
+                result += suffix_result
+        # NOTE(msdubov): The bound can be tight, so it should not get below the score
+        #                because of the rounding errors.
+        return result / len(query) * (1 + 1e-9)
+
+    def _first_char_probability(self, char):
+        """Returns the conditional probability of the child of the root whose arc starts
+        with the character (0 if there is no such child)."""
+        if getattr(self, "_first_char_probabilities", None) is None:
+            self._first_char_probabilities = {}
+        if char not in self._first_char_probabilities:
+            root = self._root()
+            child_node = self._child(root, char)
+            self._first_char_probabilities[char] = (
+                self._conditional_probability(root, child_node) if child_node is not None else 0)
+        return self._first_char_probabilities[char]
+
+    def _prefix_match_length(self, string):
+        """Returns the length of the longest prefix of the string present in the AST."""
+        node = self._root()
+        pos = 0
+        while pos < len(string):
+            child_node = self._child(node, string[pos])
+            if child_node is None:
+                break
+            (buf, substr_start, substr_end) = self._arc(node, child_node)
+            match = ast_utils.match_strings(string, buf, pos, substr_start, substr_end)
+            pos += match
+            if match < substr_end - substr_start:
+                break
+            node = child_node
+        return pos
+
+    def _max_match_length(self):
+        """Returns the length of the longest string in the AST, which no match can exceed."""
+        if getattr(self, "_max_match_length_cached", None) is None:
+            self._max_match_length_cached = max(len(string)
+                                                for string in self.strings_collection)
+        return self._max_match_length_cached
+
+    def _score(self, query, normalized=True, return_suffix_scores=False):
+        """Computes the matching score for the string (see _suffix_results()).
+
+        Expects the input string to consist of alphabet letters only (no whitespaces etc.)
+        """
+        result = 0
+        suffix_results = self._suffix_results(query, normalized)
+        for suffix_result in suffix_results:
+            result += suffix_result
+
+        result /= len(query)
+
+        if return_suffix_scores:
+            suffix_scores = {query[suffix_start:]: suffix_result
+                             for suffix_start, suffix_result in enumerate(suffix_results)}
+            result = result, suffix_scores
+
+        return result
+
+    def _suffix_results(self, query, normalized=True, suffixes_count=None):
+        """Computes the scores of the suffixes of the string in a single left-to-right pass.
+
+        The matching score is the average of the scores of all the suffixes of the query,
+        each of which is matched against the AST from the root [Chernyak, sections 1.3 & 1.4].
+        Instead of restarting every match from scratch, the matching statistics of the query
+        are computed: the match of query[s+1:] is at least as long as that of query[s:] minus
+        one character, and that part is known to be present in the AST. It is thus rescanned
+        by skipping whole arcs (the skip/count trick), starting from the suffix link of the
+        previous match where the AST has suffix links. Only the characters past the previous
+        match get compared, so that the comparisons take O(|query|) in total.
+
+        :param suffixes_count: number of the (longest) suffixes to score (all by default)
+
+        :returns: list of the suffix scores, from the longest suffix to the shortest one
+        """
+        suffix_results = []
+        root = self._root()
+        query_len = len(query)
+        # The match of the previous suffix: its length, and the parent node
+        # of the node where the match ended (with its string depth).
+        matched_chars = 0
+        parent_node = None
+        parent_depth = 0
+
+        for suffix_start in xrange(query_len if suffixes_count is None else suffixes_count):
+
+            suffix_link = (self._suffix_link(parent_node)
+                           if matched_chars and parent_depth else None)
+            if suffix_link is None:
+                node, depth = root, 0
+                suffix_score, nodes_matched = 0, 0
+            else:
+                node, depth = suffix_link, parent_depth - 1
+                suffix_score, nodes_matched = self._path_scores(node)
+            # NOTE(msdubov): The suffix is query[pos:], we never copy it.
+            pos = suffix_start + depth
+            known_chars = max(matched_chars - 1 - depth, 0)
+            parent_node, parent_depth = None, 0
+
+            while pos < query_len:
+                child_node = self._child(node, query[pos])
+                if child_node is None:
+                    break
+                (buf, substr_start, substr_end) = self._arc(node, child_node)
+                arc_len = substr_end - substr_start
+                if known_chars >= arc_len:
+                    match = arc_len
+                    known_chars -= arc_len
+                else:
+                    match = known_chars + ast_utils.match_strings(
+                                query, buf, pos + known_chars, substr_start + known_chars,
+                                substr_end)
+                    known_chars = 0
+                suffix_score += self._conditional_probability(node, child_node)
+                nodes_matched += 1
+                parent_node, parent_depth = node, depth
+                node = child_node
+                depth += match
+                pos += match
+                if match < arc_len:
+                    break
+
+            matched_chars = pos - suffix_start
+            suffix_result = 0
+            if matched_chars:
+                suffix_result = (suffix_score + matched_chars - nodes_matched)
+                if normalized:
+                    suffix_result /= matched_chars
+            suffix_results.append(suffix_result)
+
+        return suffix_results
+
+    @abc.abstractmethod
+    def _root(self):
+        """Returns the root node of the AST."""
+
+    @abc.abstractmethod
+    def _child(self, node, char):
+        """Returns the child of the node whose arc starts with the character (or None)."""
+
+    @abc.abstractmethod
+    def _arc(self, node, child_node):
+        """Returns (buffer, substr_start, substr_end) such that buffer[substr_start:substr_end]
+        is the label of the arc from the node to its child."""
+
+    @abc.abstractmethod
+    def _conditional_probability(self, node, child_node):
+        """Returns the conditional probability of the child node given its parent."""
+
+    def _suffix_link(self, node):
+        """Returns the suffix link of an internal node, or None if the AST has no suffix links."""
+        return None
+
+    def _path_scores(self, node):
+        """Returns the sum of the conditional probabilities on the path from the root
+        to the node, along with the number of nodes on that path (except for the root).
+
+        Has to be implemented by the ASTs having suffix links.
+        """
+        raise NotImplementedError
+
     def traverse(self, callback, order=consts.TraversalOrder.DEPTH_FIRST_PRE_ORDER):        
         if order == consts.TraversalOrder.DEPTH_FIRST_PRE_ORDER:
             self.traverse_depth_first_pre_order(callback)
@@ -44,3 +497,20 @@ class AST(object):
     @abc.abstractmethod
     def traverse_breadth_first(self, callback):
         """Traverses the annotated suffix tree in breadth-first order."""
+
+
+def _variant_score_bounds(scores_sums, length, min_prefix_length, max_prefix_length,
+                          normalized, max_match):
+    """Upper bounds on the scores of the variants ending with a partial variant
+    of the given length and sums of suffix scores, that are yet to be prefixed
+    with min_prefix_length..max_prefix_length more characters."""
+    if normalized:
+        # NOTE(msdubov): A normalized suffix score is at most 1, and the bound
+        #                (S + x) / (L + x) grows with x since S <= L.
+        return (scores_sums + max_prefix_length) / float(length + max_prefix_length)
+    # NOTE(msdubov): A denormalized suffix score is at most the length of the match.
+    prefix_lengths = np.arange(min_prefix_length, max_prefix_length + 1)
+    max_scores = np.concatenate(([0], np.cumsum(np.minimum(
+                     np.arange(length + 1, length + max_prefix_length + 1), max_match))))
+    return ((scores_sums[:, np.newaxis] + max_scores[prefix_lengths]) /
+            (length + prefix_lengths).astype(np.float)).max(axis=1)
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*
+
+import itertools
+import json
+import os
+import shutil
+
+import numpy as np
+
+from east.asts import base
+from east.asts import easa
+from east.asts import utils
+from east import consts
+from east import exceptions
+
+
+class CorpusEnhancedAnnotatedSuffixArray(easa.EnhancedAnnotatedSuffixArray):
+    """Generalized EASA over the strings of a whole collection of documents.
+
+    Scoring a query against each document with a separate AST repeats the descent
+    for every document. Here, the strings of all the documents share one EASA,
+    and the occurrence counts of an lcp interval in each of the documents get
+    computed from the interval bounds, so that a single descent per query suffix
+    yields the scores for all the documents at once (see score_documents()).
+
+    The per-document counts are not stored for every interval. Instead, the suffix
+    array ranks of the suffixes of each document are stored in a sorted table
+    (doctab, with doc * (n + 1) + rank entries); the number of suffixes of a document
+    within an interval [i..j] is then found by bisection in O(log n).
+
+    NOTE(msdubov): Every string in the collection gets a unique ending, coded above
+                   all the Unicode characters (see easa.STRING_ENDINGS_START), so that
+                   the number of strings is not limited by the characters of the texts.
+    """
+
+    __algorithm__ = consts.ASTAlgorithm.CORPUS_EASA
+
+    def __init__(self, strings_collection, strings_documents=None, **kwargs):
+        """
+        :param strings_documents: the index of the document each string belongs to
+                                  (all the strings make up a single document by default)
+        """
+        super(CorpusEnhancedAnnotatedSuffixArray, self).__init__(strings_collection, **kwargs)
+        if strings_documents is None:
+            strings_documents = [0] * len(strings_collection)
+        self.strings_documents = np.array(strings_documents, dtype=np.int)
+        self.doctab, self.doc_lengths = self._compute_doctab()
+
+    @classmethod
+    def from_documents(cls, documents, **kwargs):
+        """Builds the index for a list of documents, each being a strings collection."""
+        strings_collection = list(itertools.chain.from_iterable(documents))
+        strings_documents = list(itertools.chain.from_iterable(
+                                    [doc] * len(strings) for doc, strings in enumerate(documents)))
+        return cls(strings_collection, strings_documents, **kwargs)
+
+    def score_documents(self, query, normalized=True, synonimizer=None, documents=None):
+        """Computes the matching scores of the query against each of the documents.
+
+        The scores are equal to those of an EnhancedAnnotatedSuffixArray built for
+        the strings of each document separately.
+
+        :param documents: the indices of the documents to score the query against
+                          (all the documents by default)
+
+        :returns: numpy array of the scores, in the order of the documents
+        """
+        documents = self._documents(documents)
+        if synonimizer:
+            # NOTE(msdubov): The best variant of the query may differ from one document
+            #                to another; each of them gets scored once for its documents.
+            variants = self._best_query_variants(
+                            query, synonimizer, normalized,
+                            lambda string, count: self._documents_suffix_results(
+                                                      string, normalized, count, documents),
+                            len(documents))
+            res = np.zeros(len(documents))
+            for variant in set(variants):
+                positions = [k for k, doc_variant in enumerate(variants)
+                             if doc_variant == variant]
+                res[positions] = self._score_documents(variant, normalized,
+                                                       documents[positions])
+            return res
+        else:
+            return self._score_documents(query.replace(" ", ""), normalized, documents)
+
+    def score_documents_many(self, queries, normalized=True, synonimizer=None, documents=None):
+        """Computes the matching scores of a batch of queries against each of the documents.
+
+        :param documents: the indices of the documents to score the queries against
+                          (all the documents by default)
+
+        :returns: numpy array of shape (len(queries), number of documents)
+        """
+        documents = self._documents(documents)
+        scores = {}
+        res = np.zeros((len(queries), len(documents)))
+        for k, query in enumerate(queries):
+            if query not in scores:
+                scores[query] = self.score_documents(query, normalized, synonimizer, documents)
+            res[k] = scores[query]
+        return res
+
+    def _documents(self, documents=None):
+        if documents is None:
+            return np.arange(len(self.doc_lengths))
+        return np.asarray(documents, dtype=np.int)
+
+    def _score_documents(self, query, normalized=True, documents=None):
+        """Computes the matching scores of the query against the documents at once."""
+        documents = self._documents(documents)
+        result = np.zeros(len(documents))
+        if not query:
+            return result
+        for suffix_results in self._documents_suffix_results(query, normalized,
+                                                             documents=documents):
+            result += suffix_results
+        result /= len(query)
+        return result
+
+    def _documents_suffix_results(self, query, normalized=True, suffixes_count=None,
+                                  documents=None):
+        """Computes the matching statistics of the query against all the documents at once.
+
+        Follows the same descent as _score(). Along the way, the documents that stop
+        containing the current prefix of the suffix drop out. For each remaining document,
+        the ratio of its occurrence counts in the child and in the parent interval gets
+        added. This happens only where the count drops, i.e. where the AST of that document
+        alone would have a node, and at the root. The per-document sums are thus exactly
+        the ones of the separate ASTs, and so are the scores.
+
+        :param documents: the indices of the documents to compute the statistics for
+                          (all the documents by default); only these get their occurrence
+                          counts looked up.
+
+        :returns: list of the suffix scores (numpy arrays with a score for each document),
+                  from the longest suffix to the shortest one
+        """
+        all_documents = self._documents(documents)
+        documents_count = len(all_documents)
+        documents_lengths = self.doc_lengths[all_documents]
+        query_len = len(query)
+        all_suffix_results = []
+        # NOTE(msdubov): The arrays below are indexed by the positions of the documents
+        #                in all_documents, not by the documents themselves.
+        all_positions = np.arange(documents_count)
+        root = self._root()
+        matched_chars = 0
+
+        for suffix_start in xrange(query_len if suffixes_count is None else suffixes_count):
+
+            node, depth = root, 0
+            pos = suffix_start
+            known_chars = max(matched_chars - 1, 0)
+            # The documents still containing the matched prefix, with their occurrence counts
+            positions, counts = all_positions, documents_lengths
+            suffix_scores = np.zeros(documents_count)
+            nodes_matched = np.zeros(documents_count, dtype=np.int)
+            documents_matched_chars = np.zeros(documents_count, dtype=np.int)
+
+            while pos < query_len:
+                child_node = self._child(node, query[pos])
+                if child_node is None:
+                    break
+                (buf, substr_start, substr_end) = self._arc(node, child_node)
+                arc_len = substr_end - substr_start
+                if known_chars >= arc_len:
+                    match = arc_len
+                    known_chars -= arc_len
+                else:
+                    match = known_chars + utils.match_strings(
+                                query, buf, pos + known_chars, substr_start + known_chars,
+                                substr_end)
+                    known_chars = 0
+                child_counts = self._documents_counts(child_node, all_documents[positions])
+                present = child_counts > 0
+                if node is not root:
+                    branching = present & (child_counts < counts)
+                else:
+                    branching = present
+                suffix_scores[positions[branching]] += (
+                    child_counts[branching].astype(np.float) / counts[branching])
+                nodes_matched[positions[branching]] += 1
+                positions, counts = positions[present], child_counts[present]
+                node = child_node
+                depth += match
+                pos += match
+                documents_matched_chars[positions] = depth
+                if match < arc_len:
+                    break
+
+            matched_chars = pos - suffix_start
+            matched = documents_matched_chars > 0
+            suffix_results = np.zeros(documents_count)
+            suffix_results[matched] = (suffix_scores[matched] +
+                                       documents_matched_chars[matched] -
+                                       nodes_matched[matched])
+            if normalized:
+                suffix_results[matched] /= documents_matched_chars[matched]
+            all_suffix_results.append(suffix_results)
+
+        return all_suffix_results
+
+    def _documents_counts(self, lcp_interval, documents):
+        """Returns the numbers of suffixes of the documents within the lcp interval."""
+        keys = documents * (len(self.suftab) + 1)
+        # NOTE(msdubov): The keys get the dtype of the table, so that numpy
+        #                does not have to convert the whole table.
+        return (np.searchsorted(self.doctab,
+                                (keys + (lcp_interval[2] + 1)).astype(self.doctab.dtype)) -
+                np.searchsorted(self.doctab,
+                                (keys + lcp_interval[1]).astype(self.doctab.dtype)))
+
+    def _compute_doctab(self):
+        """Computes the table of document suffixes along with the lengths of the documents.
+
+        The length of a document (the number of its characters, without the unique
+        endings) is also the annotation of the root in the AST of that document alone.
+        """
+        n = len(self.suftab)
+        documents_count = self.strings_documents.max() + 1
+        positions_documents = np.repeat(self.strings_documents,
+                                        [len(string) + 1 for string in self.strings_collection])
+        ranks_documents = positions_documents[self.suftab]
+        order = np.argsort(ranks_documents, kind="mergesort")
+        doctab = ranks_documents[order] * (n + 1) + order
+        doc_lengths = np.bincount(self.strings_documents,
+                                  weights=[len(string) for string in self.strings_collection],
+                                  minlength=documents_count).astype(np.int)
+        return (doctab.astype(utils.compact_dtype(documents_count * (n + 1))),
+                doc_lengths.astype(utils.compact_dtype(n)))
+
+    def _serialize(self):
+        arrays = super(CorpusEnhancedAnnotatedSuffixArray, self)._serialize()
+        arrays.update({
+            "strings_documents": self.strings_documents,
+            "doctab": self.doctab,
+            "doc_lengths": self.doc_lengths
+        })
+        return arrays
+
+    @classmethod
+    def _deserialize(cls, arrays):
+        ast = super(CorpusEnhancedAnnotatedSuffixArray, cls)._deserialize(arrays)
+        for name in ("strings_documents", "doctab", "doc_lengths"):
+            setattr(ast, name, arrays[name])
+        return ast
+
+
+class SegmentedCorpusIndex(object):
+    """Corpus index that grows without full rebuilds.
+
+    The documents are spread over a log-structured list of segments, each being
+    a CorpusEnhancedAnnotatedSuffixArray over some of the documents. New strings
+    make up a new segment, and the last two segments get merged (i.e. rebuilt as one)
+    while the older one is less than merge_factor times larger than the newer one.
+    The segments thus get geometrically smaller from the oldest to the newest, there are
+    O(log n) of them, and each character gets re-indexed O(log n) times in total.
+
+    The score of a query against a document only depends on the strings of that document,
+    so the scores of the segments just get concatenated; they are equal to the scores
+    of a single index rebuilt from scratch for all the strings.
+    """
+
+    class Segment(object):
+
+        def __init__(self, name, index, documents):
+            self.name = name
+            # CorpusEnhancedAnnotatedSuffixArray with the local document indices
+            self.index = index
+            # Global indices of the documents in the segment (sorted)
+            self.documents = documents
+
+        def __len__(self):
+            return len(self.index.suftab)
+
+    def __init__(self, merge_factor=2, **kwargs):
+        """
+        :param merge_factor: minimum ratio between the sizes of consecutive segments
+        :param kwargs: the CorpusEnhancedAnnotatedSuffixArray construction parameters
+        """
+        self.merge_factor = merge_factor
+        self.index_kwargs = kwargs
+        self.segments = []
+        self.documents_count = 0
+        self._segments_created = 0
+
+    def add_documents(self, documents):
+        """Adds new documents (each being a strings collection) to the index."""
+        first_document = self.documents_count
+        self.add_strings(list(itertools.chain.from_iterable(documents)),
+                         list(itertools.chain.from_iterable(
+                             [first_document + doc] * len(strings)
+                             for doc, strings in enumerate(documents))))
+        self.documents_count = max(self.documents_count, first_document + len(documents))
+
+    def add_strings(self, strings_collection, strings_documents=None):
+        """Adds strings to the index.
+
+        :param strings_documents: the index of the document each string belongs to
+                                  (by default, the strings make up a new document).
+                                  The strings can also be added to the documents that are
+                                  already in the index; the segments holding these documents
+                                  then get rebuilt along with the new strings.
+        """
+        if not strings_collection:
+            return
+        if strings_documents is None:
+            strings_documents = [self.documents_count] * len(strings_collection)
+        documents = np.unique(strings_documents)
+        affected = [segment for segment in self.segments
+                    if np.in1d(segment.documents, documents, assume_unique=True).any()]
+        self.segments = [segment for segment in self.segments if segment not in affected]
+        self.segments.append(self._merge_segments(affected, strings_collection,
+                                                  strings_documents))
+        self.documents_count = max(self.documents_count, int(documents[-1]) + 1)
+        while (len(self.segments) > 1 and
+                len(self.segments[-2]) < self.merge_factor * len(self.segments[-1])):
+            self.segments[-2:] = [self._merge_segments(self.segments[-2:])]
+
+    def score_documents(self, query, normalized=True, synonimizer=None):
+        """Computes the matching scores of the query against each of the documents.
+
+        :returns: numpy array of the scores, in the order of the documents
+        """
+        res = np.zeros(self.documents_count)
+        for segment in self.segments:
+            res[segment.documents] = segment.index.score_documents(query, normalized,
+                                                                   synonimizer)
+        return res
+
+    def score_documents_many(self, queries, normalized=True, synonimizer=None):
+        """Computes the matching scores of a batch of queries against each of the documents.
+
+        :returns: numpy array of shape (len(queries), number of documents)
+        """
+        res = np.zeros((len(queries), self.documents_count))
+        for segment in self.segments:
+            res[:, segment.documents] = segment.index.score_documents_many(
+                                            queries, normalized, synonimizer)
+        return res
+
+    @staticmethod
+    def load(path, mmap_mode="r"):
+        """Loads an index saved with save() from the given directory."""
+        meta_path = os.path.join(path, "segments.json")
+        if not os.path.exists(meta_path):
+            raise exceptions.IndexNotFoundException(path=path)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("format_version") != base.INDEX_FORMAT_VERSION:
+            raise exceptions.IndexFormatException(version=meta.get("format_version"), path=path)
+        index = SegmentedCorpusIndex(meta["merge_factor"], **meta["index_kwargs"])
+        index.documents_count = meta["documents_count"]
+        index._segments_created = meta["segments_created"]
+        index.segments = [
+            SegmentedCorpusIndex.Segment(
+                segment["name"],
+                base.AST.load(os.path.join(path, segment["name"]), mmap_mode),
+                np.array(segment["documents"], dtype=np.int))
+            for segment in meta["segments"]]
+        return index
+
+    def save(self, path):
+        """Saves the index to the given directory (created if it does not exist).
+
+        Each segment is saved as an AST to a subdirectory; only the segments that are
+        not in the directory yet get written, and the merged ones get removed.
+        """
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for segment in self.segments:
+            if not os.path.exists(os.path.join(path, segment.name, "meta.json")):
+                segment.index.save(os.path.join(path, segment.name))
+        meta = {
+            "format_version": base.INDEX_FORMAT_VERSION,
+            "merge_factor": self.merge_factor,
+            "index_kwargs": self.index_kwargs,
+            "documents_count": self.documents_count,
+            "segments_created": self._segments_created,
+            "segments": [{"name": segment.name, "documents": segment.documents.tolist()}
+                         for segment in self.segments]
+        }
+        # NOTE(msdubov): The descriptor gets replaced atomically, so that an interrupted
+        #                save() leaves the previous version of the index intact.
+        meta_path = os.path.join(path, "segments.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.rename(meta_path + ".tmp", meta_path)
+        names = set(segment.name for segment in self.segments)
+        for name in os.listdir(path):
+            if name.startswith("segment-") and name not in names:
+                shutil.rmtree(os.path.join(path, name))
+
+    def _merge_segments(self, segments, strings_collection=(), strings_documents=()):
+        """Builds a new segment for the strings of the segments along with the given strings."""
+        all_strings_collection, all_strings_documents = [], []
+        for segment in segments:
+            all_strings_collection.extend(segment.index.strings_collection)
+            all_strings_documents.extend(
+                segment.documents[segment.index.strings_documents].tolist())
+        all_strings_collection.extend(strings_collection)
+        all_strings_documents.extend(strings_documents)
+        documents = np.unique(all_strings_documents)
+        index = CorpusEnhancedAnnotatedSuffixArray(
+                    all_strings_collection, np.searchsorted(documents, all_strings_documents),
+                    **self.index_kwargs)
+        self._segments_created += 1
+        return SegmentedCorpusIndex.Segment("segment-%i" % self._segments_created,
+                                            index, documents)
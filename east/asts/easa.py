@@ -6,32 +6,49 @@ import numpy as np
 from east.asts import base
 from east.asts import utils
 from east import consts
-from east import utils as common_utils
+from east import exceptions
+
+
+# Maximum number of characters compared at once while computing the LCP array
+LCP_BLOCK_SIZE = 2 ** 22
+# Number of characters compared for each pair of suffixes in the first pass over the LCP array;
+# the next passes compare twice as many characters as the previous ones for the pairs left,
+# as long as that takes no more work than the first pass
+LCP_INITIAL_WIDTH = 8
+# Code of the unique ending of the first string of the collection (the next strings get
+# the next codes); the codes are above those of all the Unicode characters, so that
+# no ending can occur in the strings themselves
+STRING_ENDINGS_START = 0x110000
+# Character standing for the unique endings of the strings in the string of the collection
+STRING_ENDING = u"\u0000"
 
 
 class EnhancedAnnotatedSuffixArray(base.AST):
 
     __algorithm__ = consts.ASTAlgorithm.EASA
 
-    def __init__(self, strings_collection):
+    def __init__(self, strings_collection,
+                 suftab_algorithm=consts.SuffixArrayAlgorithm.PREFIX_DOUBLING,
+                 compact_lcptab=False):
         super(EnhancedAnnotatedSuffixArray, self).__init__(strings_collection)
         self.strings_collection = strings_collection
-        self.string = "".join(utils.make_unique_endings(strings_collection))
-        self.suftab = self._compute_suftab(self.string)
-        self.lcptab = self._compute_lcptab(self.string, self.suftab)
-        self.childtab_up, self.childtab_down = self._compute_childtab(self.lcptab)
-        self.childtab_next_l_index = self._compute_childtab_next_l_index(self.lcptab)
+        # NOTE(msdubov): The endings only get their unique codes in the integer
+        #                representation of the string (see _string_codes()).
+        self.string = "".join(string + STRING_ENDING for string in strings_collection)
+        self.string_endings = self._strings_bounds()[:, 1]
+        codes = self._string_codes()
+        self.suftab = self._compute_suftab(codes, suftab_algorithm)
+        self.lcptab = self._compute_lcptab(codes, self.suftab)
+        (self.childtab_up, self.childtab_down,
+         self.childtab_next_l_index) = self._compute_childtab(self.lcptab)
+        (self.childtab_ptr, self.childtab_chars,
+         self.childtab_lbs) = self._compute_childtab_lookup()
         self.anntab = self._compute_anntab(self.suftab, self.lcptab)
+        self._compact_tables(compact_lcptab)
 
     def score(self, query, normalized=True, synonimizer=None, return_suffix_scores=False):
         if synonimizer:
-            synonyms = synonimizer.get_synonyms()
-            query_words = common_utils.tokenize(query)
-            for i in xrange(len(query_words)):
-                query_words[i] = synonyms[query_words[i]] + [query_words[i]]
-            possible_queries = map(lambda words: "".join(words),
-                                   itertools.product(*query_words))
-            return max(self._score(q) for q in possible_queries)
+            return self._score_synonyms(query, synonimizer, normalized)
         else:
             return self._score(query.replace(" ", ""), normalized, return_suffix_scores)
 
@@ -41,18 +58,12 @@ class EnhancedAnnotatedSuffixArray(base.AST):
         Based on Abouelhoda et al. (2004).
         """
         n = len(self.suftab)
-        root = [0, 0, n - 1, ""]  # <l, i, j, char>
-
-        def _traverse_top_down(interval):  # TODO: Rewrite with stack? As in bottom-up
+        stack = [[0, 0, n - 1, ""]]  # <l, i, j, char>
+        while stack:
+            interval = stack.pop()
             callback(interval)
-            i, j = interval[1], interval[2]
-            if i != j:
-                children = self._get_child_intervals(i, j)
-                children.sort(key=lambda child: child[3])
-                for child in children:
-                    _traverse_top_down(child)
-
-        _traverse_top_down(root)
+            # NOTE(msdubov): Child intervals already come sorted by their first character.
+            stack.extend(reversed(self._get_child_intervals(interval[1], interval[2])))
 
     def traverse_depth_first_post_order(self, callback):
         """Visits the internal "nodes" of the enhanced suffix array in depth-first post-order.
@@ -67,20 +78,21 @@ class EnhancedAnnotatedSuffixArray(base.AST):
         stack = [[0, 0, None, []]]  # <l, i, j, children>
         for i in xrange(1, n):
             lb = i - 1
-            while self.lcptab[i] < stack[-1][0]:
+            lcp = int(self.lcptab[i])
+            while lcp < stack[-1][0]:
                 stack[-1][2] = i - 1
                 last_interval = stack.pop()
                 callback(last_interval)
                 lb = last_interval[1]
-                if self.lcptab[i] <= stack[-1][0]:
+                if lcp <= stack[-1][0]:
                     stack[-1][3].append(last_interval)
                     last_interval = None
-            if self.lcptab[i] > stack[-1][0]:
+            if lcp > stack[-1][0]:
                 if last_interval:
-                    stack.append([self.lcptab[i], lb, None, [last_interval]])
+                    stack.append([lcp, lb, None, [last_interval]])
                     last_interval = None
                 else:
-                    stack.append([self.lcptab[i], lb, None, []])
+                    stack.append([lcp, lb, None, []])
         stack[-1][2] = n - 1
         callback(stack[-1])
 
@@ -88,65 +100,151 @@ class EnhancedAnnotatedSuffixArray(base.AST):
         """Visits the internal "nodes" of the enhanced suffix array in breadth-first order."""
         raise NotImplementedError
 
-    def _score(self, query, normalized=True, return_suffix_scores=False):
-        result = 0
-        suffix_scores = {}
-        n = len(self.suftab)
+    def _compact_tables(self, compact_lcptab=False):
+        """Stores each table in the narrowest integer dtype its values fit in.
 
-        root_interval = (0, 0, n - 1)
-    
-        for suffix_start in xrange(len(query)):
-            
-            suffix = query[suffix_start:]
-            suffix_score = 0
-            suffix_result = 0
-            matched_chars = 0
-            nodes_matched = 0
-            
-            parent_node = root_interval
-            child_node = self._get_child_interval(parent_node[1], parent_node[2], suffix[0])
-            while child_node:
-                nodes_matched += 1
-                # TODO: Use structs??? child_node[1] is actually cn.i; parent_node[0] == pn.l
-                substr_start = self.suftab[child_node[1]] + parent_node[0]
-                if self._is_leaf(child_node):
-                    substr_end = n
-                else:
-                    substr_end = substr_start + child_node[0] - parent_node[0]
-                match = utils.match_strings(suffix, self.string[substr_start:substr_end])
-                suffix_score += float(self._annotation(child_node)) / self._annotation(parent_node)
-                matched_chars += match
-                suffix = suffix[match:]
-                if suffix and match == substr_end - substr_start:
-                    parent_node = child_node
-                    child_node = self._get_child_interval(parent_node[1], parent_node[2], suffix[0])
-                else:
-                    break
+        :param compact_lcptab: whether to store the LCP values in one byte each,
+                               with an overflow table for the values >= 255
+                               (see utils.CompactIntArray).
+        """
+        n = len(self.suftab)
+        # NOTE(msdubov): The index tables leave room for n + 1, so that
+        #                the index arithmetic (e.g. "j + 1") never overflows.
+        index_dtype = utils.compact_dtype(n + 1)
+        for name in ("suftab", "childtab_up", "childtab_down", "childtab_next_l_index",
+                     "childtab_lbs", "anntab", "string_endings"):
+            setattr(self, name, getattr(self, name).astype(index_dtype))
+        self.childtab_ptr = self.childtab_ptr.astype(
+                                utils.compact_dtype(self.childtab_ptr[-1] + 1))
+        self.childtab_chars = self.childtab_chars.astype(
+                                utils.compact_dtype(self.childtab_chars.max()))
+        if compact_lcptab:
+            self.lcptab = utils.CompactIntArray.from_array(self.lcptab)
+        else:
+            self.lcptab = self.lcptab.astype(utils.compact_dtype(self.lcptab.max()))
+
+    def _serialize(self):
+        if isinstance(self.lcptab, utils.CompactIntArray):
+            lcptab = {
+                "lcptab": self.lcptab.values,
+                "lcptab_overflow_indices": self.lcptab.overflow_indices,
+                "lcptab_overflow_values": self.lcptab.overflow_values
+            }
+        else:
+            lcptab = {"lcptab": self.lcptab}
+        return dict(lcptab, **{
+            "string": utils.encode_string(self.string).astype("<u4"),
+            "strings_bounds": self._strings_bounds(),
+            "suftab": self.suftab,
+            "childtab_up": self.childtab_up,
+            "childtab_down": self.childtab_down,
+            "childtab_next_l_index": self.childtab_next_l_index,
+            "childtab_ptr": self.childtab_ptr,
+            "childtab_chars": self.childtab_chars,
+            "childtab_lbs": self.childtab_lbs,
+            "anntab": self.anntab
+        })
+
+    @classmethod
+    def _deserialize(cls, arrays):
+        ast = cls.__new__(cls)
+        # NOTE(msdubov): Only the string gets decoded; all the tables stay memory-mapped.
+        ast.string = utils.decode_string(arrays["string"])
+        ast.strings_collection = [ast.string[start:end]
+                                  for start, end in arrays["strings_bounds"].tolist()]
+        ast.string_endings = arrays["strings_bounds"][:, 1]
+        for name in ("suftab", "lcptab", "childtab_up", "childtab_down",
+                     "childtab_next_l_index", "childtab_ptr", "childtab_chars",
+                     "childtab_lbs", "anntab"):
+            setattr(ast, name, arrays[name])
+        if "lcptab_overflow_indices" in arrays:
+            ast.lcptab = utils.CompactIntArray(arrays["lcptab"],
+                                               arrays["lcptab_overflow_indices"],
+                                               arrays["lcptab_overflow_values"])
+        return ast
+
+    def _strings_bounds(self):
+        """Returns the [start, end) bounds of the strings of the collection in self.string."""
+        bounds = []
+        start = 0
+        for string in self.strings_collection:
+            bounds.append((start, start + len(string)))
+            start += len(string) + 1
+        return np.array(bounds, dtype=np.int).reshape(-1, 2)
+
+    def _string_codes(self):
+        """Returns the integer codes of the characters of the string of the collection,
+        with the unique codes of the endings of the strings (see STRING_ENDINGS_START)."""
+        codes = utils.encode_string(self.string).astype(np.int64)
+        codes[self.string_endings] = STRING_ENDINGS_START + np.arange(len(self.string_endings))
+        return codes
+
+    def _root(self):
+        return (0, 0, len(self.suftab) - 1, "")  # <l, i, j, char>
+
+    def _child(self, node, char):
+        return self._get_child_interval(node[1], node[2], char)
+
+    def _arc(self, node, child_node):
+        substr_start = int(self.suftab[child_node[1]]) + node[0]
+        if self._is_leaf(child_node):
+            # NOTE(msdubov): The arc ends with the string, just before its unique ending.
+            substr_end = int(self.string_endings[
+                                 self.string_endings.searchsorted(substr_start)])
+        else:
+            substr_end = substr_start + child_node[0] - node[0]
+        return self.string, substr_start, substr_end
 
-            if matched_chars:
-                suffix_result = (suffix_score + matched_chars - nodes_matched)
-                if normalized:
-                    suffix_result /= matched_chars
-                result += suffix_result
+    def _conditional_probability(self, node, child_node):
+        return float(self._annotation(child_node)) / self._annotation(node)
 
-            suffix_scores[query[suffix_start:]] = suffix_result
-            
-        result /= len(query)
+    def _compute_suftab(self, codes,
+                        algorithm=consts.SuffixArrayAlgorithm.PREFIX_DOUBLING):
+        """Computes the suffix array of a string given as the array of its character codes."""
+        if algorithm == consts.SuffixArrayAlgorithm.PREFIX_DOUBLING:
+            return self._compute_suftab_prefix_doubling(codes)
+        elif algorithm == consts.SuffixArrayAlgorithm.KARKKAINEN_SANDERS:
+            return self._compute_suftab_karkkainen_sanders(codes)
+        raise exceptions.NoSuchSuffixArrayAlgorithm(name=algorithm)
 
-        if return_suffix_scores:
-            result = result, suffix_scores
+    def _compute_suftab_prefix_doubling(self, codes):
+        """Computes the suffix array of a string in O(n log n) by prefix doubling.
 
-        return result
+        Each of the O(log n) rounds is a vectorized sort of the suffixes by the (integer)
+        ranks of their first 2^k characters, so that no per-character Python code is run.
 
-    def _compute_suftab(self, string):
+        Manber & Myers (1993).
+        """
+        n = len(codes)
+        # NOTE(msdubov): Ranks of the single characters, in [0..n-1].
+        rank = np.unique(codes, return_inverse=True)[1].astype(np.int64)
+        k = 1
+        while True:
+            # Rank of the suffix starting k characters later (-1 past the end of the string)
+            next_rank = np.full(n, -1, dtype=np.int64)
+            next_rank[:max(n - k, 0)] = rank[k:]
+            # NOTE(msdubov): Ranks are < n, so the pair fits into a single int64 sorting key.
+            keys = rank * (n + 1) + (next_rank + 1)
+            suftab = np.argsort(keys)
+            sorted_keys = keys[suftab]
+            rank = np.empty(n, dtype=np.int64)
+            rank[suftab[0]] = 0
+            rank[suftab[1:]] = np.cumsum(sorted_keys[1:] != sorted_keys[:-1])
+            if rank[suftab[-1]] == n - 1 or k >= n:
+                break
+            k *= 2
+        return suftab.astype(np.int)
+
+    def _compute_suftab_karkkainen_sanders(self, codes):
         """Computes the suffix array of a string in O(n).
 
         The code is based on that from the pysuffix library (https://code.google.com/p/pysuffix/).
 
         Kärkkäinen & Sanders (2003).
         """
-        n = len(string)
-        string += (unichr(1) * 3)
+        n = len(codes)
+        # NOTE(msdubov): The codes get shifted, so that the padding is less than all of them.
+        string = (np.asarray(codes) + 1).tolist() + [0] * 3
         suftab = np.zeros(n, dtype=np.int)
         alpha = sorted(set(string))
         self._kark_sort(string, suftab, n, alpha)
@@ -244,64 +342,151 @@ class EnhancedAnnotatedSuffixArray(base.AST):
 
         return b
 
-    def _compute_lcptab(self, string, suftab):
-        """Computes the LCP array in O(n) based on the input string & its suffix array.
+    def _compute_lcptab(self, codes, suftab):
+        """Computes the LCP array based on the input string (its character codes)
+        & its suffix array.
+
+        The common prefixes of all the pairs of adjacent suffixes get compared at once,
+        in blocks of characters of a growing width (and in chunks of pairs, to bound
+        the memory usage), as long as a pass takes O(n) vectorized work; that resolves
+        most of the pairs in natural texts. The pairs with long common prefixes left after
+        that (as in repetitive strings) get resolved by Kasai's algorithm, which reuses
+        the values already known. That takes O(n log n) vectorized work plus O(n) steps
+        of Kasai's algorithm in the worst case.
 
         Kasai et al. (2001).
         """
         n = len(suftab)
-        rank = [0] * n
-        for i in xrange(n):
-            rank[suftab[i]] = i
         lcptab = np.zeros(n, dtype=np.int)
+        # Indices k of the adjacent suffix pairs (k-1, k) with the LCP value still unknown
+        pending = np.arange(1, n)
+        offset = 0
+        width = LCP_INITIAL_WIDTH
+        while len(pending):
+            if len(pending) * width > LCP_INITIAL_WIDTH * n:
+                return self._compute_lcptab_kasai(codes, suftab, lcptab, pending, offset)
+            unresolved = []
+            chunk = max(LCP_BLOCK_SIZE // width, 1)
+            columns = offset + np.arange(width)
+            for start in xrange(0, len(pending), chunk):
+                k = pending[start:start + chunk]
+                # NOTE(msdubov): Clipping is safe since, due to the unique string endings,
+                #                the first mismatch always occurs within the string.
+                left = np.minimum(suftab[k - 1][:, np.newaxis] + columns, n - 1)
+                right = np.minimum(suftab[k][:, np.newaxis] + columns, n - 1)
+                mismatch = codes[left] != codes[right]
+                found = mismatch.any(axis=1)
+                lcptab[k[found]] = offset + mismatch[found].argmax(axis=1)
+                unresolved.append(k[~found])
+            pending = np.concatenate(unresolved)
+            offset += width
+            width *= 2
+        return lcptab
+
+    def _compute_lcptab_kasai(self, codes, suftab, lcptab, pending, offset):
+        """Completes the LCP array with Kasai's algorithm, given the pending pairs
+        of adjacent suffixes (see _compute_lcptab()) with the LCP values of at least offset."""
+        n = len(suftab)
+        rank = np.empty(n, dtype=np.int)
+        rank[suftab] = np.arange(n)
+        is_pending = np.zeros(n, dtype=np.bool)
+        is_pending[pending] = True
+        # NOTE(msdubov): Indexing python lists is much faster than numpy arrays here.
+        s = codes.tolist()
+        sa = suftab.tolist()
+        lcp = lcptab.tolist()
         h = 0
-        for i in xrange(n):
-            if rank[i] >= 1:
-                j = suftab[rank[i] - 1]
-                while string[i + h] == string[j + h]:
+        for i, k, k_pending in itertools.izip(xrange(n), rank.tolist(),
+                                              is_pending[rank].tolist()):
+            if not k_pending:
+                # NOTE(msdubov): k == 0 is never pending, and its LCP value is 0.
+                h = lcp[k]
+            else:
+                # NOTE(msdubov): The LCP value of the suffix i is at least the one of
+                #                the suffix i-1 minus one (which h is at this point).
+                h = max(h, offset)
+                j = sa[k - 1]
+                while s[i + h] == s[j + h]:
                     h += 1
-                lcptab[rank[i]] = h
-                if h > 0:
-                    h -= 1
-        return lcptab
+                lcp[k] = h
+            if h > 0:
+                h -= 1
+        return np.array(lcp, dtype=np.int)
 
     def _compute_childtab(self, lcptab):
-        """Computes the child 'up' and 'down' arrays in O(n) based on the LCP table.
+        """Computes the child 'up', 'down' and 'next l index' arrays in O(n) based on the LCP table.
+
+        Both stack-based passes are done at once, over plain python lists (indexing
+        numpy arrays element by element is much slower); the results get converted
+        to numpy arrays in a single batch.
 
         Abouelhoda et al. (2004).
         """
+        lcp = lcptab.tolist()
+        n = len(lcp)
+        childtab_up = [0] * n
+        childtab_down = [0] * n
+        childtab_next_l_index = [0] * n
         last_index = -1
         stack = [0]
-        n = len(lcptab)
-        childtab_up = np.zeros(n, dtype=np.int)  # Zeros / -1 ?
-        childtab_down = np.zeros(n, dtype=np.int)
+        l_stack = [0]
         for i in xrange(n):
-            while lcptab[i] < lcptab[stack[-1]]:
+            lcp_i = lcp[i]
+            # 'Up' and 'down' values
+            while lcp_i < lcp[stack[-1]]:
                 last_index = stack.pop()
-                if lcptab[i] <= lcptab[stack[-1]] and lcptab[stack[-1]] != lcptab[last_index]:
-                    childtab_down[stack[-1]] = last_index
+                top = stack[-1]
+                if lcp_i <= lcp[top] and lcp[top] != lcp[last_index]:
+                    childtab_down[top] = last_index
             if last_index != -1:
                 childtab_up[i] = last_index
                 last_index = -1
             stack.append(i)
-        return childtab_up, childtab_down
-
-    def _compute_childtab_next_l_index(self, lcptab):
-        """Computes the child 'next l index' array in O(n) based on the LCP table.
-
-        Abouelhoda et al. (2004).
+            # 'Next l index' values
+            while lcp_i < lcp[l_stack[-1]]:
+                l_stack.pop()
+            if lcp_i == lcp[l_stack[-1]]:
+                childtab_next_l_index[l_stack.pop()] = i
+            l_stack.append(i)
+        return (np.array(childtab_up, dtype=np.int), np.array(childtab_down, dtype=np.int),
+                np.array(childtab_next_l_index, dtype=np.int))
+
+    def _compute_childtab_lookup(self):
+        """Computes the child lookup table in O(n) based on the child table.
+
+        The table is stored in the compressed sparse row format: the children of an lcp
+        interval with index x (see _interval_index()) are the entries [ptr[x]..ptr[x+1]-1]
+        of both the 'chars' array (the codes of the first characters on the arcs leading
+        to the children) and the 'lbs' array (the left bounds of the children).
         """
-        stack = [0]
-        n = len(lcptab)
-        childtab_next_l_index = np.zeros(n, dtype=np.int)  # Zeros / -1 ?
-        for i in xrange(n):
-            while lcptab[i] < lcptab[stack[-1]]:
-                stack.pop()
-            if lcptab[i] == lcptab[stack[-1]]:
-                last_index = stack.pop()
-                childtab_next_l_index[last_index] = i
-            stack.append(i)
-        return childtab_next_l_index
+        n = len(self.suftab)
+        lcp = self.lcptab.tolist()
+        childtab_next_l_index = self.childtab_next_l_index.tolist()
+        indices, lbs, depths = [], [], []
+        stack = [(0, n - 1)]
+        while stack:
+            i, j = stack.pop()
+            index = self._first_l_index(i, j)
+            # NOTE(msdubov): The child intervals start at i and at all the l-indices.
+            starts = [i]
+            k = index if index > i else childtab_next_l_index[index]
+            while k:
+                starts.append(k)
+                k = childtab_next_l_index[k]
+            indices.extend([index] * len(starts))
+            lbs.extend(starts)
+            depths.extend([lcp[index]] * len(starts))
+            ends = [start - 1 for start in starts[1:]] + [j]
+            stack.extend((i1, i2) for i1, i2 in itertools.izip(starts, ends) if i1 < i2)
+
+        indices = np.array(indices, dtype=np.int)
+        order = np.argsort(indices, kind="mergesort")
+        childtab_lbs = np.array(lbs, dtype=np.int)[order]
+        codes = self._string_codes()
+        childtab_chars = codes[self.suftab[childtab_lbs] + np.array(depths, dtype=np.int)[order]]
+        childtab_ptr = np.zeros(n + 1, dtype=np.int)
+        childtab_ptr[1:] = np.cumsum(np.bincount(indices, minlength=n))
+        return childtab_ptr, childtab_chars, childtab_lbs
 
     def _compute_anntab(self, suftab, lcptab):
         """Computes the annotations array in O(n) by "traversing" the suffix array.
@@ -309,39 +494,72 @@ class EnhancedAnnotatedSuffixArray(base.AST):
         Based on ideas from Abouelhoda et al. (2004) and Dubov & Chernyak (2013).
         """
         n = len(suftab)
-        anntab = np.zeros(n, dtype=np.int)  # Zeros / -1 ?
+        anntab = [0] * n
 
         def process_node(node):
             # NOTE(msdubov): Assumes that child l-[i..j] lcp intervals come in the ascending
             #                order (by i). This allows to handle the leafs properly.
             i = node[1]
+            annotation = 0
             for child_node in node[3]:
                 if i < child_node[1]:
-                    anntab[self._interval_index(node)] += child_node[1] - i
-                anntab[self._interval_index(node)] += anntab[self._interval_index(child_node)]
+                    annotation += child_node[1] - i
+                annotation += anntab[self._interval_index(child_node)]
                 i = child_node[2] + 1
             if i <= node[2]:
-                anntab[self._interval_index(node)] += node[2] - i + 1
+                annotation += node[2] - i + 1
+            anntab[self._interval_index(node)] = annotation
 
         self.traverse_depth_first_post_order(process_node)
         # NOTE(msdubov): Removing the "degenerate" 1st-level leafs
         #                with the auxiliary symbol in the arc.
         anntab[0] -= len(self.strings_collection)
 
-        return anntab
+        return np.array(anntab, dtype=np.int)
 
     def _interval_index(self, lcp_interval):
-        """Maps an lcp interval to an index in [0..n-1].
+        """Maps an lcp interval to an index in [0..n-1] in O(1).
+
+        The index is the first l-index of the interval (the root is mapped to 0),
+        which is unique for each lcp interval and can be read from the child table.
+
+        Abouelhoda et al. (2004).
 
         :param lcp_interval: <l, i, j>.
         """
-        return utils.index(self.lcptab, lcp_interval[0], lcp_interval[1])
+        return self._first_l_index(lcp_interval[1], lcp_interval[2])
+
+    def _first_l_index(self, i, j):
+        n = len(self.suftab)
+        if i == 0 and j == n - 1:
+            return 0
+        if j == n - 1:
+            # NOTE(msdubov): There is no childtab_up[j + 1] for the intervals ending at n-1.
+            right_spine = self._right_spine()
+            return int(right_spine[right_spine.searchsorted(i, side="right")])
+        up = int(self.childtab_up[j + 1])
+        if i < up <= j:
+            return up
+        else:
+            return int(self.childtab_down[i])
+
+    def _right_spine(self):
+        """Returns the indices k with no LCP value less than lcptab[k] after them.
+
+        All the l-indices of an lcp interval [i..n-1] are among them, and its first
+        l-index is thus the first of them after i.
+        """
+        if getattr(self, "_right_spine_cached", None) is None:
+            lcptab = np.array(self.lcptab.tolist(), dtype=np.int)
+            suffix_min = np.minimum.accumulate(lcptab[::-1])[::-1]
+            self._right_spine_cached = np.flatnonzero(lcptab <= suffix_min)
+        return self._right_spine_cached
 
     def _annotation(self, lcp_interval):
         if self._is_leaf(lcp_interval):
             return 1
         else:
-            return self.anntab[self._interval_index(lcp_interval)]
+            return int(self.anntab[self._interval_index(lcp_interval)])
 
     def _is_leaf(self, lcp_interval):
         return lcp_interval[1] == lcp_interval[2]
@@ -350,51 +568,44 @@ class EnhancedAnnotatedSuffixArray(base.AST):
         n = len(self.suftab)
         if (i == 0 or i == n - 1) and j == n - 1:
             return 0  # TODO: Verify the correctness of this step.
-        elif i < self.childtab_up[j + 1] <= j:
-            return self.lcptab[self.childtab_up[j + 1]]
+        if j == n - 1:
+            return int(self.lcptab[self._first_l_index(i, j)])
+        up = int(self.childtab_up[j + 1])
+        if i < up <= j:
+            return int(self.lcptab[up])
         else:
-            return self.lcptab[self.childtab_down[i]]
+            return int(self.lcptab[self.childtab_down[i]])
 
     def _get_child_intervals(self, i, j):
         if i == j:
             return []
-        n = len(self.suftab)
-        l = self._lcp_value(i, j)
-        intervals = []
-        if i == 0 and j == n - 1:
-            i1 = 0  # TODO: Verify the correctness of this step.
-        else:
-            if i < self.childtab_up[j + 1]:
-                i1 = self.childtab_up[j + 1]
-            else:
-                i1 = self.childtab_down[i]
-            intervals.append((self._lcp_value(i, i1 - 1), i, i1 - 1, self.string[self.suftab[i] + l]))
-        while self.childtab_next_l_index[i1] != 0:
-            i2 = self.childtab_next_l_index[i1]
-            intervals.append((self._lcp_value(i1, i2 - 1), i1, i2 - 1, self.string[self.suftab[i1] + l]))
-            i1 = i2
-        intervals.append((self._lcp_value(i1, j), i1, j, self.string[self.suftab[i1] + l]))
-        return intervals
+        index = self._first_l_index(i, j)
+        lo, hi = int(self.childtab_ptr[index]), int(self.childtab_ptr[index + 1])
+        starts = self.childtab_lbs[lo:hi].tolist()
+        ends = [start - 1 for start in starts[1:]] + [j]
+        # NOTE(msdubov): The arcs starting with the unique endings of the strings
+        #                have no character.
+        chars = [unichr(code) if code < STRING_ENDINGS_START else None
+                 for code in self.childtab_chars[lo:hi].tolist()]
+        return [(self._lcp_value(i1, i2), i1, i2, char)
+                for i1, i2, char in itertools.izip(starts, ends, chars)]
 
     def _get_child_interval(self, i, j, char):
+        """Finds the child interval of l-[i..j] whose arc starts with char in O(log |alphabet|).
+
+        The children of each lcp interval come in the suffix array order, i.e. sorted by
+        their first character, so the child lookup table can be searched with bisection.
+        """
         if i == j:
             return None
-        n = len(self.suftab)
-        l = self._lcp_value(i, j)
-        if i == 0 and j == n - 1:
-            i1 = 0
-        else:
-            if i < self.childtab_up[j + 1]:
-                i1 = self.childtab_up[j + 1]
-            else:
-                i1 = self.childtab_down[i]
-            if self.string[self.suftab[i] + l] == char:
-                return (self._lcp_value(i, i1 - 1), i, i1 - 1, self.string[self.suftab[i] + l])
-        while self.childtab_next_l_index[i1] != 0:
-            i2 = self.childtab_next_l_index[i1]
-            if self.string[self.suftab[i1] + l] == char:
-                return (self._lcp_value(i1, i2 - 1), i1, i2 - 1, self.string[self.suftab[i1] + l])
-            i1 = i2
-        if self.string[self.suftab[i1] + l] == char:
-            return (self._lcp_value(i1, j), i1, j, self.string[self.suftab[i1] + l])
-        return None
+        index = self._first_l_index(i, j)
+        lo, hi = int(self.childtab_ptr[index]), int(self.childtab_ptr[index + 1])
+        code = ord(char)
+        # NOTE(msdubov): Searching on the numpy side, since comparing narrow numpy
+        #                integers to Python ones one by one (as bisect does) is slow.
+        k = lo + int(self.childtab_chars[lo:hi].searchsorted(code))
+        if k == hi or int(self.childtab_chars[k]) != code:
+            return None
+        i1 = int(self.childtab_lbs[k])
+        i2 = int(self.childtab_lbs[k + 1]) - 1 if k + 1 < hi else j
+        return (self._lcp_value(i1, i2), i1, i2, char)
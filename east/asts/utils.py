@@ -1,5 +1,10 @@
 # -*- coding: utf-8 -*
 
+import itertools
+import sys
+
+import numpy as np
+
 from east import consts
 
 
@@ -11,14 +16,21 @@ def index(array, key, start=0):
     return i
 
 
-def match_strings(str1, str2):
+def match_strings(str1, str2, start1=0, start2=0, end2=None):
     """
-    Returns the largest index i such that str1[:i] == str2[:i]
+    Returns the largest index i such that
+    str1[start1:start1+i] == str2[start2:start2+i] and start2+i <= end2.
+
+    Compares the characters by their offsets in the original strings,
+    so that no substrings get copied.
     
     """
     i = 0
-    min_len = len(str1) if len(str1) < len(str2) else len(str2)
-    while i < min_len and str1[i] == str2[i]: i += 1
+    len2 = len(str2) if end2 is None or end2 > len(str2) else end2
+    min_len = len(str1) - start1
+    if len2 - start2 < min_len:
+        min_len = len2 - start2
+    while i < min_len and str1[start1 + i] == str2[start2 + i]: i += 1
     return i
 
 
@@ -38,3 +50,159 @@ def make_unique_endings(strings_collection):
         hex_code = r"\U" + "0" * (8 - len(hex_code) + 2) + hex_code[2:]
         res.append(strings_collection[i] + hex_code.decode("unicode-escape"))
     return res
+
+
+def encode_string(string):
+    """
+    Returns the array of integer character codes of the (Unicode) string,
+    one entry per character of the string.
+
+    """
+    if sys.maxunicode > 0xFFFF:
+        return np.frombuffer(string.encode("utf-32-le"), dtype="<u4").astype(np.int)
+    else:
+        # NOTE(msdubov): On 'narrow' python installations, UTF-32 would merge
+        #                surrogate pairs and thus change the string length.
+        return np.fromiter(itertools.imap(ord, string), dtype=np.int, count=len(string))
+
+
+def decode_string(codes):
+    """
+    Returns the Unicode string with the given character codes
+    (the inverse of encode_string()).
+
+    """
+    if sys.maxunicode > 0xFFFF:
+        return np.asarray(codes, dtype="<u4").tostring().decode("utf-32-le")
+    else:
+        return u"".join(itertools.imap(unichr, codes))
+
+
+class QueryTrie(object):
+    """
+    Trie of all the suffixes of a batch of queries, used to score them all at once
+    (see AST.score_many()). The queries get deduplicated, and the suffixes sharing
+    a common prefix share the corresponding path in the trie.
+
+    The trie nodes are numbered in depth-first pre-order, and each occurrence of
+    a suffix ending in a node gets a "slot". The slots are numbered in the same order,
+    so that the slots of all the suffixes in a subtree form a contiguous range.
+
+    """
+
+    def __init__(self, queries):
+        # Distinct queries, and the index of the distinct version of each input query
+        self.queries = []
+        self.query_ids = []
+        ids = {}
+        for query in queries:
+            query = query.replace(" ", "")
+            if query not in ids:
+                ids[query] = len(self.queries)
+                self.queries.append(query)
+            self.query_ids.append(ids[query])
+
+        # NOTE(msdubov): Dictionary-based trie; the None key holds the suffixes
+        #                (query index, suffix start) ending in the node.
+        root = {}
+        for query_id, query in enumerate(self.queries):
+            for suffix_start in xrange(len(query)):
+                node = root
+                for char in itertools.islice(query, suffix_start, None):
+                    node = node.setdefault(char, {})
+                node.setdefault(None, []).append((query_id, suffix_start))
+
+        # Flattened trie: the children of each node as (char, child) pairs, and the
+        # ranges [lo..own_hi) and [lo..hi) of the slots of the node and of its subtree.
+        self.children = []
+        self.slots_lo = []
+        self.slots_own_hi = []
+        self.query_slots = [[None] * len(query) for query in self.queries]
+        slots_count = 0
+        parents = []
+        stack = [(root, None, None)]
+        while stack:
+            node, parent, char = stack.pop()
+            node_id = len(self.children)
+            self.children.append([])
+            parents.append(parent)
+            if parent is not None:
+                self.children[parent].append((char, node_id))
+            self.slots_lo.append(slots_count)
+            for query_id, suffix_start in node.get(None, []):
+                self.query_slots[query_id][suffix_start] = slots_count
+                slots_count += 1
+            self.slots_own_hi.append(slots_count)
+            stack.extend((node[c], node_id, c) for c in
+                         sorted((c for c in node if c is not None), reverse=True))
+        self.slots_count = slots_count
+        self.slots_hi = list(self.slots_own_hi)
+        for node_id in xrange(len(self.children) - 1, 0, -1):
+            parent = parents[node_id]
+            if self.slots_hi[node_id] > self.slots_hi[parent]:
+                self.slots_hi[parent] = self.slots_hi[node_id]
+
+
+def compact_dtype(max_value):
+    """
+    Returns the narrowest signed integer dtype that can store all the values
+    in [0..max_value].
+
+    NOTE(msdubov): Signed dtypes are used on purpose, so that the arithmetic
+                   on the array elements (e.g. "j - 1") never wraps around.
+
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+class CompactIntArray(object):
+    """
+    Read-only array of non-negative integers that stores the values below 255
+    in one byte each; the larger values are kept in a separate overflow table
+    (sorted by index) and are looked up with bisection.
+
+    Suits the arrays with mostly small values but a few large ones
+    (like the LCP array of a collection with some long repeats).
+
+    """
+
+    OVERFLOW = 255
+
+    def __init__(self, values, overflow_indices, overflow_values):
+        self.values = values
+        self.overflow_indices = overflow_indices
+        self.overflow_values = overflow_values
+
+    @classmethod
+    def from_array(cls, array):
+        array = np.asarray(array)
+        overflow_indices = np.flatnonzero(array >= cls.OVERFLOW)
+        values = np.minimum(array, cls.OVERFLOW).astype(np.uint8)
+        return cls(values,
+                   overflow_indices.astype(compact_dtype(len(array))),
+                   array[overflow_indices].astype(compact_dtype(array.max()
+                                                                if len(array) else 0)))
+
+    def __getitem__(self, i):
+        value = self.values[i]
+        if value == self.OVERFLOW:
+            return int(self.overflow_values[np.searchsorted(self.overflow_indices, i)])
+        return int(value)
+
+    def __len__(self):
+        return len(self.values)
+
+    @property
+    def nbytes(self):
+        return (self.values.nbytes + self.overflow_indices.nbytes +
+                self.overflow_values.nbytes)
+
+    def tolist(self):
+        res = self.values.tolist()
+        for i, value in itertools.izip(self.overflow_indices.tolist(),
+                                       self.overflow_values.tolist()):
+            res[i] = value
+        return res
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*
+
+import collections
+import hashlib
+import shelve
+import sys
+
+
+class ScoreCache(object):
+    """
+    Bounded LRU cache of relevance scores.
+
+    The cache is limited by the (estimated) amount of memory its entries take; the least
+    recently used ones get evicted when the limit is exceeded. If a path is given, the cache
+    gets backed by a shelve file there: the evicted entries (and all the entries on sync()
+    or close()) get written to the disk, and the lookups that miss the memory go to the disk,
+    so that the cache survives across runs.
+
+    The keys are tuples of strings, numbers, None and nested tuples; the values are floats.
+
+    """
+
+    # Estimated overhead of an entry (the dictionary slot and the LRU list node), in bytes
+    ENTRY_OVERHEAD = 150
+
+    def __init__(self, max_memory=2 ** 26, path=None):
+        self.max_memory = max_memory
+        self.memory = 0
+        self.path = path
+        self._entries = collections.OrderedDict()
+        self._shelf = shelve.open(path, protocol=2) if path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached score for the key, or None if there is no such score."""
+        if key in self._entries:
+            # NOTE(msdubov): Reinserting the entry makes it the most recently used one.
+            entry = self._entries.pop(key)
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+        if self._shelf is not None:
+            value = self._shelf.get(self._disk_key(key))
+            if value is not None:
+                self.disk_hits += 1
+                self._put(key, value)
+                return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._put(key, float(value))
+
+    def stats(self):
+        """Returns the hit-rate statistics of the cache."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "memory": self.memory,
+            "hit_rate": float(self.hits + self.disk_hits) / lookups if lookups else 0.0
+        }
+
+    def sync(self):
+        """Writes all the entries to the disk (if the cache is backed by a file)."""
+        if self._shelf is not None:
+            for key, (value, _) in self._entries.iteritems():
+                self._shelf[self._disk_key(key)] = value
+            self._shelf.sync()
+
+    def close(self):
+        if self._shelf is not None:
+            self.sync()
+            self._shelf.close()
+            self._shelf = None
+
+    def _put(self, key, value):
+        # NOTE(msdubov): The entries keep their sizes, so that these get estimated once.
+        if key in self._entries:
+            self.memory -= self._entries.pop(key)[1]
+        size = self._entry_size(key, value)
+        self._entries[key] = (value, size)
+        self.memory += size
+        while self.memory > self.max_memory and self._entries:
+            old_key, (old_value, old_size) = self._entries.popitem(last=False)
+            self.memory -= old_size
+            self.evictions += 1
+            if self._shelf is not None:
+                self._shelf[self._disk_key(old_key)] = old_value
+
+    def _entry_size(self, key, value):
+        return _deep_getsizeof(key) + sys.getsizeof(value) + self.ENTRY_OVERHEAD
+
+    def _disk_key(self, key):
+        # NOTE(msdubov): shelve only accepts (byte) strings as keys.
+        return hashlib.sha1(repr(key)).hexdigest()
+
+
+def _deep_getsizeof(obj):
+    if isinstance(obj, tuple):
+        return sys.getsizeof(obj) + sum(_deep_getsizeof(item) for item in obj)
+    return sys.getsizeof(obj)
@@ -25,7 +25,7 @@ class _String(utils.ImmutableMixin, utils.EnumMixin):
 
 
 class _RelevanceMeasure(utils.ImmutableMixin, utils.EnumMixin):
-    AST = "AST"
+    AST = "ast"
     COSINE = "cosine"
 
 
@@ -33,6 +33,12 @@ class _ASTAlgorithm(utils.ImmutableMixin, utils.EnumMixin):
     AST_LINEAR = "ast_linear"
     AST_NAIVE = "ast_naive"
     EASA = "easa"
+    CORPUS_EASA = "corpus_easa"
+
+
+class _SuffixArrayAlgorithm(utils.ImmutableMixin, utils.EnumMixin):
+    KARKKAINEN_SANDERS = "karkkainen-sanders"
+    PREFIX_DOUBLING = "prefix-doubling"
 
 
 class _TermWeighting(utils.ImmutableMixin, utils.EnumMixin):
@@ -69,6 +75,7 @@ URL = _URL()
 String = _String()
 RelevanceMeasure = _RelevanceMeasure()
 ASTAlgorithm = _ASTAlgorithm()
+SuffixArrayAlgorithm = _SuffixArrayAlgorithm()
 TermWeighting = _TermWeighting()
 VectorSpace = _VectorSpace()
 Language = _Language()
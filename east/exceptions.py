@@ -54,6 +54,27 @@ class NoSuchASTAlgorithm(NotFoundException):
     msg_fmt = "There is no AST construction algorithm with name `%(name)s`."
 
 
+class NoSuchSuffixArrayAlgorithm(NotFoundException):
+    msg_fmt = "There is no suffix array construction algorithm with name `%(name)s`."
+
+
+class IndexNotFoundException(NotFoundException):
+    msg_fmt = "There is no saved AST in `%(path)s`."
+
+
+class IndexFormatException(EastException):
+    msg_fmt = "Unsupported format version `%(version)s` of the AST saved in `%(path)s`."
+
+
+class IndexSaveException(EastException):
+    msg_fmt = "Could not save the AST to `%(path)s`."
+
+
+class LemmataNotSupportedException(EastException):
+    msg_fmt = ("Lemmata are only available for English texts, not for `%(language)s` ones; "
+               "please use stems or words as the vector space instead.")
+
+
 class TomitaNotInstalledException(EastException):
     msg_fmt = ("Please, add the tomita distribution corresponding to your operating system "
                "to `tools/tomita`. The tomita binary file can be downloaded from %s" %
@@ -1,57 +1,155 @@
 # -*- coding: utf-8 -*
 
+import StringIO
+
 
 def format_table(table, format):
+    """Formats the keyphrases table, either a dictionary of dictionaries as returned
+    by applications.keyphrases_table() or a table returned by keyphrases_matrix()."""
+    if format == "xml":
+        return table2xml(table)
+    elif format == "csv":
+        return table2csv(table)
+    else:
+        raise Exception("Unknown table format: '%s'. "
+                        "Please use one of: 'xml', 'csv'." % format)
+
+
+def table_rows_by_texts(format):
+    """Tells whether the rows of the table written in the format go by texts or by keyphrases.
+
+    See write_table() and applications.keyphrases_table_rows().
+    """
     if format == "xml":
-        return table2xml(keyphrases_table)
+        return False
     elif format == "csv":
-        return table2csv(keyphrases_table)
+        return True
     else:
         raise Exception("Unknown table format: '%s'. "
                         "Please use one of: 'xml', 'csv'." % format)
 
 
+def write_table(rows, f, format):
+    """Writes the keyphrases table to the file-like object f as its rows get produced.
+
+    :param rows: iterable of the table rows as yielded by applications.keyphrases_table_rows(),
+                 going by texts if table_rows_by_texts(format) is True and by keyphrases
+                 otherwise
+    """
+    if table_rows_by_texts(format):
+        write_table_csv(rows, f)
+    else:
+        write_table_xml(rows, f)
+
+
 def table2xml(keyphrases_table):
-    res = "<table>\n"
-    for keyphrase in sorted(keyphrases_table.keys()):
-        res += '  <keyphrase value="%s">\n' % keyphrase
-        for text in sorted(keyphrases_table[keyphrase].keys()):
-            res += '    <text name="%s">' % text
-            res += '%.3f' % keyphrases_table[keyphrase][text]
-            res += '</text>\n'
-        res += '  </keyphrase>\n'
-    res += "</table>\n"
-    return res
+    f = StringIO.StringIO()
+    if isinstance(keyphrases_table, dict):
+        rows = ((keyphrase, keyphrases_table[keyphrase])
+                for keyphrase in sorted(keyphrases_table.keys()))
+    else:
+        rows = keyphrases_table.rows()
+    write_table_xml(rows, f)
+    return f.getvalue()
+
+
+def write_table_xml(keyphrase_rows, f):
+    f.write("<table>\n")
+    for keyphrase, scores in keyphrase_rows:
+        f.write('  <keyphrase value="%s">\n' % keyphrase)
+        for text in sorted(scores.keys()):
+            f.write('    <text name="%s">%.3f</text>\n' % (text, scores[text]))
+        f.write('  </keyphrase>\n')
+    f.write("</table>\n")
 
 
 def table2csv(keyphrases_table):
+    f = StringIO.StringIO()
+    if isinstance(keyphrases_table, dict):
+        keyphrases = sorted(keyphrases_table.keys())
+        texts = sorted(keyphrases_table[keyphrases[0]].keys())
+        write_table_csv(((text, {keyphrase: keyphrases_table[keyphrase][text]
+                                 for keyphrase in keyphrases})
+                         for text in texts), f)
+    else:
+        write_table_csv(keyphrases_table.rows(by_texts=True), f, keyphrases_table.keyphrases)
+    return f.getvalue()
+
+
+def write_table_csv(text_rows, f, keyphrases=None):
+    """Writes the table rows going by texts in CSV.
+
+    :param keyphrases: the keyphrases for the columns (those of the first row by default);
+                       the cells with no score in a row are left empty
+    """
 
     def quote(s):
         return '"' + s.replace('"', "'") + '"'
 
-    keyphrases = sorted(keyphrases_table.keys())
-    texts = sorted(keyphrases_table[keyphrases[0]].keys())
-    res = "," + ",".join(map(quote, keyphrases)) + "\n"  # Heading
-    for text in texts:
-        scores = map(lambda score: u"%.3f" % score,
-                     [keyphrases_table[keyphrase][text] for keyphrase in keyphrases])
-        res += (quote(text) + "," + ",".join(scores) + "\n")
-    return res
+    if keyphrases is not None:
+        f.write("," + ",".join(map(quote, keyphrases)) + "\n")  # Heading
+    for text, scores in text_rows:
+        if keyphrases is None:
+            keyphrases = sorted(scores.keys())
+            f.write("," + ",".join(map(quote, keyphrases)) + "\n")  # Heading
+        f.write(quote(text) + "," +
+                ",".join(u"%.3f" % scores[keyphrase] if keyphrase in scores else u""
+                         for keyphrase in keyphrases) + "\n")
+
+
+def format_top(top, format):
+    f = StringIO.StringIO()
+    write_top(top, f, format)
+    return f.getvalue()
+
+
+def write_top(top, f, format):
+    """Writes the top texts for the keyphrases (see applications.keyphrases_top())."""
+    if format == "xml":
+        f.write("<top>\n")
+        for keyphrase in sorted(top.keys()):
+            f.write('  <keyphrase value="%s">\n' % keyphrase)
+            for text, score in top[keyphrase]:
+                f.write('    <text name="%s">%.3f</text>\n' % (text, score))
+            f.write('  </keyphrase>\n')
+        f.write("</top>\n")
+    elif format == "csv":
+
+        def quote(s):
+            return '"' + s.replace('"', "'") + '"'
+
+        for keyphrase in sorted(top.keys()):
+            for text, score in top[keyphrase]:
+                f.write(quote(keyphrase) + "," + quote(text) + "," + u"%.3f" % score + "\n")
+    else:
+        raise Exception("Unknown format: '%s'. "
+                        "Please use one of: 'xml', 'csv'." % format)
 
 
 def format_graph(graph, format):
+    f = StringIO.StringIO()
+    write_graph(graph, f, format)
+    return f.getvalue()
+
+
+def write_graph(graph, f, format):
     if format == "gml":
-        return graph2gml(graph)
+        write_graph_gml(graph, f)
     elif format == "edges":
-        return graph2edges(graph)
+        write_graph_edges(graph, f)
     else:
         raise Exception("Unknown graph format: '%s'. "
                         "Please use one of: 'gml', 'edges'." % format)
 
 
 def graph2edges(graph):
+    f = StringIO.StringIO()
+    write_graph_edges(graph, f)
+    return f.getvalue()
+
+
+def write_graph_edges(graph, f):
     # TODO(mikhaildubov): Exception on the US constitution example!
-    res = ""
     node_edges = {}
     for edge in graph["edges"]:
         source_label = graph["nodes"][edge["source"]]["label"]
@@ -60,21 +158,25 @@ def graph2edges(graph):
             node_edges[source_label] = []
         node_edges[source_label].append(target_label)
     for node in node_edges:
-        res += "%s -> %s\n" % (node, ", ".join(node_edges[node]))
-    return res
+        f.write("%s -> %s\n" % (node, ", ".join(node_edges[node])))
 
 
 def graph2gml(graph):
-    res = "graph\n[\n"
-    res += "  directed 1\n"
-    res += "  referral_confidence %.2f\n" % graph["referral_confidence"]
-    res += "  relevance_threshold %.2f\n" % graph["relevance_threshold"]
-    res += "  support_threshold %i\n" % graph["support_threshold"]
+    f = StringIO.StringIO()
+    write_graph_gml(graph, f)
+    return f.getvalue()
+
+
+def write_graph_gml(graph, f):
+    f.write("graph\n[\n")
+    f.write("  directed 1\n")
+    f.write("  referral_confidence %.2f\n" % graph["referral_confidence"])
+    f.write("  relevance_threshold %.2f\n" % graph["relevance_threshold"])
+    f.write("  support_threshold %i\n" % graph["support_threshold"])
     for node in graph["nodes"]:
-        res += ('  node\n  [\n    id %i\n    label "%s"\n  ]\n' %
+        f.write('  node\n  [\n    id %i\n    label "%s"\n  ]\n' %
                 (node["id"], node["label"]))
     for edge in graph["edges"]:
-        res += ('  edge\n  [\n    source %i\n    target %i\n    confidence %.2f\n  ]\n' %
+        f.write('  edge\n  [\n    source %i\n    target %i\n    confidence %.2f\n  ]\n' %
                 (edge["source"], edge["target"], edge["confidence"]))
-    res += "]\n"
-    return res
+    f.write("]\n")
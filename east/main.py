@@ -5,6 +5,7 @@ import os
 import sys
 
 from east import applications
+from east import cache
 from east import consts
 from east import formatting
 from east.synonyms import synonyms
@@ -14,7 +15,7 @@ from east import utils
 
 def main():
     args = sys.argv[1:]
-    opts, args = getopt.getopt(args, "s:a:w:v:l:f:c:r:p:dy")
+    opts, args = getopt.getopt(args, "s:a:w:v:l:f:c:r:p:i:C:j:dy")
     opts = dict(opts)
 
     # Default values for non-boolean options
@@ -24,7 +25,7 @@ def main():
     # Relevance measures
     # Similarity measure to use ("ast" / "cosine")
     opts.setdefault("-s", consts.RelevanceMeasure.AST)
-    # Algorithm to use for computing ASTs ("easa" / "ast_linear" / "ast_naive")
+    # Algorithm to use for computing ASTs ("easa" / "ast_linear" / "ast_naive" / "corpus_easa")
     opts.setdefault("-a", consts.ASTAlgorithm.EASA)
     # Term weighting scheme used for computing the cosine similarity ("tf-idf" / "tf")
     opts.setdefault("-w", consts.TermWeighting.TF_IDF)
@@ -41,7 +42,7 @@ def main():
         print("Invalid syntax: EAST should be called as:\n\n"
               "    east [options] <command> <subcommand> args\n\n"
               "Commands available: keyphrases.\n"
-              "Subcommands available: table/graph.")
+              "Subcommands available: table/graph/top.")
         return 1
 
     command = args[0]
@@ -49,6 +50,13 @@ def main():
 
     if command == "keyphrases":
 
+        if subcommand == "top":
+            # NOTE(msdubov): The "top" subcommand has its own options, going after its name.
+            top_opts, top_args = getopt.getopt(args[2:], "k:")
+            top_opts = dict(top_opts)
+            args = args[:2] + top_args
+            top_opts.setdefault("-k", "10")  # Number of the most relevant texts to find
+
         if len(args) < 4:
             print('Invalid syntax. For keyphrases analysis, EAST should be called as:\n\n'
                   '    east [options] keyphrases <subcommand> "path/to/keyphrases.txt" '
@@ -90,61 +98,98 @@ def main():
 
         language = opts["-l"]
 
+        # Number of processes to index the texts / compute the matching scores in
+        workers = int(opts.get("-j", 1))
+
+        # File to cache the relevance scores in across runs (no caching by default)
+        score_cache = cache.ScoreCache(path=opts["-C"]) if "-C" in opts else None
+
         # Similarity measure
         similarity_measure = opts["-s"]
-        if similarity_measure == "ast":
+        if similarity_measure == consts.RelevanceMeasure.AST:
             ast_algorithm = opts["-a"]
             normalized_scores = "-d" not in opts
-            similarity_measure = relevance.ASTRelevanceMeasure(ast_algorithm, normalized_scores)
-        elif similarity_measure == "cosine":
+            # Directory to save the text indexes to / load them from (no saving by default)
+            index_path = opts.get("-i")
+            if ast_algorithm == consts.ASTAlgorithm.CORPUS_EASA:
+                # NOTE(msdubov): One index for all the texts instead of an index per text.
+                similarity_measure = relevance.CorpusASTRelevanceMeasure(normalized_scores,
+                                                                         index_path, score_cache)
+            else:
+                similarity_measure = relevance.ASTRelevanceMeasure(ast_algorithm,
+                                                                   normalized_scores, index_path,
+                                                                   score_cache, workers)
+        elif similarity_measure == consts.RelevanceMeasure.COSINE:
             vector_space = opts["-v"]
             term_weighting = opts["-w"]
-            similarity_measure = relevance.CosineRelevanceMeasure(vector_space, term_weighting)
+            similarity_measure = relevance.CosineRelevanceMeasure(vector_space, term_weighting,
+                                                                  score_cache, workers)
 
         # Synomimizer
         use_synonyms = "-y" in opts
-        synonimizer = synonyms.SynonymExtractor(text_collection_path) if use_synonyms else None
+        synonimizer = (synonyms.SynonymExtractor(text_collection_path, workers)
+                       if use_synonyms else None)
 
-        if subcommand == "table":
+        try:
+            if subcommand == "table":
 
-            keyphrases_table = applications.keyphrases_table(
-                                    keyphrases, texts, similarity_measure_factory,
-                                    synonimizer, language)
+                opts.setdefault("-f", "xml")  # Table output format ("csv" is the other option)
+                table_format = opts["-f"].lower()
 
-            opts.setdefault("-f", "xml")  # Table output format ("csv" is the other option)
-            table_format = opts["-f"].lower()
+                try:
+                    by_texts = formatting.table_rows_by_texts(table_format)
+                except Exception as e:
+                    print e
+                    return 1
 
-            try:
-                res = formatting.format_table(keyphrases_table, table_format)
-                print res
-            except Exception as e:
-                print e
-                return 1
+                # NOTE(msdubov): The table gets written row by row, as it is being computed.
+                keyphrases_table_rows = applications.keyphrases_table_rows(
+                                            keyphrases, texts, similarity_measure, synonimizer,
+                                            language, workers, by_texts)
+                formatting.write_table(keyphrases_table_rows, sys.stdout, table_format)
+
+            elif subcommand == "graph":
+
+                # Graph construction parameters: Referral confidence, relevance, support thresholds
+                referral_confidence = float(opts["-c"])
+                relevance_threshold = float(opts["-r"])
+                support_threshold = float(opts["-p"])
 
-        elif subcommand == "graph":
+                graph = applications.keyphrases_graph(keyphrases, texts, referral_confidence,
+                                                      relevance_threshold, support_threshold,
+                                                      similarity_measure, synonimizer, language,
+                                                      workers)
 
-            # Graph construction parameters: Referral confidence, relevance and support thresholds            
-            referral_confidence = float(opts["-c"])
-            relevance_threshold = float(opts["-r"])
-            support_threshold = float(opts["-p"])
+                opts.setdefault("-f", "edges")  # Graph output format (also "gml" possible)
+                graph_format = opts["-f"].lower()
 
-            graph = applications.keyphrases_graph(keyphrases, texts, referral_confidence,
-                                                  relevance_threshold, support_threshold,
+                try:
+                    formatting.write_graph(graph, sys.stdout, graph_format)
+                except Exception as e:
+                    print e
+                    return 1
+
+            elif subcommand == "top":
+
+                top = applications.keyphrases_top(keyphrases, texts, int(top_opts["-k"]),
                                                   similarity_measure, synonimizer, language)
 
-            opts.setdefault("-f", "edges")  # Graph output format (also "gml" possible)
-            graph_format = opts["-f"].lower()
+                opts.setdefault("-f", "xml")  # Output format ("csv" is the other option)
+                top_format = opts["-f"].lower()
 
-            try:
-                res = formatting.format_graph(graph, graph_format)
-                print res
-            except Exception as e:
-                print e
-                return 1
+                try:
+                    formatting.write_top(top, sys.stdout, top_format)
+                except Exception as e:
+                    print e
+                    return 1
 
-        else:
-            print "Invalid subcommand: '%s'. Please use one of: 'table', 'graph'." % subcommand
-            return 1
+            else:
+                print ("Invalid subcommand: '%s'. "
+                       "Please use one of: 'table', 'graph', 'top'." % subcommand)
+                return 1
+        finally:
+            if score_cache is not None:
+                score_cache.close()
 
     else:
         print "Invalid command: '%s'. Please use one of: 'keyphrases'." % command
@@ -1,71 +1,409 @@
 # -*- coding: utf-8 -*
 
-from collections import defaultdict
+import array
+from collections import Counter
+import hashlib
+import heapq
+import itertools
 import math
+import multiprocessing
+import os
+import shutil
 import sys
+import tempfile
 
 from nltk.stem import snowball
+from nltk.stem import wordnet
 import numpy as np
 
 from east.asts import base
+from east.asts import utils as ast_utils
 from east import consts
+from east import exceptions
 from east import logging
 from east import utils
 
 
+# Minimal number of distinct tokens to stem / lemmatize in parallel
+PARALLEL_PREPROCESSING_MIN_TOKENS = 10000
+
+
 class RelevanceMeasure(object):
 
+    # Whether the scores get computed for whole blocks of texts at once (see _relevance_block())
+    scores_all_texts_at_once = False
+
+    def __init__(self, score_cache=None):
+        # Cache of the computed scores (see cache.ScoreCache), not used by default
+        self.score_cache = score_cache
+        self._text_keys = (None, None)
+        self._synonyms_key = (None, None)
+        # The block of the texts being scored (see relevance_table())
+        self._texts_block = None
+        self._scores = None
+
     def set_text_collection(self, texts, language=consts.Language.ENGLISH):
         raise NotImplemented()
 
     def relevance(self, keyphrase, text, synonimizer=None):
         # text is the index of the text to measure the relevance to
         # TODO(mikhaildubov): Add detailed docstrings
+        if self.score_cache is None:
+            return self._relevance(keyphrase, text, synonimizer)
+        key = self._score_cache_key(keyphrase, text, synonimizer)
+        score = self.score_cache.get(key)
+        if score is None:
+            score = self._relevance(keyphrase, text, synonimizer)
+            self.score_cache.put(key, score)
+        return score
+
+    def relevance_many(self, keyphrases, text, synonimizer=None):
+        """Computes the relevance of each of the keyphrases to the text.
+
+        :returns: numpy array of the relevance scores, in the order of the keyphrases
+        """
+        if self.score_cache is None:
+            return self._relevance_many(keyphrases, text, synonimizer)
+        scores = self.get_cached_scores(keyphrases, text, synonimizer)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        if missing:
+            missing_keyphrases = [keyphrases[i] for i in missing]
+            missing_scores = self._relevance_many(missing_keyphrases, text, synonimizer)
+            self.put_cached_scores(missing_keyphrases, text, missing_scores, synonimizer)
+            for i, score in itertools.izip(missing, missing_scores.tolist()):
+                scores[i] = score
+        return np.array(scores, dtype=np.float)
+
+    def relevance_table(self, keyphrases, texts, synonimizer=None):
+        """Computes the relevance of each of the keyphrases to each of the texts.
+
+        :param texts: list of the indices of the texts
+        :returns: numpy array of shape (len(keyphrases), len(texts))
+        """
+        scores = np.zeros((len(keyphrases), len(texts)), dtype=np.float)
+        self._texts_block = tuple(texts)
+        self._scores = None
+        try:
+            for k, text in enumerate(texts):
+                scores[:, k] = self.relevance_many(keyphrases, text, synonimizer)
+        finally:
+            self._texts_block = None
+            self._scores = None
+        return scores
+
+    def get_cached_scores(self, keyphrases, text, synonimizer=None):
+        """Looks up the relevance scores of the keyphrases to the text in the score cache.
+
+        :returns: list of the scores, with None for the ones missing in the cache
+        """
+        if self.score_cache is None:
+            return [None] * len(keyphrases)
+        return [self.score_cache.get(self._score_cache_key(keyphrase, text, synonimizer))
+                for keyphrase in keyphrases]
+
+    def put_cached_scores(self, keyphrases, text, scores, synonimizer=None):
+        """Puts the relevance scores of the keyphrases to the text into the score cache."""
+        if self.score_cache is None:
+            return
+        for keyphrase, score in itertools.izip(keyphrases, np.asarray(scores).tolist()):
+            self.score_cache.put(self._score_cache_key(keyphrase, text, synonimizer), score)
+
+    def top_texts(self, keyphrase, k, synonimizer=None):
+        """Finds the k texts the keyphrase is the most relevant to.
+
+        :returns: list of min(k, number of texts) pairs (text, score), in the descending order
+                  of the scores (the ties get broken by the text indices)
+        """
+        return self.top_texts_many([keyphrase], k, synonimizer)[0]
+
+    def top_texts_many(self, keyphrases, k, synonimizer=None):
+        """Finds the k texts each of the keyphrases is the most relevant to.
+
+        The texts get scored in the descending order of the upper bounds on their scores
+        (see _relevance_upper_bounds()), each against only those keyphrases for which
+        it can still get into the top k.
+
+        :returns: list of the results of top_texts() for each of the keyphrases
+        """
+        bounds = [self._relevance_upper_bounds(keyphrase, synonimizer)
+                  for keyphrase in keyphrases]
+        texts = xrange(len(self.texts))
+        if keyphrases and bounds[0] is not None:
+            max_bounds = np.max(bounds, axis=0).tolist()
+            texts = sorted(texts, key=lambda text: (-max_bounds[text], text))
+        # NOTE(msdubov): Min-heaps of the best (score, -text) pairs found so far.
+        tops = [[] for _ in keyphrases]
+        for step, text in enumerate(texts):
+            candidates = [i for i in xrange(len(keyphrases))
+                          if len(tops[i]) < k or bounds[i] is None or
+                             bounds[i][text] >= tops[i][0][0]]
+            if candidates:
+                scores = self.relevance_many([keyphrases[i] for i in candidates], text,
+                                             synonimizer)
+                for i, score in itertools.izip(candidates, scores.tolist()):
+                    if len(tops[i]) < k:
+                        heapq.heappush(tops[i], (score, -text))
+                    elif (score, -text) > tops[i][0]:
+                        heapq.heapreplace(tops[i], (score, -text))
+            logging.progress("Finding the most relevant texts", step + 1, len(self.texts))
+        logging.clear()
+        return [[(-text, score) for score, text in sorted(top, reverse=True)] for top in tops]
+
+    def _relevance_upper_bounds(self, keyphrase, synonimizer=None):
+        """Returns the upper bounds on the scores of the keyphrase in each of the texts,
+        or None if the relevance measure cannot compute them faster than the scores."""
+        return None
+
+    def _relevance(self, keyphrase, text, synonimizer=None):
         raise NotImplemented()
 
+    def _relevance_many(self, keyphrases, text, synonimizer=None):
+        return np.array([self._relevance(keyphrase, text, synonimizer)
+                         for keyphrase in keyphrases])
+
+    def _relevance_many_from_block(self, keyphrases, text, synonimizer=None):
+        """Implements _relevance_many() for the measures with scores_all_texts_at_once
+        (see _relevance_block())."""
+        # NOTE(msdubov): The scores for the whole block of the texts being scored (see
+        #                relevance_table()) come at once, so they get cached for the subsequent
+        #                calls with the same batch of keyphrases. Only the scores for that block
+        #                are kept, so that the memory usage stays bounded by its size.
+        keyphrases = tuple(keyphrases)
+        if (self._scores is None or self._scores[:2] != (keyphrases, synonimizer) or
+                text not in self._scores[2]):
+            texts = self._texts_block
+            if texts is None or text not in texts:
+                texts = (text,)
+            self._scores = (keyphrases, synonimizer,
+                            {block_text: k for k, block_text in enumerate(texts)},
+                            self._relevance_block(keyphrases, texts, synonimizer))
+        return self._scores[3][:, self._scores[2][text]]
+
+    def _relevance_block(self, keyphrases, texts, synonimizer=None):
+        """Computes the relevance of each of the keyphrases to each of the texts at once,
+        for the measures with scores_all_texts_at_once.
+
+        :returns: numpy array of shape (len(keyphrases), len(texts))
+        """
+        raise NotImplemented()
+
+    def _score_cache_params(self):
+        """Returns the parameters of the measure that the scores depend on."""
+        raise NotImplemented()
+
+    def _score_cache_key(self, keyphrase, text, synonimizer):
+        return (keyphrase, self._text_key(text), self._score_cache_params(),
+                self._get_synonyms_key(synonimizer))
+
+    def _text_key(self, text):
+        # NOTE(msdubov): Texts are identified by the hashes of their contents, so that
+        #                the cached scores survive the changes in the text collection.
+        if self._text_keys[0] is not self.texts:
+            self._text_keys = (self.texts, [None] * len(self.texts))
+        text_keys = self._text_keys[1]
+        if text_keys[text] is None:
+            content = self.texts[text]
+            if isinstance(content, unicode):
+                content = content.encode("utf-8")
+            text_keys[text] = hashlib.sha1(content).hexdigest()
+        return text_keys[text]
+
+    def _get_synonyms_key(self, synonimizer):
+        if synonimizer is None:
+            return None
+        if self._synonyms_key[0] is not synonimizer:
+            synonyms = synonimizer.get_synonyms()
+            synonyms = sorted((word, sorted(synonyms[word])) for word in synonyms
+                              if synonyms[word])
+            self._synonyms_key = (synonimizer,
+                                  hashlib.sha1(repr(synonyms)).hexdigest())
+        return self._synonyms_key[1]
+
 
 class ASTRelevanceMeasure(RelevanceMeasure):
 
-    def __init__(self, ast_algorithm=consts.ASTAlgorithm.EASA, normalized=True):
-        super(ASTRelevanceMeasure, self).__init__()
+    def __init__(self, ast_algorithm=consts.ASTAlgorithm.EASA, normalized=True, index_path=None,
+                 score_cache=None, workers=1):
+        super(ASTRelevanceMeasure, self).__init__(score_cache)
         self.ast_algorithm = ast_algorithm
         self.normalized = normalized
+        # Directory where the ASTs for the texts get saved to be reused (see AST.save())
+        self.index_path = index_path
+        # Number of processes to build the ASTs in
+        self.workers = workers
+        self._query_trie = None
 
     def set_text_collection(self, texts, language=consts.Language.ENGLISH):
         self.texts = texts
         self.language = language
 
+        if self.workers > 1 and len(texts) > 1:
+            self.asts = self._get_asts_parallel(texts)
+            return
+
         self.asts = []
         total_texts = len(texts)
 
         for i in xrange(total_texts):
             # NOTE(mikhaildubov): utils.text_to_strings_collection()
             #                     does utils.prepare_text() as well.
-            self.asts.append(base.AST.get_ast(
-                                    utils.text_to_strings_collection(texts[i]),
-                                    self.ast_algorithm))
+            self.asts.append(self._get_ast(utils.text_to_strings_collection(texts[i])))
             logging.progress("Indexing texts with ASTs", i + 1, total_texts)
 
         logging.clear()
 
-    def relevance(self, keyphrase, text, synonimizer=None):
+    def _get_ast(self, strings_collection):
+        if not self.index_path:
+            return base.AST.get_ast(strings_collection, self.ast_algorithm)
+        return _get_saved_ast(strings_collection, self.ast_algorithm, self.index_path)[0]
+
+    def _get_asts_parallel(self, texts):
+        # NOTE(msdubov): The workers save the ASTs they build and the parent process
+        #                memory-maps them, so that the arrays never get pickled.
+        index_path = self.index_path or tempfile.mkdtemp()
+        # NOTE(msdubov): The same texts get indexed once (they would be saved to the same path).
+        unique_texts = {}
+        for i, text in enumerate(texts):
+            unique_texts.setdefault(text, i)
+        unique_indices = sorted(unique_texts.itervalues())
+        workers = min(self.workers, len(unique_indices))
+        chunks = _chunk_texts([texts[i] for i in unique_indices], workers * 4)
+        pool = multiprocessing.Pool(workers)
+        try:
+            paths = {}
+            tasks = [(self.ast_algorithm, index_path,
+                      [(unique_indices[k], texts[unique_indices[k]]) for k in chunk])
+                     for chunk in chunks]
+            indexed_texts = 0
+            for chunk_paths in pool.imap_unordered(_build_asts, tasks):
+                for i, path in chunk_paths:
+                    paths[i] = path
+                indexed_texts += len(chunk_paths)
+                logging.progress("Indexing texts with ASTs", indexed_texts, len(unique_indices))
+            asts = {}
+            for i in unique_indices:
+                if paths[i] not in asts:
+                    asts[paths[i]] = base.AST.load(paths[i])
+            return [asts[paths[unique_texts[text]]] for text in texts]
+        finally:
+            pool.close()
+            pool.join()
+            logging.clear()
+            if not self.index_path:
+                # NOTE(msdubov): Files that are already memory-mapped stay accessible
+                #                after they get removed (on POSIX systems).
+                shutil.rmtree(index_path, ignore_errors=True)
+
+    def _score_cache_params(self):
+        return (consts.RelevanceMeasure.AST, self.ast_algorithm, self.normalized)
+
+    def _relevance(self, keyphrase, text, synonimizer=None):
         return self.asts[text].score(keyphrase, normalized=self.normalized,
                                      synonimizer=synonimizer)
 
+    def _relevance_upper_bounds(self, keyphrase, synonimizer=None):
+        if synonimizer:
+            return None
+        return [ast.score_upper_bound(keyphrase, normalized=self.normalized)
+                for ast in self.asts]
+
+    def _relevance_many(self, keyphrases, text, synonimizer=None):
+        if synonimizer:
+            return self.asts[text].score_many(keyphrases, normalized=self.normalized,
+                                              synonimizer=synonimizer)
+        # NOTE(msdubov): The same batch of keyphrases usually gets scored against all the
+        #                texts, so the trie of their suffixes is built once for all of them.
+        keyphrases = tuple(keyphrases)
+        if self._query_trie is None or self._query_trie[0] != keyphrases:
+            self._query_trie = (keyphrases, ast_utils.QueryTrie(keyphrases))
+        return self.asts[text].score_many(self._query_trie[1], normalized=self.normalized)
+
+
+class CorpusASTRelevanceMeasure(ASTRelevanceMeasure):
+    """AST relevance measure backed by one generalized EASA built for all the texts.
+
+    Gives the same scores as ASTRelevanceMeasure, but scores each keyphrase against
+    all the texts in a single descent (see CorpusEnhancedAnnotatedSuffixArray).
+    """
+
+    scores_all_texts_at_once = True
+
+    def __init__(self, normalized=True, index_path=None, score_cache=None):
+        super(CorpusASTRelevanceMeasure, self).__init__(consts.ASTAlgorithm.CORPUS_EASA,
+                                                        normalized, index_path, score_cache)
+
+    def set_text_collection(self, texts, language=consts.Language.ENGLISH):
+        self.texts = texts
+        self.language = language
+
+        strings_collection = []
+        strings_documents = []
+        total_texts = len(texts)
+        for i in xrange(total_texts):
+            text_strings_collection = utils.text_to_strings_collection(texts[i])
+            strings_collection.extend(text_strings_collection)
+            strings_documents.extend([i] * len(text_strings_collection))
+            logging.progress("Preparing texts", i + 1, total_texts)
+
+        logging.clear()
+
+        self.ast = self._get_ast(strings_collection, strings_documents)
+        self._scores = None
+
+    def _get_ast(self, strings_collection, strings_documents):
+        if not self.index_path:
+            return base.AST.get_ast(strings_collection, self.ast_algorithm,
+                                    strings_documents=strings_documents)
+        digest = hashlib.sha1(u"\n".join(strings_collection).encode("utf-8"))
+        digest.update(np.array(strings_documents, dtype="<i8").tostring())
+        path = os.path.join(self.index_path, self.ast_algorithm, digest.hexdigest())
+        try:
+            return base.AST.load(path)
+        except (exceptions.IndexNotFoundException, exceptions.IndexFormatException):
+            ast = base.AST.get_ast(strings_collection, self.ast_algorithm,
+                                   strings_documents=strings_documents)
+            ast.save(path)
+            return ast
+
+    def top_texts_many(self, keyphrases, k, synonimizer=None):
+        # NOTE(msdubov): The scores for all the texts come at once, so there is nothing
+        #                to prune here.
+        return _top_texts(self.ast.score_documents_many(keyphrases, self.normalized,
+                                                        synonimizer), k)
+
+    def _relevance(self, keyphrase, text, synonimizer=None):
+        return self.ast.score_documents(keyphrase, normalized=self.normalized,
+                                        synonimizer=synonimizer)[text]
+
+    def _relevance_many(self, keyphrases, text, synonimizer=None):
+        return self._relevance_many_from_block(keyphrases, text, synonimizer)
+
+    def _relevance_block(self, keyphrases, texts, synonimizer=None):
+        return self.ast.score_documents_many(keyphrases, self.normalized, synonimizer,
+                                             documents=texts)
+
 
 class CosineRelevanceMeasure(RelevanceMeasure):
 
+    scores_all_texts_at_once = True
+
     def __init__(self, vector_space=consts.VectorSpace.STEMS,
-                 term_weighting=consts.TermWeighting.TF_IDF):
-        super(CosineRelevanceMeasure, self).__init__()
+                 term_weighting=consts.TermWeighting.TF_IDF, score_cache=None, workers=1):
+        super(CosineRelevanceMeasure, self).__init__(score_cache)
         self.vector_space = vector_space
         self.term_weighting = term_weighting
-        
+        # Number of processes to stem / lemmatize the tokens in
+        self.workers = workers
+        self._query_vectors = {}
+        self._terms = {}
 
     def set_text_collection(self, texts, language=consts.Language.ENGLISH):
+        self.texts = texts
         self.language = language
-        if self.vector_space == consts.VectorSpace.STEMS:
-            self.stemmer = snowball.SnowballStemmer(self.language)
+        # NOTE(msdubov): Lemmatizer in case of the lemmata vector space.
+        self.stemmer = _get_stemmer(self.vector_space, self.language)
+        # NOTE(msdubov): Memo table {token: term} for the tokens of the texts.
+        self._terms = {}
         raw_tokens = []
         total_texts = len(texts)
         for i in xrange(total_texts):
@@ -79,90 +417,414 @@ class CosineRelevanceMeasure(RelevanceMeasure):
 
         # Terms define the vector space (they can be words, stems or lemmata). They should be
         # defined once here because they will be reused when we compute td-idf for queries
-        self.terms = list(set(utils.flatten(preprocessed_tokens)))
-        self.tf, self.idf = self._tf_idf(preprocessed_tokens)
-
-
-    def _preprocess_tokens(self, tokens_in_texts):
+        self.terms, self.term_index, self.idf, self.vectors = self._tf_idf(preprocessed_tokens)
+        # Inverted index: the postings (texts, weights) of each of the terms, with the texts
+        # in ascending order, and the maximal weight of each term
+        self.postings = self._transpose(self.vectors, len(self.terms))
+        self.max_weights = (np.maximum.reduceat(self.postings[2], self.postings[0][:-1])
+                            if self.terms else np.zeros(0))
+        self._query_vectors = {}
+        self._scores = None
+        self._cache_params = self._get_cache_params()
+
+
+    def _preprocess_tokens(self, tokens_in_texts, memoize=True):
+        """Transforms the tokens to the terms of the vector space.
+
+        :param memoize: whether to keep the terms for the new tokens in the memo table;
+                        the tokens of the queries do not get there, so that the table
+                        does not grow while the measure is being used.
+        """
         if self.vector_space == consts.VectorSpace.WORDS:
             return tokens_in_texts
-        if self.vector_space == consts.VectorSpace.STEMS:
-            # TODO(mikhaildubov): If the user does not specify the language, can we do some
-            #                     auto language detection here?
-            stemmed_tokens = []
-            total_texts = len(tokens_in_texts)
-            for i in xrange(total_texts):
-                stemmed_tokens.append([self.stemmer.stem(token) for token in tokens_in_texts[i]])
-                logging.progress("Stemming tokens in texts", i + 1, total_texts)
-            return stemmed_tokens
-        elif self.vector_space == consts.VectorSpace.LEMMATA:
-            # TODO(mikhaildubov): Implement this (what lemmatizer to use here?)
-            raise NotImplemented()
-
+        # TODO(mikhaildubov): If the user does not specify the language, can we do some
+        #                     auto language detection here?
+        # NOTE(msdubov): Natural language vocabularies are Zipfian, so most of the token
+        #                occurrences repeat; each distinct token gets stemmed / lemmatized once.
+        new_tokens = set()
+        for tokens in tokens_in_texts:
+            new_tokens.update(token for token in tokens if token not in self._terms)
+        new_tokens = list(new_tokens)
+        terms = self._terms if memoize else {}
+        if self.workers > 1 and len(new_tokens) >= PARALLEL_PREPROCESSING_MIN_TOKENS:
+            terms.update(self._get_terms_parallel(new_tokens))
+        else:
+            for i, token in enumerate(new_tokens):
+                terms[token] = _get_term(self.stemmer, token)
+                if (i + 1) % 1000 == 0 or i + 1 == len(new_tokens):
+                    logging.progress("Preprocessing tokens", i + 1, len(new_tokens))
         logging.clear()
+        return [[self._terms[token] if token in self._terms else terms[token]
+                 for token in tokens] for tokens in tokens_in_texts]
+
+
+    def _get_terms_parallel(self, tokens):
+        workers = min(self.workers, len(tokens))
+        pool = multiprocessing.Pool(workers)
+        try:
+            tasks = [(self.vector_space, self.language, tokens[start:end])
+                     for start, end in utils.ranges(len(tokens), workers * 4)]
+            terms = {}
+            for chunk_terms in pool.imap_unordered(_get_terms, tasks):
+                terms.update(chunk_terms)
+                logging.progress("Preprocessing tokens", len(terms), len(tokens))
+            return terms
+        finally:
+            pool.close()
+            pool.join()
+            logging.clear()
 
 
     def _tf_idf(self, tokens_in_texts):
-        # Calculate the inverted term index to facilitate further calculations
-        # This is a mapping from a token to its position in the vector
+        """Computes the (normalized) vectors of the texts in one pass over their tokens.
+
+        :returns: tuple (terms, {term: index}, IDF array or None, text vectors), where
+                  the text vectors are stored in the compressed sparse row format as
+                  a tuple (indptr, indices, data): the vector of the i-th text has the values
+                  data[indptr[i]:indptr[i + 1]] for the terms with the indices
+                  indices[indptr[i]:indptr[i + 1]] (in ascending order).
+        """
+        terms = []
         term_index = {}
-        for i in xrange(len(self.terms)):
-            term_index[self.terms[i]] = i
-
         total_texts = len(tokens_in_texts)
-        terms_count = len(self.terms)
-
-        # Calculate TF and IDF
-        tf = [np.zeros(terms_count) for _ in xrange(total_texts)]
-        idf_per_ferm = defaultdict(int)
+        indptr = np.zeros(total_texts + 1, dtype=np.int64)
+        indices = array.array("i")
+        counts = array.array("d")
         for i in xrange(total_texts):
             logging.progress("Processing texts for TF-IDF", i + 1, total_texts)
             # NOTE(mikhaildubov): For TF, we want to count each term as many time as it appears
-            for term in tokens_in_texts[i]:
-                if term in term_index:
-                    tf[i][term_index[term]] += 1
-            # NOTE(mikhaildubov): For IDF, we want to count each document once for each term
-            if self.term_weighting == consts.TermWeighting.TF_IDF:
-                for term in set(tokens_in_texts[i]):
-                    if term in term_index:
-                        idf_per_ferm[term] += 1
-            # TF Normalization
-            tf[i] = [freq * 1.0 / max(len(tokens_in_texts[i]), 1) for freq in tf[i]]
-        # Actual IDF metric calculation
+            text_counts = []
+            for term, count in Counter(tokens_in_texts[i]).iteritems():
+                if term not in term_index:
+                    term_index[term] = len(terms)
+                    terms.append(term)
+                text_counts.append((term_index[term], count))
+            text_counts.sort()
+            indices.extend(index for index, _ in text_counts)
+            counts.extend(count for _, count in text_counts)
+            indptr[i + 1] = len(indices)
+        indices = np.frombuffer(indices, dtype=np.int32) if indices else np.zeros(0, np.int32)
+        data = np.frombuffer(counts, dtype=np.float) if counts else np.zeros(0)
+
+        # NOTE(msdubov): TF normalization by the text length does not change the cosine
+        #                similarity, so the vectors get just normalized to the unit length.
         if self.term_weighting == consts.TermWeighting.TF_IDF:
-            idf = np.zeros(len(self.terms))
-            for term in idf_per_ferm:
-                idf[term_index[term]] = 1 + math.log(total_texts * 1.0 / idf_per_ferm[term])
+            # NOTE(mikhaildubov): For IDF, we want to count each document once for each term
+            documents_per_term = np.bincount(indices, minlength=len(terms))
+            idf = 1 + np.log(total_texts * 1.0 / np.maximum(documents_per_term, 1))
+            data = data * idf[indices]
         else:
             idf = None
+        rows = np.repeat(np.arange(total_texts), np.diff(indptr))
+        norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=total_texts))
+        data = data / norms[rows]
 
         logging.clear()
 
-        return tf, idf
-
-
-    def _cosine_similarity(self, u, v):
-        u_norm = math.sqrt(np.dot(u, u)) if np.count_nonzero(u) else 1.0
-        v_norm = math.sqrt(np.dot(v, v)) if np.count_nonzero(v) else 1.0
-        return np.dot(u, v) / (u_norm * v_norm)
+        return terms, term_index, idf, (indptr, indices, data)
+
+
+    def _transpose(self, vectors, columns_count):
+        """Returns the transposed sparse matrix, i.e. the (texts, values) for each of the terms
+        when given the text vectors, in the same format."""
+        indptr, indices, data = vectors
+        rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        order = np.argsort(indices, kind="mergesort")
+        return (np.searchsorted(indices[order], np.arange(columns_count + 1)),
+                rows[order], data[order])
+
+
+    def score_texts_many(self, keyphrases, texts=None):
+        """Computes the relevance of each of the keyphrases to the texts at once.
+
+        Only the postings of the query terms (or, if that takes less work, the vectors
+        of the texts) get processed; the texts having none of the terms of a keyphrase
+        get the score of exactly 0.
+
+        :param texts: list of the indices of the texts (all the texts by default)
+        :returns: numpy array of shape (len(keyphrases), len(texts))
+        """
+        # NOTE(msdubov): This is the product of the sparse (keyphrase x term) matrix of
+        #                the query vectors and the (term x text) matrix of the text vectors,
+        #                computed through the postings of the query terms.
+        queries = [self._get_query_vector(keyphrase) for keyphrase in keyphrases]
+        texts_count = len(self.vectors[0]) - 1
+        columns_count = texts_count if texts is None else len(texts)
+        if not queries:
+            return np.zeros((0, columns_count))
+        query_rows = np.repeat(np.arange(len(queries)), [len(query[0]) for query in queries])
+        query_terms = np.concatenate([query[0] for query in queries])
+        query_data = np.concatenate([query[1] for query in queries])
+        indptr, postings_texts, data = self.postings
+        lengths = indptr[query_terms + 1] - indptr[query_terms]
+        if texts is None:
+            cells = utils.ranges_concatenation(indptr[query_terms], lengths)
+            columns = postings_texts[cells]
+        else:
+            texts = np.asarray(texts, dtype=np.int)
+            texts_indptr = self.vectors[0]
+            texts_lengths = texts_indptr[texts + 1] - texts_indptr[texts]
+            if texts_lengths.sum() < lengths.sum():
+                return self._score_texts_vectors(len(queries), query_rows, query_terms,
+                                                 query_data, texts, texts_lengths)
+            cells = utils.ranges_concatenation(indptr[query_terms], lengths)
+            text_columns = np.full(texts_count, -1, dtype=np.int)
+            text_columns[texts] = np.arange(len(texts))
+            columns = text_columns[postings_texts[cells]]
+            in_texts = columns >= 0
+            cells, columns = cells[in_texts], columns[in_texts]
+            lengths = np.bincount(np.repeat(np.arange(len(lengths)), lengths)[in_texts],
+                                  minlength=len(lengths))
+        scores = np.bincount(np.repeat(query_rows, lengths) * columns_count + columns,
+                             weights=np.repeat(query_data, lengths) * data[cells],
+                             minlength=len(queries) * columns_count)
+        return scores.reshape(len(queries), columns_count)
+
+    def _score_texts_vectors(self, queries_count, query_rows, query_terms, query_data, texts,
+                             texts_lengths):
+        """Computes the product of the query vectors (given as a sparse matrix) and
+        the vectors of a few texts through the vectors of these texts."""
+        indptr, terms, data = self.vectors
+        cells = utils.ranges_concatenation(indptr[texts], texts_lengths)
+        order = np.argsort(query_terms, kind="mergesort")
+        sorted_terms = query_terms[order]
+        starts = np.searchsorted(sorted_terms, terms[cells], side="left")
+        matches = np.searchsorted(sorted_terms, terms[cells], side="right") - starts
+        query_cells = order[utils.ranges_concatenation(starts, matches)]
+        columns = np.repeat(np.repeat(np.arange(len(texts)), texts_lengths), matches)
+        scores = np.bincount(query_rows[query_cells] * len(texts) + columns,
+                             weights=query_data[query_cells] * np.repeat(data[cells], matches),
+                             minlength=queries_count * len(texts))
+        return scores.reshape(queries_count, len(texts))
+
+
+    def top_texts_many(self, keyphrases, k, synonimizer=None):
+        res = []
+        for i, keyphrase in enumerate(keyphrases):
+            res.append(self._top_texts_max_score(keyphrase, k))
+            logging.progress("Finding the most relevant texts", i + 1, len(keyphrases))
+        logging.clear()
+        return res
+
+
+    def _top_texts_max_score(self, keyphrase, k):
+        """Finds the k texts the keyphrase is the most relevant to with the max-score
+        optimization: the postings of the query terms get processed in the descending order
+        of the maximal scores they can contribute, until the rest of the terms cannot bring
+        a new text into the top k. The rest of the postings then get only looked up for
+        the texts that can still get there."""
+        query_indices, query_data = self._get_query_vector(keyphrase)
+        indptr, texts, data = self.postings
+        # NOTE(msdubov): The scores get accumulated in a different order here, so the bounds
+        #                are made a bit looser to stay valid despite the rounding errors.
+        bounds = query_data * self.max_weights[query_indices] * (1 + 1e-9)
+        order = np.argsort(-bounds, kind="mergesort")
+        remaining_bounds = np.concatenate((np.cumsum(bounds[order][::-1])[::-1], [0]))
+        candidates = None
+        for step, term in enumerate(order):
+            start, end = indptr[query_indices[term]], indptr[query_indices[term] + 1]
+            touched = texts[start:end] if candidates is None else np.union1d(candidates,
+                                                                             texts[start:end])
+            candidates = touched
+            if len(candidates) < k:
+                continue
+            partial_scores = self._score_texts(query_indices[order[:step + 1]],
+                                               query_data[order[:step + 1]], candidates)
+            threshold = np.partition(partial_scores, len(partial_scores) - k)[-k]
+            if remaining_bounds[step + 1] < threshold:
+                # NOTE(msdubov): The texts not touched so far cannot get into the top k.
+                candidates = candidates[partial_scores + remaining_bounds[step + 1] >= threshold]
+                break
+        if candidates is None or len(candidates) < k:
+            # NOTE(msdubov): There are less than k texts sharing terms with the keyphrase,
+            #                so some of the texts with zero scores get into the top.
+            return _top_texts(self.score_texts_many([keyphrase]), k)[0]
+        scores = self._score_texts(query_indices, query_data, candidates).tolist()
+        return sorted(zip(candidates.tolist(), scores),
+                      key=lambda (text, score): (-score, text))[:k]
+
+
+    def _score_texts(self, query_indices, query_data, texts):
+        """Computes the scores of the query in the given texts (in ascending order)
+        by looking up the texts in the postings of the query terms."""
+        indptr, postings_texts, postings_data = self.postings
+        scores = np.zeros(len(texts))
+        # NOTE(msdubov): The terms get processed in the ascending order, so that the scores
+        #                are the same as the ones computed by score_texts_many().
+        for term, weight in sorted(itertools.izip(query_indices.tolist(), query_data.tolist())):
+            start, end = indptr[term], indptr[term + 1]
+            positions = np.minimum(np.searchsorted(postings_texts[start:end], texts),
+                                   end - start - 1)
+            found = postings_texts[start:end][positions] == texts
+            scores[found] += weight * postings_data[start:end][positions[found]]
+        return scores
+
+
+    def _get_query_vector(self, keyphrase):
+        # NOTE(msdubov): Each keyphrase gets tokenized and vectorized once.
+        if keyphrase not in self._query_vectors:
+            query_tokens = self._preprocess_tokens([utils.tokenize_and_filter(keyphrase)],
+                                                   memoize=False)[0]
+            self._query_vectors[keyphrase] = self._query_vector(query_tokens)
+        return self._query_vectors[keyphrase]
+
+
+    def _query_vector(self, query_tokens):
+        """Returns the normalized vector of the query as a tuple (indices, data)."""
+        # NOTE(mikhaildubov): Query vectors are defined in the same vector space as document
+        #                     vectors; IDF is computed for the query alone, so it is 1 for
+        #                     all of its terms and the query vector is the same for TF and TF-IDF.
+        query_counts = sorted((self.term_index[term], count)
+                              for term, count in Counter(query_tokens).iteritems()
+                              if term in self.term_index)
+        indices = np.array([index for index, _ in query_counts], dtype=np.int32)
+        data = np.array([count for _, count in query_counts], dtype=np.float)
+        if len(data):
+            data /= math.sqrt(np.dot(data, data))
+        return indices, data
+
+
+    def _get_cache_params(self):
+        params = (consts.RelevanceMeasure.COSINE, self.vector_space, self.term_weighting,
+                  self.language)
+        if self.term_weighting == consts.TermWeighting.TF_IDF:
+            # NOTE(msdubov): IDF depends on the whole text collection.
+            params += (hashlib.sha1("".join(self._text_key(text)
+                                            for text in xrange(len(self.texts)))).hexdigest(),)
+        return params
 
+    def _score_cache_params(self):
+        # NOTE(msdubov): The parameters get computed once for the text collection
+        #                (see set_text_collection()), since they are needed for every score.
+        return self._cache_params
 
-    def relevance(self, keyphrase, text, synonimizer=None):
+    def _relevance(self, keyphrase, text, synonimizer=None):
         # Based on: https://janav.wordpress.com/2013/10/27/tf-idf-and-cosine-similarity/,
         # but query vectors are defined here in the same vector space as document vectors
         # (not in the reduced one as in the article).
-
-        # TF-IDF for query tokens
-        query_tokens = self._preprocess_tokens([utils.tokenize_and_filter(keyphrase)])
-        query_tf, query_idf = self._tf_idf(query_tokens)
-        query_tf = query_tf[0]
-
-        # Weighting for both text and query (either TF or TF-IDF)
-        if self.term_weighting == consts.TermWeighting.TF:
-            text_vector = self.tf[text]
-            query_vector = query_tf
-        elif self.term_weighting == consts.TermWeighting.TF_IDF:
-            text_vector = np.multiply(self.tf[text], self.idf)
-            query_vector = np.multiply(query_tf, query_idf)
-
-        return self._cosine_similarity(text_vector, query_vector)
+        query_indices, query_data = self._get_query_vector(keyphrase)
+
+        indptr, indices, data = self.vectors
+        start, end = indptr[text], indptr[text + 1]
+        if start == end or not len(query_indices):
+            return 0.0
+        # NOTE(msdubov): Both vectors are sparse, with the term indices sorted.
+        text_indices = indices[start:end]
+        positions = np.minimum(np.searchsorted(text_indices, query_indices), end - start - 1)
+        found = text_indices[positions] == query_indices
+        return float(np.dot(data[start:end][positions[found]], query_data[found]))
+
+    def _relevance_many(self, keyphrases, text, synonimizer=None):
+        return self._relevance_many_from_block(keyphrases, text, synonimizer)
+
+    def _relevance_block(self, keyphrases, texts, synonimizer=None):
+        return self.score_texts_many(keyphrases, texts)
+
+
+def _top_texts(scores, k):
+    """Returns the results of RelevanceMeasure.top_texts_many() for the matrix of
+    the scores of the keyphrases (rows) in all the texts (columns)."""
+    res = []
+    for keyphrase_scores in scores.tolist():
+        res.append([(text, keyphrase_scores[text])
+                    for text in heapq.nsmallest(k, xrange(len(keyphrase_scores)),
+                                                key=lambda text: (-keyphrase_scores[text],
+                                                                  text))])
+    return res
+
+
+def _get_stemmer(vector_space, language):
+    """Returns the stemmer (or the lemmatizer) for the vector space, if it needs one."""
+    if vector_space == consts.VectorSpace.STEMS:
+        return snowball.SnowballStemmer(language)
+    elif vector_space == consts.VectorSpace.LEMMATA:
+        # NOTE(msdubov): WordNet only has English lemmata.
+        if language != consts.Language.ENGLISH:
+            raise exceptions.LemmataNotSupportedException(language=language)
+        return wordnet.WordNetLemmatizer()
+    return None
+
+
+def _get_term(stemmer, token):
+    """Transforms the token to the term of the vector space (see _get_stemmer())."""
+    if stemmer is None:
+        return token
+    if isinstance(stemmer, wordnet.WordNetLemmatizer):
+        # NOTE(msdubov): The tokens are in upper case, so they get lowercased
+        #                (just like the stemmer does).
+        return stemmer.lemmatize(token.lower())
+    return stemmer.stem(token)
+
+
+def _get_terms(task):
+    """Stems / lemmatizes a chunk of tokens in a worker process.
+
+    :param task: tuple (vector_space, language, list of tokens)
+    :returns: dictionary {token: term}
+    """
+    vector_space, language, tokens = task
+    stemmer = _get_stemmer(vector_space, language)
+    return {token: _get_term(stemmer, token) for token in tokens}
+
+
+def _get_saved_ast(strings_collection, ast_algorithm, index_path):
+    """Loads the AST for the strings from index_path, building and saving it if needed.
+
+    :returns: tuple (AST, path it is saved to)
+    """
+    path = _saved_ast_path(strings_collection, ast_algorithm, index_path)
+    try:
+        return base.AST.load(path), path
+    except (exceptions.IndexNotFoundException, exceptions.IndexFormatException):
+        ast = base.AST.get_ast(strings_collection, ast_algorithm)
+        ast.save(path)
+        return ast, path
+
+
+def _saved_ast_path(strings_collection, ast_algorithm, index_path):
+    # NOTE(msdubov): ASTs are saved under the hash of the strings they are built for.
+    digest = hashlib.sha1(u"\n".join(strings_collection).encode("utf-8")).hexdigest()
+    return os.path.join(index_path, ast_algorithm, digest)
+
+
+def _build_asts(task):
+    """Builds (or finds) the saved ASTs for a chunk of texts in a worker process.
+
+    :param task: tuple (ast_algorithm, index_path, list of (text index, text))
+    :returns: list of (text index, path to the saved AST)
+    """
+    ast_algorithm, index_path, texts = task
+    res = []
+    for i, text in texts:
+        strings_collection = utils.text_to_strings_collection(text)
+        path = _saved_ast_path(strings_collection, ast_algorithm, index_path)
+        # NOTE(msdubov): The ASTs already saved do not get loaded here, only in the parent.
+        if not base.AST.is_saved(path):
+            base.AST.get_ast(strings_collection, ast_algorithm).save(path)
+        res.append((i, path))
+    return res
+
+
+def _chunk_texts(texts, chunks_count):
+    """Splits the texts into chunks of roughly equal total length.
+
+    The chunks go in the descending order of their texts' lengths: huge texts form chunks
+    on their own and get scheduled first, so that they do not end up as stragglers.
+
+    :returns: list of lists of text indices
+    """
+    order = sorted(xrange(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    chunk_length = max(sum(len(text) for text in texts) // max(chunks_count, 1), 1)
+    chunks = []
+    chunk = []
+    length = 0
+    for i in order:
+        chunk.append(i)
+        length += len(texts[i])
+        if length >= chunk_length:
+            chunks.append(chunk)
+            chunk = []
+            length = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
@@ -2,8 +2,8 @@
 
 import codecs
 import collections
-import itertools
 import math
+import multiprocessing
 import os
 import subprocess
 from xml.dom import minidom
@@ -17,22 +17,22 @@ from east.synonyms import utils
 
 class SynonymExtractor(object):
 
-    def __init__(self, input_path):
+    def __init__(self, input_path, workers=1):
         self.current_os = utils.determine_operating_system()
         self.tomita_path, self.tomita_binary = self._get_tomita_path()
         if self.tomita_binary is None:
             raise exceptions.TomitaNotInstalledException()
         self.text, self.number_of_texts = self._retrieve_text(input_path)
-        self.dependency_triples, self.dt_for_r, self.dt_for_w1r, self.dt_for_rw2 = \
-            self._retrieve_dependency_triples(self.text)
+        self.dependency_triples = self._retrieve_dependency_triples(self.text)
         self.word_frequencies = self._calculate_word_frequencies(self.text)
         self.frequencies = self._calculate_dt_frequencies(self.dependency_triples)
         self.words = set([dt[0] for dt in self.dependency_triples] +
                          [dt[2] for dt in self.dependency_triples])
         self.relations = set([dt[1] for dt in self.dependency_triples])
-        self.I_memoized = {}
-        self.T_memoized = {}
-        self.synonyms_memoized = {}
+        self.features, self.features_sums = self._calculate_features(self.frequencies)
+        # Number of processes to compute the word similarities in
+        self.workers = workers
+        self._synonyms = None
 
     def _retrieve_text(self, input_path):
         if os.path.isdir(input_path):
@@ -53,11 +53,6 @@ class SynonymExtractor(object):
 
         dependency_triples = []
 
-        # Additional indexes to speed up the calculation of I(w1, r, w2)
-        dt_for_r = collections.defaultdict(list)
-        dt_for_w1r = collections.defaultdict(list)
-        dt_for_rw2 = collections.defaultdict(list)
-
         p = subprocess.Popen([self.tomita_binary, "config.proto"],
                              stdin=subprocess.PIPE, stdout=subprocess.PIPE,
                              stderr=subprocess.PIPE, cwd=self.tomita_path,
@@ -73,19 +68,13 @@ class SynonymExtractor(object):
 
             dt = (w1, r, w2)
             dependency_triples.append(dt)
-            dt_for_r[r].append(dt)
-            dt_for_w1r[(w1, r)].append(dt)
-            dt_for_rw2[(r, w2)].append(dt)
 
             # NOTE(msdubov): Also add inversed triples.
             r_inv = r[:-3] if r.endswith("_of") else (r + "_of")
             dt_inv = (w2, r_inv, w1)
             dependency_triples.append(dt_inv)
-            dt_for_r[r_inv].append(dt_inv)
-            dt_for_w1r[(w2, r_inv)].append(dt_inv)
-            dt_for_rw2[(r_inv, w1)].append(dt_inv)
 
-        return dependency_triples, dt_for_r, dt_for_w1r, dt_for_rw2
+        return dependency_triples
 
     def _get_tomita_path(self):
         tomita_path = (os.path.dirname(os.path.abspath(__file__)) +
@@ -119,51 +108,133 @@ class SynonymExtractor(object):
             res[dt] += 1
         return res
 
-    def I(self, w1, r, w2):
-        if (w1, r, w2) in self.I_memoized:
-            return self.I_memoized[(w1, r, w2)]
+    def _calculate_features(self, frequencies):
+        """Computes the features of the words, i.e. the (r, w2) pairs with positive I(w1, r, w2).
+
+        :returns: tuple ({w1: {(r, w2): I(w1, r, w2)}}, {w1: sum of I(w1, r, w2) over
+                  the features of w1})
+        """
+        # NOTE(msdubov): The marginal counts sum the frequencies of the triples over all
+        #                their occurrences in the text, i.e. frequency^2 for each triple.
+        fr__r_ = collections.defaultdict(int)
+        fr_w1r_ = collections.defaultdict(int)
+        fr__rw2 = collections.defaultdict(int)
+        for (w1, r, w2), fr_w1rw2 in frequencies.iteritems():
+            fr__r_[r] += fr_w1rw2 * fr_w1rw2
+            fr_w1r_[(w1, r)] += fr_w1rw2 * fr_w1rw2
+            fr__rw2[(r, w2)] += fr_w1rw2 * fr_w1rw2
+
+        features = collections.defaultdict(dict)
+        for (w1, r, w2), fr_w1rw2 in frequencies.iteritems():
+            i = math.log(float(fr_w1rw2) * fr__r_[r] / fr_w1r_[(w1, r)] / fr__rw2[(r, w2)])
+            if i > 0:
+                features[w1][(r, w2)] = i
+        features = dict(features)
+        features_sums = {w: sum(w_features.itervalues())
+                         for w, w_features in features.iteritems()}
+        return features, features_sums
 
-        fr_w1rw2 = self.frequencies[w1, r, w2]
-        if not fr_w1rw2:
-            return 0.0
-        fr__r_ = sum(self.frequencies[triple] for triple in self.dt_for_r[r])
-        fr_w1r_ = sum(self.frequencies[triple] for triple in self.dt_for_w1r[(w1, r)])
-        fr__rw2 = sum(self.frequencies[triple] for triple in self.dt_for_rw2[(r, w2)])
-        res = max(math.log(float(fr_w1rw2) * fr__r_ / fr_w1r_ / fr__rw2), 0.0)
-        self.I_memoized[(w1, r, w2)] = res
-        return res
+    def I(self, w1, r, w2):
+        return self.features.get(w1, {}).get((r, w2), 0.0)
 
     def T(self, w):
-        if w in self.T_memoized:
-            return self.T_memoized[w]
-        res = set(filter(lambda (r, w_): self.I(w, r, w_) > 0,
-                         itertools.product(self.relations, self.words)))
-        self.T_memoized[w] = res
-        return res
+        return set(self.features.get(w, {}))
 
     def similarity(self, w1, w2):
-        numerator = sum(self.I(w1, r, w) + self.I(w2, r, w)
-                        for (r, w) in self.T(w1) & self.T(w2))
-        denominator = (sum(self.I(w1, r, w) for (r, w) in self.T(w1)) +
-                       sum(self.I(w2, r, w) for (r, w) in self.T(w2)))
+        features1 = self.features.get(w1, {})
+        features2 = self.features.get(w2, {})
+        if len(features1) > len(features2):
+            features1, features2 = features2, features1
+        numerator = sum(i + features2[feature]
+                        for feature, i in features1.iteritems() if feature in features2)
+        denominator = self.features_sums.get(w1, 0.0) + self.features_sums.get(w2, 0.0)
         if denominator:
             return numerator / denominator
         else:
             return 0.0
 
     def get_synonyms(self, threshold=0.3, return_similarity_measure=False):
+        # NOTE(msdubov): The synonyms get requested for every keyphrase, while computing
+        #                them takes many word similarities, so the last result is kept.
+        if self._synonyms is not None and self._synonyms[0] == (threshold,
+                                                                return_similarity_measure):
+            return self._synonyms[1]
         synonyms = collections.defaultdict(list)
         words = filter(lambda w: len(w) > 2 and
                                  self.word_frequencies[w] > self.number_of_texts / 50,
                        self.words)
-        combs = itertools.combinations(words, 2)
-        for w1, w2 in combs:
-            sim = self.similarity(w1, w2)
-            if sim > threshold:
-                if return_similarity_measure:
-                    synonyms[w1].append((w2, sim))
-                    synonyms[w2].append((w1, sim))
-                else:
-                    synonyms[w1].append(w2)
-                    synonyms[w2].append(w1)
+        for w1, w2, sim in self._similar_pairs(words, threshold):
+            if return_similarity_measure:
+                synonyms[w1].append((w2, sim))
+                synonyms[w2].append((w1, sim))
+            else:
+                synonyms[w1].append(w2)
+                synonyms[w2].append(w1)
+        self._synonyms = ((threshold, return_similarity_measure), synonyms)
         return synonyms
+
+    def _similar_pairs(self, words, threshold):
+        """Finds the pairs of the words with the similarity above the threshold.
+
+        Only the pairs of the words sharing features get scored, the similarity of the rest
+        being 0; the words get split between the worker processes, if there are any.
+
+        :returns: list of tuples (w1, w2, similarity), in the order of
+                  itertools.combinations(words, 2)
+        """
+        # Inverted index: the indices of the words having each of the features
+        postings = collections.defaultdict(list)
+        for i, word in enumerate(words):
+            for feature in self.features.get(word, ()):
+                postings[feature].append(i)
+
+        if self.workers <= 1 or len(words) < 2:
+            return _similar_pairs(self, words, postings, threshold, 0, len(words))
+
+        # NOTE(msdubov): The workers get forked from this process, so that they share
+        #                the features instead of copying them.
+        pool = multiprocessing.Pool(min(self.workers, len(words)), _init_similarity_worker,
+                                    (self, words, postings, threshold))
+        try:
+            res = []
+            # NOTE(msdubov): The first words have more pairs to score, so the chunks are small.
+            for pairs in pool.imap(_similar_pairs_chunk,
+                                   common_utils.ranges(len(words), self.workers * 16)):
+                res.extend(pairs)
+            return res
+        finally:
+            pool.close()
+            pool.join()
+
+
+def _similar_pairs(extractor, words, postings, threshold, start, end):
+    """Finds the similar pairs (see SynonymExtractor._similar_pairs()) with the first word
+    among words[start:end]."""
+    res = []
+    for i in xrange(start, end):
+        if threshold < 0:
+            # NOTE(msdubov): Even the words sharing no features are similar enough then.
+            candidates = xrange(i + 1, len(words))
+        else:
+            candidates = set()
+            for feature in extractor.features.get(words[i], ()):
+                candidates.update(postings[feature])
+            candidates = sorted(j for j in candidates if j > i)
+        for j in candidates:
+            sim = extractor.similarity(words[i], words[j])
+            if sim > threshold:
+                res.append((words[i], words[j], sim))
+    return res
+
+
+# State of a worker process computing the word similarities (see _init_similarity_worker())
+_similarity_worker = {}
+
+
+def _init_similarity_worker(extractor, words, postings, threshold):
+    _similarity_worker["task"] = (extractor, words, postings, threshold)
+
+
+def _similar_pairs_chunk(words_range):
+    start, end = words_range
+    return _similar_pairs(*(_similarity_worker["task"] + (start, end)))
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*
+
+import collections
+import itertools
+
+import numpy as np
+
+
+class KeyphrasesTable(collections.Mapping):
+    """
+    Keyphrases table stored as a dense (keyphrases x texts) matrix of float32 scores.
+
+    Besides the matrix and its labels, the table works as a read-only dictionary
+    of dictionaries {keyphrase: {text_name: score}}, just like the one returned
+    by applications.keyphrases_table() (up to the float32 precision of the scores).
+
+    """
+
+    def __init__(self, keyphrases, texts, scores):
+        """
+        :param keyphrases: list of the keyphrases (the labels of the matrix rows)
+        :param texts: list of the text names (the labels of the matrix columns)
+        :param scores: matrix of shape (len(keyphrases), len(texts))
+        """
+        self.keyphrases = list(keyphrases)
+        self.texts = list(texts)
+        self.scores = np.asarray(scores, dtype=np.float32).reshape(len(self.keyphrases),
+                                                                   len(self.texts))
+        self._keyphrase_indices = {keyphrase: i for i, keyphrase in enumerate(self.keyphrases)}
+        self._text_indices = {text: j for j, text in enumerate(self.texts)}
+
+    def __getitem__(self, keyphrase):
+        return self.Row(self, self._keyphrase_indices[keyphrase])
+
+    def __iter__(self):
+        return iter(self.keyphrases)
+
+    def __len__(self):
+        return len(self.keyphrases)
+
+    def rows(self, by_texts=False):
+        """Yields the rows of the table as applications.keyphrases_table_rows() does."""
+        if by_texts:
+            for j, text in enumerate(self.texts):
+                yield text, dict(itertools.izip(self.keyphrases, self.scores[:, j].tolist()))
+        else:
+            for i, keyphrase in enumerate(self.keyphrases):
+                yield keyphrase, dict(itertools.izip(self.texts, self.scores[i].tolist()))
+
+    def threshold(self, min_score):
+        """Returns the sparse table with only the scores that are at least min_score."""
+        mask = self.scores >= min_score
+        indptr = np.concatenate(([0], np.cumsum(mask.sum(axis=1))))
+        return SparseKeyphrasesTable(self.keyphrases, self.texts, indptr,
+                                     np.nonzero(mask)[1], self.scores[mask], min_score)
+
+    def to_dict(self):
+        return dict(self.rows())
+
+    class Row(collections.Mapping):
+
+        def __init__(self, table, index):
+            self.table = table
+            self.index = index
+
+        def __getitem__(self, text):
+            return float(self.table.scores[self.index, self.table._text_indices[text]])
+
+        def __iter__(self):
+            return iter(self.table.texts)
+
+        def __len__(self):
+            return len(self.table.texts)
+
+
+class SparseKeyphrasesTable(collections.Mapping):
+    """
+    Keyphrases table keeping only the scores that reach a threshold.
+
+    The scores are stored in the compressed sparse row format: the scores of the i-th keyphrase
+    are data[indptr[i]:indptr[i + 1]], for the texts with indices indices[indptr[i]:indptr[i + 1]]
+    (in ascending order). As a dictionary of dictionaries, the table only has the stored scores.
+
+    """
+
+    def __init__(self, keyphrases, texts, indptr, indices, data, threshold):
+        self.keyphrases = list(keyphrases)
+        self.texts = list(texts)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.data = np.asarray(data, dtype=np.float32)
+        self.threshold = threshold
+        self._keyphrase_indices = {keyphrase: i for i, keyphrase in enumerate(self.keyphrases)}
+
+    def __getitem__(self, keyphrase):
+        i = self._keyphrase_indices[keyphrase]
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return {self.texts[j]: score for j, score in
+                itertools.izip(self.indices[start:end].tolist(), self.data[start:end].tolist())}
+
+    def __iter__(self):
+        return iter(self.keyphrases)
+
+    def __len__(self):
+        return len(self.keyphrases)
+
+    def rows(self, by_texts=False):
+        """Yields the rows of the table as applications.keyphrases_table_rows() does,
+        only with the stored scores."""
+        if by_texts:
+            keyphrase_indices = np.repeat(np.arange(len(self.keyphrases)), np.diff(self.indptr))
+            order = np.argsort(self.indices, kind="mergesort")
+            texts_indptr = np.searchsorted(self.indices[order], np.arange(len(self.texts) + 1))
+            for j, text in enumerate(self.texts):
+                cells = order[texts_indptr[j]:texts_indptr[j + 1]]
+                yield text, {self.keyphrases[i]: score for i, score in
+                             itertools.izip(keyphrase_indices[cells].tolist(),
+                                            self.data[cells].tolist())}
+        else:
+            for keyphrase in self.keyphrases:
+                yield keyphrase, self[keyphrase]
+
+    def nnz(self):
+        """Returns the number of the stored scores."""
+        return len(self.data)
+
+    def to_dense(self):
+        """Returns the dense KeyphrasesTable, with zeros instead of the scores not stored."""
+        scores = np.zeros((len(self.keyphrases), len(self.texts)), dtype=np.float32)
+        scores[np.repeat(np.arange(len(self.keyphrases)), np.diff(self.indptr)),
+               self.indices] = self.data
+        return KeyphrasesTable(self.keyphrases, self.texts, scores)
+
+    def to_dict(self):
+        return dict(self.rows())
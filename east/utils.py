@@ -7,6 +7,7 @@ import re
 import sys
 
 from nltk.corpus import stopwords as nltk_stopwords
+import numpy as np
 
 
 class ImmutableMixin(object):
@@ -93,6 +94,22 @@ def flatten(lst):
     return list(itertools.chain.from_iterable(lst))
 
 
+def ranges(total, count):
+    """Splits range(total) into count contiguous ranges of (almost) equal lengths.
+
+    :returns: list of tuples (start, end)
+    """
+    bounds = [total * k // count for k in xrange(count + 1)]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def ranges_concatenation(starts, lengths):
+    """Returns the concatenation of the ranges [starts[i], starts[i] + lengths[i])."""
+    offsets = np.cumsum(lengths) - lengths
+    return (np.repeat(starts - offsets, lengths) +
+            np.arange(offsets[-1] + lengths[-1] if len(lengths) else 0))
+
+
 def output_is_redirected():
     return os.fstat(0) != os.fstat(1)
 
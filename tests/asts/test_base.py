@@ -1,9 +1,16 @@
 # -*- coding: utf-8 -*
 
 import itertools
+import json
+import os
+import shutil
+import tempfile
+
 import testtools
 
 from east.asts import base
+from east.asts import utils
+from east import exceptions
 
 
 class BASEAstTestCase(testtools.TestCase):
@@ -12,6 +19,7 @@ class BASEAstTestCase(testtools.TestCase):
         super(BASEAstTestCase, self).setUp()
         self.strings_collection = ["abcd efg ops", "xyzq", "test"]
         self.queries = ["aqcb", "efgp", "mn4"]
+        self.algorithms = ["easa", "ast_linear", "ast_naive"]
 
     def test_matching_scores_equality(self):
         algorithms = ["easa", "ast_linear", "ast_naive"]
@@ -22,3 +30,129 @@ class BASEAstTestCase(testtools.TestCase):
                 for query in self.queries:
                     self.assertEqual(ast1.score(query, normalized=normalized),
                                      ast2.score(query, normalized=normalized))
+
+    def test_matching_score_value(self):
+        for algorithm in self.algorithms:
+            ast = base.AST.get_ast(["XABXAC", "HI"], algorithm)
+            self.assertEqual(ast.score("ABCI"), 0.1875)
+            self.assertEqual(ast.score("NOPE"), 0)
+
+    def test_score_upper_bound(self):
+        strings_collection = ["XABXAC", "HI", "ABABABAB", "CAB"]
+        queries = ["ABCI", "NOPE", "ABABA", "XAB", "B", "CABABABX", "AB AB"]
+        for algorithm in self.algorithms:
+            ast = base.AST.get_ast(strings_collection, algorithm)
+            for query in queries:
+                for normalized in (True, False):
+                    self.assertTrue(ast.score(query, normalized=normalized) <=
+                                    ast.score_upper_bound(query, normalized=normalized))
+            self.assertEqual(0, ast.score_upper_bound("NOPQ"))
+            # NOTE(msdubov): The bound is exact for single characters.
+            self.assertAlmostEqual(ast.score("B"), ast.score_upper_bound("B"))
+
+    def test_suffix_scores_equality(self):
+        strings_collection = ["ABRACADABRA", "CADABRAABRA", "BRA", "ABRACAD"]
+        queries = ["ABRACADABRACADABRA", "RAABRACA", "DABRAX", "XXABRA", "A"]
+        for normalized in [True, False]:
+            for alg1, alg2 in itertools.combinations(self.algorithms, 2):
+                ast1 = base.AST.get_ast(strings_collection, alg1)
+                ast2 = base.AST.get_ast(strings_collection, alg2)
+                for query in queries:
+                    self.assertEqual(
+                        ast1.score(query, normalized=normalized, return_suffix_scores=True),
+                        ast2.score(query, normalized=normalized, return_suffix_scores=True))
+
+    def test_score_many(self):
+        queries = ["aqcb", "efgp", "mn4", "efg ops", "aqcb", "cd", ""]
+        for algorithm in self.algorithms:
+            ast = base.AST.get_ast(self.strings_collection, algorithm)
+            for normalized in [True, False]:
+                scores = ast.score_many(queries, normalized=normalized)
+                self.assertEqual(len(queries), len(scores))
+                for query, score in zip(queries, scores):
+                    if query:
+                        self.assertEqual(ast.score(query, normalized=normalized), score)
+                    else:
+                        self.assertEqual(0, score)
+                trie = utils.QueryTrie(queries)
+                self.assertEqual(scores.tolist(),
+                                 ast.score_many(trie, normalized=normalized).tolist())
+
+    def test_score_synonyms(self):
+        strings_collection = ["ABRACADABRA", "CADABRAABRA", "BRACAD", "ABRACAD", "DABRA"]
+        synonyms = {"ABRA": ["CAD", "ABRA", "BRAC"], "CAD": ["ABRA", "DAB"], "XYZ": ["RA"]}
+        synonimizer = FakeSynonymExtractor(synonyms)
+        queries = ["ABRA CAD", "CAD ABRA XYZ", "XYZ", "NOPE ABRA", "ABRA CAD ABRA", "BRA"]
+        for algorithm in self.algorithms:
+            ast = base.AST.get_ast(strings_collection, algorithm)
+            for normalized in [True, False]:
+                for query in queries:
+                    variants = itertools.product(*[[word] + synonyms.get(word, [])
+                                                   for word in query.split()])
+                    self.assertEqual(max(ast.score("".join(variant), normalized=normalized)
+                                         for variant in variants),
+                                     ast.score(query, normalized=normalized,
+                                               synonimizer=synonimizer))
+
+    def test_save_load(self):
+        strings_collection = ["ABRACADABRA", "CADABRAABRA", "BRA", u"ПРИВЕТ"]
+        queries = ["ABRACADABRACADABRA", "RAABRACA", "DABRAX", u"ВЕТЕР", "A"]
+        for algorithm in self.algorithms:
+            path = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, path)
+            ast = base.AST.get_ast(strings_collection, algorithm)
+            ast.save(path)
+            loaded_ast = base.AST.load(path)
+            self.assertIsInstance(loaded_ast, type(ast))
+            self.assertEqual(ast.strings_collection, loaded_ast.strings_collection)
+            for query in queries:
+                for normalized in [True, False]:
+                    self.assertEqual(
+                        ast.score(query, normalized=normalized, return_suffix_scores=True),
+                        loaded_ast.score(query, normalized=normalized,
+                                         return_suffix_scores=True))
+
+    def test_save_existing(self):
+        parent_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, parent_path)
+        path = os.path.join(parent_path, "easa", "ast")
+        self.assertFalse(base.AST.is_saved(path))
+        ast = base.AST.get_ast(self.strings_collection)
+        ast.save(path)
+        self.assertTrue(base.AST.is_saved(path))
+        # NOTE(msdubov): Saving the same AST again (e.g. by another process) keeps the saved one.
+        mtime = os.path.getmtime(os.path.join(path, "meta.json"))
+        ast.save(path)
+        self.assertEqual(mtime, os.path.getmtime(os.path.join(path, "meta.json")))
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        meta["format_version"] = -1
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        self.assertFalse(base.AST.is_saved(path))
+        ast.save(path)
+        self.assertTrue(base.AST.is_saved(path))
+        self.assertEqual(ast.score("ABRA"), base.AST.load(path).score("ABRA"))
+        # NOTE(msdubov): No temporary directories are left.
+        self.assertEqual(["ast"], os.listdir(os.path.join(parent_path, "easa")))
+
+    def test_load_errors(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.assertRaises(exceptions.IndexNotFoundException, base.AST.load, path)
+        base.AST.get_ast(self.strings_collection).save(path)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        meta["format_version"] = -1
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        self.assertRaises(exceptions.IndexFormatException, base.AST.load, path)
+
+
+class FakeSynonymExtractor(object):
+
+    def __init__(self, synonyms):
+        self.synonyms = synonyms
+
+    def get_synonyms(self):
+        return self.synonyms
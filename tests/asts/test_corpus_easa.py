@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*
+
+import os
+import shutil
+import tempfile
+
+import testtools
+
+from east.asts import base
+from east.asts import corpus_easa
+from east import consts
+from tests.asts import test_base
+
+
+class CorpusEasaTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(CorpusEasaTestCase, self).setUp()
+        self.documents = [
+            ["XABXAC", "HI"],
+            ["ABRACADABRA", "CADABRAABRA", "BRA"],
+            ["AAAA", "AA"],
+            [" "],
+            [u"ПРИВЕТМИР", "ABC"]
+        ]
+        self.queries = ["ABCI", "ABRACADABRA", "AAAAA", "RAC", u"МИР", "NOPE", "A"]
+
+    def test_score_documents(self):
+        index = corpus_easa.CorpusEnhancedAnnotatedSuffixArray.from_documents(self.documents)
+        asts = [base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+                for strings_collection in self.documents]
+        for normalized in [True, False]:
+            for query in self.queries:
+                self.assertEqual([ast.score(query, normalized=normalized) for ast in asts],
+                                 index.score_documents(query, normalized=normalized).tolist())
+
+    def test_score_documents_string_endings(self):
+        # NOTE(msdubov): The characters of the texts must not match the endings of the strings,
+        #                whatever characters these are.
+        documents = [["Y"], [u"\u0a01X"], [u"\u0a00\u0a01", u"\u0a02"]]
+        index = corpus_easa.CorpusEnhancedAnnotatedSuffixArray.from_documents(documents)
+        for query, renamed_query in ((u"\u0a01X", "BX"), (u"\u0a00\u0a01\u0a02", "ABC")):
+            self.assertEqual([base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+                              .score(renamed_query)
+                              for strings_collection in (["Y"], ["BX"], ["AB", "C"])],
+                             index.score_documents(query).tolist())
+
+    def test_score_documents_synonyms(self):
+        synonimizer = test_base.FakeSynonymExtractor({"ABRA": ["AAAA", "XAB"], "CI": ["MIR"]})
+        index = corpus_easa.CorpusEnhancedAnnotatedSuffixArray.from_documents(self.documents)
+        asts = [base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+                for strings_collection in self.documents]
+        for normalized in [True, False]:
+            for query in ["ABRA CI", "CI ABRA", "ABRA"]:
+                self.assertEqual(
+                    [ast.score(query, normalized=normalized, synonimizer=synonimizer)
+                     for ast in asts],
+                    index.score_documents(query, normalized=normalized,
+                                          synonimizer=synonimizer).tolist())
+
+    def test_score_documents_many(self):
+        index = corpus_easa.CorpusEnhancedAnnotatedSuffixArray.from_documents(self.documents)
+        scores = index.score_documents_many(self.queries + ["", "ABCI"])
+        self.assertEqual((len(self.queries) + 2, len(self.documents)), scores.shape)
+        for query, query_scores in zip(self.queries, scores):
+            self.assertEqual(index.score_documents(query).tolist(), query_scores.tolist())
+        self.assertEqual([0] * len(self.documents), scores[-2].tolist())
+
+    def test_score_documents_subset(self):
+        synonimizer = test_base.FakeSynonymExtractor({"ABRA": ["AAAA", "XAB"], "CI": ["MIR"]})
+        index = corpus_easa.CorpusEnhancedAnnotatedSuffixArray.from_documents(self.documents)
+        for documents in ([1], [4, 0, 2], []):
+            for synonimizer in (None, synonimizer):
+                scores = index.score_documents_many(self.queries + ["ABRA CI"],
+                                                    synonimizer=synonimizer)
+                self.assertEqual(scores[:, documents].tolist(),
+                                 index.score_documents_many(self.queries + ["ABRA CI"],
+                                                            synonimizer=synonimizer,
+                                                            documents=documents).tolist())
+
+    def test_single_document(self):
+        strings_collection = ["ABRACADABRA", "CADABRAABRA"]
+        index = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.CORPUS_EASA)
+        ast = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+        for query in self.queries:
+            self.assertEqual([ast.score(query)], index.score_documents(query).tolist())
+            self.assertEqual(ast.score(query), index.score(query))
+
+    def test_save_load(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        index = corpus_easa.CorpusEnhancedAnnotatedSuffixArray.from_documents(self.documents)
+        index.save(path)
+        index_loaded = base.AST.load(path)
+        self.assertIsInstance(index_loaded, corpus_easa.CorpusEnhancedAnnotatedSuffixArray)
+        for query in self.queries:
+            self.assertEqual(index.score_documents(query).tolist(),
+                             index_loaded.score_documents(query).tolist())
+
+
+class SegmentedCorpusIndexTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(SegmentedCorpusIndexTestCase, self).setUp()
+        self.documents = [
+            ["XABXAC", "HI"],
+            ["ABRACADABRA", "CADABRAABRA", "BRA"],
+            ["AAAA", "AA"],
+            ["ABC"],
+            ["CABRA", "ABRACA"]
+        ]
+        self.queries = ["ABCI", "ABRACADABRA", "AAAAA", "RAC", "NOPE", "A"]
+
+    def assertScoresEqual(self, documents, index):
+        full_index = corpus_easa.CorpusEnhancedAnnotatedSuffixArray.from_documents(documents)
+        for query in self.queries:
+            self.assertEqual(full_index.score_documents(query).tolist(),
+                             index.score_documents(query).tolist())
+        self.assertEqual(full_index.score_documents_many(self.queries).tolist(),
+                         index.score_documents_many(self.queries).tolist())
+
+    def test_add_documents(self):
+        index = corpus_easa.SegmentedCorpusIndex()
+        for i in xrange(len(self.documents)):
+            index.add_documents([self.documents[i]])
+            self.assertScoresEqual(self.documents[:i + 1], index)
+        # NOTE(msdubov): Each segment is at least twice as large as the next one.
+        for segment1, segment2 in zip(index.segments, index.segments[1:]):
+            self.assertTrue(len(segment1) >= 2 * len(segment2))
+
+    def test_add_strings(self):
+        index = corpus_easa.SegmentedCorpusIndex()
+        index.add_documents(self.documents)
+        index.add_strings(["ABCABC"])
+        index.add_strings(["BRABRA", "XAB"], [1, 5])
+        documents = list(self.documents) + [["ABCABC"]]
+        documents[1] = documents[1] + ["BRABRA"]
+        documents[5] = documents[5] + ["XAB"]
+        self.assertScoresEqual(documents, index)
+
+    def test_save_load(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        index = corpus_easa.SegmentedCorpusIndex()
+        index.add_documents(self.documents[:3])
+        index.save(path)
+        index = corpus_easa.SegmentedCorpusIndex.load(path)
+        index.add_documents(self.documents[3:])
+        index.save(path)
+        index = corpus_easa.SegmentedCorpusIndex.load(path)
+        self.assertScoresEqual(self.documents, index)
+        self.assertEqual(sorted(segment.name for segment in index.segments),
+                         sorted(name for name in os.listdir(path) if name != "segments.json"))
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*
+
+import itertools
+import os
+
+import numpy as np
+import testtools
+
+from analysis import utils as analysis_utils
+from east.asts import base
+from east.asts import easa
+from east.asts import utils
+from east import consts
+from east import exceptions
+
+
+class EasaTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(EasaTestCase, self).setUp()
+        self.strings_collections = [
+            ["abcd efg ops", "xyzq", "test"],
+            ["XABXAC", "HI"],
+            ["MISSISSIPPI", "MISSISSIPPI", "SIP"],
+            [u"ПРИВЕТМИР", u"МИРПРИВЕТ", "HELLO"],
+            ["A"],
+            analysis_utils.worst_case_strings_collection(20, 15)
+        ]
+
+    def test_suftab_algorithms_equality(self):
+        for strings_collection in self.strings_collections:
+            ast1 = base.AST.get_ast(
+                        strings_collection, consts.ASTAlgorithm.EASA,
+                        suftab_algorithm=consts.SuffixArrayAlgorithm.KARKKAINEN_SANDERS)
+            ast2 = base.AST.get_ast(
+                        strings_collection, consts.ASTAlgorithm.EASA,
+                        suftab_algorithm=consts.SuffixArrayAlgorithm.PREFIX_DOUBLING)
+            self.assertEqual(ast1.suftab.tolist(), ast2.suftab.tolist())
+
+    def test_suftab_is_sorted(self):
+        for strings_collection in self.strings_collections:
+            ast = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+            codes = ast._string_codes().tolist()
+            suffixes = [codes[i:] for i in ast.suftab]
+            self.assertEqual(sorted(suffixes), suffixes)
+            self.assertEqual(len(ast.string), len(suffixes))
+
+    def test_lcptab(self):
+        for strings_collection in self.strings_collections:
+            ast = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+            codes = ast._string_codes().tolist()
+            suffixes = [codes[i:] for i in ast.suftab]
+            lcptab = [0] + [len(os.path.commonprefix([suffixes[k - 1], suffixes[k]]))
+                            for k in xrange(1, len(suffixes))]
+            self.assertEqual(lcptab, ast.lcptab.tolist())
+
+    def test_lcptab_repetitive(self):
+        # NOTE(msdubov): Long common prefixes get resolved by Kasai's algorithm.
+        for strings_collection in (["A" * 500], ["AB" * 200, "AB" * 200, "ABA" * 50],
+                                   ["XYZ" * 100 + "Q", "Q" + "XYZ" * 100]):
+            ast = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+            codes = ast._string_codes().tolist()
+            suffixes = [codes[i:] for i in ast.suftab]
+            lcptab = [0] + [len(os.path.commonprefix([suffixes[k - 1], suffixes[k]]))
+                            for k in xrange(1, len(suffixes))]
+            self.assertEqual(lcptab, ast.lcptab.tolist())
+
+    def test_childtab_next_l_index(self):
+        for strings_collection in self.strings_collections:
+            ast = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+            lcptab = ast.lcptab.tolist()
+            for i in xrange(1, len(lcptab)):
+                next_l_index = ast.childtab_next_l_index[i]
+                if next_l_index:
+                    self.assertEqual(lcptab[i], lcptab[next_l_index])
+                    self.assertTrue(all(lcp > lcptab[i]
+                                        for lcp in lcptab[i + 1:next_l_index]))
+                else:
+                    self.assertTrue(all(lcp != lcptab[i] for lcp in
+                                        itertools.takewhile(lambda lcp: lcp >= lcptab[i],
+                                                            lcptab[i + 1:])))
+
+    def test_interval_index(self):
+        for strings_collection in self.strings_collections:
+            ast = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+            indices = []
+
+            def check_interval(interval):
+                # NOTE(msdubov): The index is the first l-index of the lcp interval.
+                index = ast._interval_index(interval)
+                self.assertEqual(utils.index(ast.lcptab, interval[0], interval[1]), index)
+                indices.append(index)
+
+            ast.traverse_depth_first_post_order(check_interval)
+            self.assertEqual(len(set(indices)), len(indices))
+
+    def test_child_intervals(self):
+        for strings_collection in self.strings_collections:
+            ast = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+            codes = ast._string_codes().tolist()
+            internal_intervals = []
+
+            def check_interval(interval):
+                l, i, j = interval[:3]
+                internal_intervals.append((i, j))
+                children = ast._get_child_intervals(i, j)
+                child_codes = [codes[ast.suftab[child[1]] + l] for child in children]
+                self.assertEqual(sorted(set(child_codes)), child_codes)
+                self.assertEqual(i, children[0][1])
+                self.assertEqual(j, children[-1][2])
+                for child, code in zip(children, child_codes):
+                    if code < easa.STRING_ENDINGS_START:
+                        self.assertEqual(unichr(code), child[3])
+                        self.assertEqual(child, ast._get_child_interval(i, j, child[3]))
+                    else:
+                        self.assertIsNone(child[3])
+                self.assertIsNone(ast._get_child_interval(i, j, u"\u0001"))
+
+            ast.traverse_depth_first_pre_order(
+                lambda interval: interval[1] < interval[2] and check_interval(interval))
+            post_order_intervals = []
+            ast.traverse_depth_first_post_order(
+                lambda interval: post_order_intervals.append((interval[1], interval[2])))
+            self.assertEqual(sorted(post_order_intervals), sorted(internal_intervals))
+
+    def test_repeated_characters_above_endings(self):
+        strings_collection = [u"ab\u2014\u2014c", u"x\u2014\u2014y"]
+        ast = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+        ast_naive = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.AST_NAIVE)
+        for query in (u"\u2014\u2014", u"b\u2014\u2014c", u"x\u2014", u"\u2014y", u"c"):
+            self.assertEqual(ast_naive.score(query), ast.score(query))
+
+    def test_first_l_index_last_intervals(self):
+        # NOTE(msdubov): Without a unique ending, some lcp intervals end at n-1.
+        codes = [ord(char) for char in u"\u2014\u2014ab\u2014\u2014"]
+        ast = easa.EnhancedAnnotatedSuffixArray.__new__(easa.EnhancedAnnotatedSuffixArray)
+        ast.suftab = ast._compute_suftab_prefix_doubling(np.array(codes))
+        suffixes = [codes[i:] for i in ast.suftab]
+        lcptab = [0] + [len(os.path.commonprefix([suffixes[k - 1], suffixes[k]]))
+                        for k in xrange(1, len(suffixes))]
+        ast.lcptab = np.array(lcptab)
+        (ast.childtab_up, ast.childtab_down,
+         ast.childtab_next_l_index) = ast._compute_childtab(ast.lcptab)
+        n = len(codes)
+        for i in xrange(1, n - 1):
+            l = min(lcptab[i + 1:])
+            if lcptab[i] < l:
+                self.assertEqual(lcptab.index(l, i + 1), ast._first_l_index(i, n - 1))
+                self.assertEqual(l, ast._lcp_value(i, n - 1))
+
+    def test_unknown_suftab_algorithm(self):
+        self.assertRaises(exceptions.NoSuchSuffixArrayAlgorithm,
+                          easa.EnhancedAnnotatedSuffixArray, ["abc"], suftab_algorithm="nope")
+
+    def test_compact_tables(self):
+        for strings_collection in self.strings_collections + [["AB" * 300, "B" * 400]]:
+            ast = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA)
+            ast_compact = base.AST.get_ast(strings_collection, consts.ASTAlgorithm.EASA,
+                                           compact_lcptab=True)
+            n = len(ast.suftab)
+            for table in (ast.suftab, ast.childtab_up, ast.childtab_down, ast.anntab):
+                self.assertEqual(utils.compact_dtype(n + 1), table.dtype)
+            self.assertEqual(ast.lcptab.tolist(), ast_compact.lcptab.tolist())
+            self.assertEqual([ast.lcptab[k] for k in xrange(n)],
+                             [ast_compact.lcptab[k] for k in xrange(n)])
+            for query in ("ABAB", "BBB", u"ПРИВЕТ", "XAC"):
+                self.assertEqual(ast.score(query), ast_compact.score(query))
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*
 
+import numpy as np
 import testtools
 
 from east.asts import utils
@@ -19,6 +20,13 @@ class AstUtilsTestCase(testtools.TestCase):
         self.assertEqual(utils.match_strings("abc", "abc"), 3)
         self.assertEqual(utils.match_strings("abc", "abcd"), 3)
 
+    def test_match_strings_offsets(self):
+        self.assertEqual(utils.match_strings("xabc", "abd", 1), 2)
+        self.assertEqual(utils.match_strings("abc", "xxabc", 0, 2), 3)
+        self.assertEqual(utils.match_strings("abc", "xxabc", 0, 2, 4), 2)
+        self.assertEqual(utils.match_strings("abc", "xxabc", 0, 2, 10), 3)
+        self.assertEqual(utils.match_strings("abc", "xxabc", 3, 2), 0)
+
     def test_index_int(self):
         self.assertEqual(utils.index([0, 2, 4, 6], 0), 0)
         self.assertEqual(utils.index([0, 2, 4, 6], 4), 2)
@@ -28,3 +36,17 @@ class AstUtilsTestCase(testtools.TestCase):
         self.assertEqual(utils.index(["a", "b", "c", "d"], "a"), 0)
         self.assertEqual(utils.index(["a", "b", "c", "d"], "c"), 2)
         self.assertEqual(utils.index(["a", "b", "c", "d"], "d"), 3)
+
+    def test_compact_dtype(self):
+        self.assertEqual(np.int8, utils.compact_dtype(127))
+        self.assertEqual(np.int16, utils.compact_dtype(128))
+        self.assertEqual(np.int32, utils.compact_dtype(2 ** 31 - 1))
+        self.assertEqual(np.int64, utils.compact_dtype(2 ** 31))
+
+    def test_compact_int_array(self):
+        values = [0, 3, 254, 255, 1000, 7, 70000, 1]
+        array = utils.CompactIntArray.from_array(np.array(values))
+        self.assertEqual(values, array.tolist())
+        self.assertEqual(values, [array[i] for i in xrange(len(array))])
+        self.assertEqual(np.uint8, array.values.dtype)
+        self.assertEqual(3, len(array.overflow_values))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*
+
+import itertools
+import math
+import os
+import shutil
+import tempfile
+
+import testtools
+
+from east import exceptions
+from east.synonyms import synonyms
+
+
+class SynonymExtractorTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(SynonymExtractorTestCase, self).setUp()
+        self.dependency_triples = []
+        for w1, r, w2 in [("CAT", "subj", "EAT"), ("DOG", "subj", "EAT"), ("CAT", "subj", "RUN"),
+                          ("DOG", "subj", "RUN"), ("CAT", "subj", "RUN"), ("BIRD", "subj", "FLY"),
+                          ("BIRD", "subj", "SING"), ("MAN", "subj", "SPEAK"),
+                          ("MAN", "subj", "WRITE"), ("MAN", "subj", "SING"),
+                          ("DOG", "mod", "BIG"), ("CAT", "mod", "SMALL"), ("MAN", "mod", "OLD")]:
+            self.dependency_triples.extend([(w1, r, w2), (w2, r + "_of", w1)])
+        # NOTE(msdubov): The dependency triples usually come from the tomita parser.
+        self.patch(synonyms.SynonymExtractor, "_get_tomita_path",
+                   lambda extractor: ("", "tomita"))
+        self.patch(synonyms.SynonymExtractor, "_retrieve_dependency_triples",
+                   lambda extractor, text: list(self.dependency_triples))
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        with open(os.path.join(self.path, "text.txt"), "w") as f:
+            f.write("The cat and the dog eat and run. The bird can fly, the old man can sing.")
+        self.extractor = synonyms.SynonymExtractor(self.path)
+
+    def _I(self, w1, r, w2):
+        def frequencies_sum(matches):
+            return sum(self.dependency_triples.count(dt) for dt in self.dependency_triples
+                       if matches(dt))
+        fr_w1rw2 = self.dependency_triples.count((w1, r, w2))
+        if not fr_w1rw2:
+            return 0.0
+        return max(math.log(float(fr_w1rw2) * frequencies_sum(lambda dt: dt[1] == r) /
+                            frequencies_sum(lambda dt: dt[:2] == (w1, r)) /
+                            frequencies_sum(lambda dt: dt[1:] == (r, w2))), 0.0)
+
+    def test_tomita_not_installed(self):
+        self.patch(synonyms.SynonymExtractor, "_get_tomita_path",
+                   lambda extractor: ("", None))
+        self.assertRaises(exceptions.TomitaNotInstalledException,
+                          synonyms.SynonymExtractor, self.path)
+
+    def test_I_and_T(self):
+        words = self.extractor.words
+        relations = self.extractor.relations
+        for w1 in words:
+            for r, w2 in itertools.product(relations, words):
+                self.assertAlmostEqual(self._I(w1, r, w2), self.extractor.I(w1, r, w2))
+            self.assertEqual(set((r, w2) for r, w2 in itertools.product(relations, words)
+                                 if self._I(w1, r, w2) > 0),
+                             self.extractor.T(w1))
+            self.assertAlmostEqual(sum(self.extractor.I(w1, r, w2)
+                                       for r, w2 in self.extractor.T(w1)),
+                                   self.extractor.features_sums.get(w1, 0.0))
+
+    def test_similarity(self):
+        for w1, w2 in itertools.product(self.extractor.words, repeat=2):
+            T1, T2 = self.extractor.T(w1), self.extractor.T(w2)
+            denominator = (sum(self.extractor.I(w1, r, w) for r, w in T1) +
+                           sum(self.extractor.I(w2, r, w) for r, w in T2))
+            similarity = (sum(self.extractor.I(w1, r, w) + self.extractor.I(w2, r, w)
+                              for r, w in T1 & T2) / denominator if denominator else 0.0)
+            self.assertAlmostEqual(similarity, self.extractor.similarity(w1, w2))
+            self.assertEqual(self.extractor.similarity(w1, w2),
+                             self.extractor.similarity(w2, w1))
+        self.assertEqual(0.0, self.extractor.similarity("CAT", "UNKNOWN"))
+
+    def test_get_synonyms(self):
+        synonyms = self.extractor.get_synonyms(threshold=0.2)
+        self.assertIn("DOG", synonyms["CAT"])
+        self.assertIn("CAT", synonyms["DOG"])
+        self.assertNotIn("BIRD", synonyms["CAT"])
+        self.assertIs(synonyms, self.extractor.get_synonyms(threshold=0.2))
+        with_similarities = self.extractor.get_synonyms(threshold=0.2,
+                                                        return_similarity_measure=True)
+        self.assertEqual([("DOG", self.extractor.similarity("CAT", "DOG"))],
+                         [(w, sim) for w, sim in with_similarities["CAT"] if w == "DOG"])
+
+    def test_get_synonyms_exhaustive(self):
+        words = filter(lambda w: len(w) > 2, self.extractor.words)
+        for threshold in (-0.1, 0.0, 0.2, 0.5):
+            pairs = [(w1, w2, self.extractor.similarity(w1, w2))
+                     for w1, w2 in itertools.combinations(words, 2)
+                     if self.extractor.similarity(w1, w2) > threshold]
+            self.assertEqual(pairs, self.extractor._similar_pairs(words, threshold))
+            self.extractor.workers = 2
+            self.assertEqual(pairs, self.extractor._similar_pairs(words, threshold))
+            self.extractor.workers = 1
+
+    def test_get_synonyms_candidates(self):
+        scored = []
+        similarity = self.extractor.similarity
+
+        def record_similarity(w1, w2):
+            scored.append(tuple(sorted((w1, w2))))
+            return similarity(w1, w2)
+
+        self.patch(self.extractor, "similarity", record_similarity)
+        self.extractor.get_synonyms(threshold=0.2)
+        # NOTE(msdubov): Only the words sharing features get compared.
+        self.assertIn(("CAT", "DOG"), scored)
+        self.assertNotIn(("CAT", "FLY"), scored)
+        self.assertEqual(len(set(scored)), len(scored))
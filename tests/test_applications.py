@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*
+
+import functools
+import itertools
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import testtools
+
+from east.asts import base
+from east import applications
+from east import cache
+from east import relevance
+from east import utils
+
+
+class ApplicationsTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(ApplicationsTestCase, self).setUp()
+        self.keyphrases = ["sunny day", "rainy weather", "dog", "sunny day", ""]
+        self.texts = {
+            "first": "Well, what a sunny day! The dog is happy.",
+            "second": "Rainy weather again, it is raining cats and dogs.",
+            "third": "Nothing to see here."
+        }
+
+    def test_keyphrases_table(self):
+        similarity_measure = relevance.ASTRelevanceMeasure()
+        table = applications.keyphrases_table(self.keyphrases, self.texts, similarity_measure)
+        self.assertEqual(set(["sunny day", "rainy weather", "dog"]), set(table.keys()))
+        for keyphrase in table:
+            self.assertEqual(set(self.texts.keys()), set(table[keyphrase].keys()))
+            for text_name, text in self.texts.iteritems():
+                ast = base.AST.get_ast(utils.text_to_strings_collection(text))
+                self.assertEqual(ast.score(utils.prepare_text(keyphrase)),
+                                 table[keyphrase][text_name])
+
+    def test_keyphrases_table_saved_indexes(self):
+        index_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_path)
+        table = applications.keyphrases_table(
+                    self.keyphrases, self.texts,
+                    relevance.ASTRelevanceMeasure(index_path=index_path))
+        self.assertEqual(len(self.texts), len(os.listdir(os.path.join(index_path, "easa"))))
+        # NOTE(msdubov): The second time, the indexes get loaded from the disk.
+        table_loaded = applications.keyphrases_table(
+                            self.keyphrases, self.texts,
+                            relevance.ASTRelevanceMeasure(index_path=index_path))
+        self.assertEqual(table, table_loaded)
+
+    def test_keyphrases_table_corpus_index(self):
+        table = applications.keyphrases_table(self.keyphrases, self.texts,
+                                              relevance.ASTRelevanceMeasure())
+        table_corpus = applications.keyphrases_table(self.keyphrases, self.texts,
+                                                     relevance.CorpusASTRelevanceMeasure())
+        self.assertEqual(table, table_corpus)
+
+    def test_keyphrases_table_score_cache(self):
+        table = applications.keyphrases_table(self.keyphrases, self.texts,
+                                              relevance.ASTRelevanceMeasure())
+        score_cache = cache.ScoreCache()
+        table_cached = applications.keyphrases_table(
+                            self.keyphrases, self.texts,
+                            relevance.ASTRelevanceMeasure(score_cache=score_cache))
+        self.assertEqual(table, table_cached)
+        self.assertEqual(0, score_cache.stats()["hits"])
+        # NOTE(msdubov): The second time, all the scores come from the cache.
+        table_cached = applications.keyphrases_table(
+                            self.keyphrases, self.texts,
+                            relevance.ASTRelevanceMeasure(score_cache=score_cache))
+        self.assertEqual(table, table_cached)
+        stats = score_cache.stats()
+        self.assertEqual(stats["misses"], stats["hits"])
+        self.assertEqual(0.5, stats["hit_rate"])
+
+    def test_keyphrases_table_parallel_score_cache(self):
+        table = applications.keyphrases_table(self.keyphrases, self.texts,
+                                              relevance.ASTRelevanceMeasure())
+        score_cache = cache.ScoreCache()
+        # NOTE(msdubov): Only some of the scores get cached at first.
+        applications.keyphrases_table(self.keyphrases[:2], {"first": self.texts["first"]},
+                                      relevance.ASTRelevanceMeasure(score_cache=score_cache))
+        self.assertEqual(2, len(score_cache))
+        for _ in xrange(2):
+            table_cached = applications.keyphrases_table(
+                                self.keyphrases, self.texts,
+                                relevance.ASTRelevanceMeasure(score_cache=score_cache),
+                                workers=2)
+            self.assertEqual(table, table_cached)
+        # NOTE(msdubov): The workers' scores got cached, so the second time all come from there.
+        cells = len(set(filter(None, self.keyphrases))) * len(self.texts)
+        self.assertEqual(cells, len(score_cache))
+        self.assertEqual(2 + cells, score_cache.stats()["hits"])
+
+    def test_keyphrases_table_parallel_indexing(self):
+        table = applications.keyphrases_table(self.keyphrases, self.texts,
+                                              relevance.ASTRelevanceMeasure())
+        table_parallel = applications.keyphrases_table(
+                            self.keyphrases, self.texts, relevance.ASTRelevanceMeasure(workers=2))
+        self.assertEqual(table, table_parallel)
+        index_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_path)
+        table_parallel = applications.keyphrases_table(
+                            self.keyphrases, self.texts,
+                            relevance.ASTRelevanceMeasure(index_path=index_path, workers=2))
+        self.assertEqual(table, table_parallel)
+        self.assertEqual(len(self.texts), len(os.listdir(os.path.join(index_path, "easa"))))
+
+    def test_keyphrases_table_parallel_indexing_duplicates(self):
+        self.texts["fourth"] = self.texts["first"]
+        table = applications.keyphrases_table(self.keyphrases, self.texts,
+                                              relevance.ASTRelevanceMeasure())
+        index_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_path)
+        for _ in xrange(2):
+            table_parallel = applications.keyphrases_table(
+                                self.keyphrases, self.texts,
+                                relevance.ASTRelevanceMeasure(index_path=index_path, workers=2))
+            self.assertEqual(table, table_parallel)
+            self.assertEqual(len(self.texts) - 1,
+                             len(os.listdir(os.path.join(index_path, "easa"))))
+
+    def test_build_asts_saved(self):
+        index_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_path)
+        task = ("easa", index_path, [(0, self.texts["first"]), (1, self.texts["second"])])
+        paths = relevance._build_asts(task)
+        self.assertTrue(all(base.AST.is_saved(path) for _, path in paths))
+
+        def load(path, mmap_mode=None):
+            raise AssertionError("The saved AST should not be loaded")
+
+        # NOTE(msdubov): The ASTs saved already are only checked for.
+        self.patch(np, "load", load)
+        self.assertEqual(paths, relevance._build_asts(task))
+
+    def test_keyphrases_table_parallel_scoring(self):
+        for similarity_measure in (relevance.ASTRelevanceMeasure,
+                                   relevance.CorpusASTRelevanceMeasure):
+            table = applications.keyphrases_table(self.keyphrases, self.texts,
+                                                  similarity_measure())
+            for workers in (2, 5):
+                table_parallel = applications.keyphrases_table(
+                                    self.keyphrases, self.texts, similarity_measure(),
+                                    workers=workers)
+                self.assertEqual(table, table_parallel)
+
+    def test_grid_blocks(self):
+        for keyphrases_count, texts_count in ((10, 100), (100, 3), (1, 1), (7, 5)):
+            for split_keyphrases_only in (False, True):
+                blocks = applications._grid_blocks(keyphrases_count, texts_count, 8,
+                                                   split_keyphrases_only)
+                cells = [(i, j) for (k1, k2), (t1, t2) in blocks
+                         for i in xrange(k1, k2) for j in xrange(t1, t2)]
+                self.assertEqual(sorted(itertools.product(xrange(keyphrases_count),
+                                                          xrange(texts_count))), sorted(cells))
+                self.assertTrue(len(blocks) <= 8)
+
+    def test_keyphrases_table_rows(self):
+        table = applications.keyphrases_table(self.keyphrases, self.texts)
+        # NOTE(msdubov): Blocks of 2 scores at most make the rows span several blocks.
+        self.patch(applications, "TABLE_BLOCK_SIZE", 2)
+        for workers in (1, 2):
+            rows = list(applications.keyphrases_table_rows(self.keyphrases, self.texts,
+                                                           workers=workers))
+            self.assertEqual(sorted(table.keys()), [keyphrase for keyphrase, _ in rows])
+            self.assertEqual(table, dict(rows))
+            rows = list(applications.keyphrases_table_rows(self.keyphrases, self.texts,
+                                                           workers=workers, by_texts=True))
+            self.assertEqual(sorted(self.texts.keys()), [text for text, _ in rows])
+            for text, scores in rows:
+                self.assertEqual({keyphrase: table[keyphrase][text] for keyphrase in table},
+                                 scores)
+
+    def test_keyphrases_table_rows_by_texts_blocks(self):
+        self.patch(utils, "tokenize_and_filter",
+                   functools.partial(utils.tokenize_and_filter, stopwords=set(["THE"])))
+        for similarity_measure in (relevance.CosineRelevanceMeasure,
+                                   relevance.CorpusASTRelevanceMeasure):
+            table = applications.keyphrases_table(self.keyphrases, self.texts,
+                                                  similarity_measure())
+            # NOTE(msdubov): Blocks of 3 scores, i.e. of a single text for all the keyphrases.
+            self.patch(applications, "TABLE_BLOCK_SIZE", 3)
+            measure = similarity_measure()
+            blocks = []
+            relevance_block = measure._relevance_block
+
+            def record_relevance_block(keyphrases, texts, synonimizer=None):
+                blocks.append(len(texts))
+                return relevance_block(keyphrases, texts, synonimizer)
+
+            self.patch(measure, "_relevance_block", record_relevance_block)
+            rows = dict(applications.keyphrases_table_rows(self.keyphrases, self.texts,
+                                                           measure, by_texts=True))
+            self.patch(applications, "TABLE_BLOCK_SIZE", 2 ** 20)
+            # NOTE(msdubov): Only the scores for the texts of a block get computed at once.
+            self.assertEqual([1] * len(self.texts), blocks)
+            for text, scores in rows.iteritems():
+                self.assertEqual({keyphrase: table[keyphrase][text] for keyphrase in table},
+                                 scores)
+
+    def test_keyphrases_matrix(self):
+        table = applications.keyphrases_table(self.keyphrases, self.texts)
+        matrix = applications.keyphrases_matrix(self.keyphrases, self.texts)
+        self.assertEqual(sorted(table.keys()), matrix.keyphrases)
+        self.assertEqual(sorted(self.texts.keys()), matrix.texts)
+        self.assertEqual((3, 3), matrix.scores.shape)
+        for keyphrase in table:
+            for text in self.texts:
+                self.assertAlmostEqual(table[keyphrase][text], matrix[keyphrase][text], 6)
+        sparse = applications.keyphrases_matrix(self.keyphrases, self.texts, threshold=0.25)
+        self.assertEqual({keyphrase: set(text for text in table[keyphrase]
+                                         if table[keyphrase][text] >= 0.25)
+                          for keyphrase in table},
+                         {keyphrase: set(sparse[keyphrase]) for keyphrase in sparse})
+
+    def test_keyphrases_graph_from_table(self):
+        graph = applications.keyphrases_graph(self.keyphrases, self.texts,
+                                              referral_confidence=0.5, relevance_threshold=0.3)
+        keyphrases = [keyphrase for keyphrase in self.keyphrases if keyphrase]
+        for table in (applications.keyphrases_table(self.keyphrases, self.texts),
+                      applications.keyphrases_matrix(self.keyphrases, self.texts, threshold=0.3),
+                      applications.keyphrases_matrix(self.keyphrases, self.texts, threshold=0.1)):
+            self.assertEqual(graph, applications.keyphrases_graph_from_table(
+                                        table, referral_confidence=0.5, relevance_threshold=0.3,
+                                        keyphrases=keyphrases))
+
+    def test_keyphrases_graph_float64_threshold(self):
+        table = applications.keyphrases_table(self.keyphrases, self.texts)
+        # NOTE(msdubov): The threshold is above the score, but not after rounding to float32.
+        threshold = np.nextafter(table["dog"]["first"], 1.0)
+        self.assertEqual(np.float32(table["dog"]["first"]), np.float32(threshold))
+        sparse = applications.keyphrases_matrix(self.keyphrases, self.texts, threshold=threshold)
+        self.assertNotIn("first", sparse["dog"])
+        self.assertEqual(applications.keyphrases_graph_from_table(
+                             table, referral_confidence=0.5, relevance_threshold=threshold,
+                             keyphrases=[keyphrase for keyphrase in self.keyphrases if keyphrase]),
+                         applications.keyphrases_graph(
+                             self.keyphrases, self.texts, referral_confidence=0.5,
+                             relevance_threshold=threshold))
+
+    def test_keyphrases_graph_cooccurrence_blocks(self):
+        table = applications.keyphrases_matrix(self.keyphrases, self.texts)
+        for referral_confidence in (0.0, 0.5, 1.0):
+            graph = applications.keyphrases_graph_from_table(
+                        table, referral_confidence=referral_confidence, relevance_threshold=0.2)
+            # NOTE(msdubov): Blocks of a single keyphrase must give exactly the same graph.
+            self.patch(applications, "COOCCURRENCES_BLOCK_SIZE", 1)
+            self.assertEqual(graph, applications.keyphrases_graph_from_table(
+                                        table, referral_confidence=referral_confidence,
+                                        relevance_threshold=0.2))
+            self.patch(applications, "COOCCURRENCES_BLOCK_SIZE", 2 ** 22)
+            nodes = {node["id"]: node["label"] for node in graph["nodes"]}
+            for edge in graph["edges"]:
+                source = table[nodes[edge["source"]]]
+                target = table[nodes[edge["target"]]]
+                source_texts = set(text for text in source if source[text] >= 0.2)
+                target_texts = set(text for text in target if target[text] >= 0.2)
+                self.assertNotEqual(edge["source"], edge["target"])
+                self.assertGreaterEqual(
+                    float(len(source_texts & target_texts)) / len(source_texts),
+                    referral_confidence)
+
+    def test_keyphrases_top(self):
+        self.texts["fourth"] = "Солнечный день, собака рада."
+        for similarity_measure in (relevance.ASTRelevanceMeasure(),
+                                   relevance.ASTRelevanceMeasure(normalized=False),
+                                   relevance.CorpusASTRelevanceMeasure()):
+            table = applications.keyphrases_table(self.keyphrases, self.texts,
+                                                  similarity_measure)
+            for k in (1, 2, 10):
+                top = applications.keyphrases_top(self.keyphrases, self.texts, k,
+                                                  similarity_measure)
+                self.assertEqual(set(table.keys()), set(top.keys()))
+                for keyphrase in table:
+                    self.assertEqual(sorted(table[keyphrase].items(),
+                                            key=lambda (text, score): (-score, text))[:k],
+                                     top[keyphrase])
+
+    def test_keyphrases_top_pruning(self):
+        self.texts["fourth"] = "Солнечный день, собака рада."
+        similarity_measure = relevance.ASTRelevanceMeasure()
+        scored_texts = []
+        relevance_many = similarity_measure.relevance_many
+
+        def record_relevance_many(keyphrases, text, synonimizer=None):
+            scored_texts.append(text)
+            return relevance_many(keyphrases, text, synonimizer)
+
+        self.patch(similarity_measure, "relevance_many", record_relevance_many)
+        applications.keyphrases_top(self.keyphrases, self.texts, 2, similarity_measure)
+        # NOTE(msdubov): The text having none of the characters of the keyphrases cannot get
+        #                into the top, so it never gets scored.
+        self.assertEqual([0, 2, 3], sorted(scored_texts))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*
+
+import os
+import shutil
+import tempfile
+
+import testtools
+
+from east import cache
+
+
+class ScoreCacheTestCase(testtools.TestCase):
+
+    def test_get_put(self):
+        score_cache = cache.ScoreCache()
+        self.assertIsNone(score_cache.get(("dog", "text")))
+        score_cache.put(("dog", "text"), 0.5)
+        self.assertEqual(0.5, score_cache.get(("dog", "text")))
+        score_cache.put(("dog", "text"), 0.0)
+        self.assertEqual(0.0, score_cache.get(("dog", "text")))
+        self.assertEqual(1, len(score_cache))
+        stats = score_cache.stats()
+        self.assertEqual(2, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertAlmostEqual(2.0 / 3, stats["hit_rate"])
+
+    def test_lru_eviction(self):
+        score_cache = cache.ScoreCache()
+        entry_size = score_cache._entry_size(("key", 0), 0.0)
+        score_cache = cache.ScoreCache(max_memory=3 * entry_size)
+        for i in xrange(3):
+            score_cache.put(("key", i), float(i))
+        # NOTE(msdubov): The lookup makes the first entry the most recently used one.
+        score_cache.get(("key", 0))
+        score_cache.put(("key", 3), 3.0)
+        self.assertEqual(3, len(score_cache))
+        self.assertIsNone(score_cache.get(("key", 1)))
+        for i in (0, 2, 3):
+            self.assertEqual(float(i), score_cache.get(("key", i)))
+        self.assertEqual(1, score_cache.stats()["evictions"])
+        self.assertTrue(score_cache.memory <= score_cache.max_memory)
+
+    def test_disk_spill(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        cache_path = os.path.join(path, "scores")
+        score_cache = cache.ScoreCache(max_memory=1, path=cache_path)
+        score_cache.put(("dog", "first"), 0.25)
+        score_cache.put(("dog", "second"), 0.75)
+        self.assertEqual(0, len(score_cache))
+        self.assertEqual(0.25, score_cache.get(("dog", "first")))
+        self.assertEqual(1, score_cache.stats()["disk_hits"])
+        score_cache.close()
+        # NOTE(msdubov): The scores survive across runs.
+        score_cache = cache.ScoreCache(path=cache_path)
+        self.addCleanup(score_cache.close)
+        self.assertEqual(0.75, score_cache.get(("dog", "second")))
+        self.assertEqual(0.25, score_cache.get(("dog", "first")))
+        self.assertIsNone(score_cache.get(("cat", "first")))
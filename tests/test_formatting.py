@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*
+
+import StringIO
+
+import testtools
+
+from east import formatting
+from east import tables
+
+
+class FormattingTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(FormattingTestCase, self).setUp()
+        self.table = {
+            "sunny day": {"first": 0.5, "second": 0.125},
+            "dog": {"first": 0.25, "second": 1.0}
+        }
+        self.graph = {
+            "nodes": [{"id": 0, "label": "sunny day"}, {"id": 1, "label": "dog"}],
+            "edges": [{"source": 0, "target": 1, "confidence": 1.0}],
+            "referral_confidence": 0.6,
+            "relevance_threshold": 0.25,
+            "support_threshold": 1
+        }
+
+    def test_format_table(self):
+        self.assertEqual('<table>\n'
+                         '  <keyphrase value="dog">\n'
+                         '    <text name="first">0.250</text>\n'
+                         '    <text name="second">1.000</text>\n'
+                         '  </keyphrase>\n'
+                         '  <keyphrase value="sunny day">\n'
+                         '    <text name="first">0.500</text>\n'
+                         '    <text name="second">0.125</text>\n'
+                         '  </keyphrase>\n'
+                         '</table>\n', formatting.format_table(self.table, "xml"))
+        self.assertEqual(',"dog","sunny day"\n'
+                         '"first",0.250,0.500\n'
+                         '"second",1.000,0.125\n', formatting.format_table(self.table, "csv"))
+        self.assertRaises(Exception, formatting.format_table, self.table, "json")
+
+    def test_format_matrix(self):
+        matrix = tables.KeyphrasesTable(["dog", "sunny day"], ["first", "second"],
+                                        [[0.25, 1.0], [0.5, 0.125]])
+        for table_format in ("xml", "csv"):
+            self.assertEqual(formatting.format_table(self.table, table_format),
+                             formatting.format_table(matrix, table_format))
+        sparse = matrix.threshold(0.5)
+        self.assertIn('  <keyphrase value="sunny day">\n'
+                      '    <text name="first">0.500</text>\n'
+                      '  </keyphrase>\n', formatting.format_table(sparse, "xml"))
+        self.assertEqual(',"dog","sunny day"\n'
+                         '"first",,0.500\n'
+                         '"second",1.000,\n', formatting.format_table(sparse, "csv"))
+
+    def test_write_table(self):
+        keyphrase_rows = [(keyphrase, self.table[keyphrase]) for keyphrase in sorted(self.table)]
+        text_rows = [(text, {keyphrase: self.table[keyphrase][text] for keyphrase in self.table})
+                     for text in ("first", "second")]
+        for table_format in ("xml", "csv"):
+            rows = text_rows if formatting.table_rows_by_texts(table_format) else keyphrase_rows
+            f = StringIO.StringIO()
+            # NOTE(msdubov): The rows may come from a generator.
+            formatting.write_table(iter(rows), f, table_format)
+            self.assertEqual(formatting.format_table(self.table, table_format), f.getvalue())
+        self.assertRaises(Exception, formatting.table_rows_by_texts, "json")
+
+    def test_write_graph(self):
+        for graph_format in ("gml", "edges"):
+            f = StringIO.StringIO()
+            formatting.write_graph(self.graph, f, graph_format)
+            self.assertEqual(formatting.format_graph(self.graph, graph_format), f.getvalue())
+        self.assertEqual("sunny day -> dog\n", formatting.graph2edges(self.graph))
+        self.assertRaises(Exception, formatting.format_graph, self.graph, "json")
+
+    def test_format_top(self):
+        top = {"sunny day": [("first", 0.5), ("second", 0.125)], "dog": [("second", 1.0)]}
+        self.assertEqual('<top>\n'
+                         '  <keyphrase value="dog">\n'
+                         '    <text name="second">1.000</text>\n'
+                         '  </keyphrase>\n'
+                         '  <keyphrase value="sunny day">\n'
+                         '    <text name="first">0.500</text>\n'
+                         '    <text name="second">0.125</text>\n'
+                         '  </keyphrase>\n'
+                         '</top>\n', formatting.format_top(top, "xml"))
+        self.assertEqual('"dog","second",1.000\n'
+                         '"sunny day","first",0.500\n'
+                         '"sunny day","second",0.125\n', formatting.format_top(top, "csv"))
+        self.assertRaises(Exception, formatting.format_top, top, "json")
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*
+
+import functools
+import math
+
+from nltk.stem import snowball
+from nltk.stem import wordnet
+import numpy as np
+import testtools
+
+from east import cache
+from east import consts
+from east import exceptions
+from east import relevance
+from east import utils
+
+
+class CosineRelevanceMeasureTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(CosineRelevanceMeasureTestCase, self).setUp()
+        self.tokens_in_texts = [
+            ["SUNNY", "DAY", "DOG", "HAPPY", "DAY"],
+            ["RAINY", "WEATHER", "RAINING", "CATS", "DOGS", "WEATHER"],
+            [],
+            ["NOTHING", "SEE", "HERE", "DOG"]
+        ]
+
+    def _dense_vectors(self, measure):
+        terms = measure.terms
+        vectors = []
+        for tokens in self.tokens_in_texts:
+            vector = np.array([tokens.count(term) * 1.0 for term in terms])
+            if measure.term_weighting == consts.TermWeighting.TF_IDF:
+                vector *= [1 + math.log(float(len(self.tokens_in_texts)) /
+                                        sum(term in t for t in self.tokens_in_texts))
+                           for term in terms]
+            norm = math.sqrt(np.dot(vector, vector))
+            vectors.append(vector / norm if norm else vector)
+        return vectors
+
+    def test_tf_idf(self):
+        for term_weighting in (consts.TermWeighting.TF, consts.TermWeighting.TF_IDF):
+            measure = relevance.CosineRelevanceMeasure(consts.VectorSpace.WORDS, term_weighting)
+            measure.terms, measure.term_index, measure.idf, measure.vectors = (
+                measure._tf_idf(self.tokens_in_texts))
+            self.assertEqual(sorted(set(sum(self.tokens_in_texts, []))), sorted(measure.terms))
+            self.assertEqual(term_weighting == consts.TermWeighting.TF, measure.idf is None)
+            indptr, indices, data = measure.vectors
+            self.assertEqual([0, 4, 9, 9, 13], indptr.tolist())
+            for i, dense_vector in enumerate(self._dense_vectors(measure)):
+                vector = np.zeros(len(measure.terms))
+                vector[indices[indptr[i]:indptr[i + 1]]] = data[indptr[i]:indptr[i + 1]]
+                self.assertEqual(sorted(indices[indptr[i]:indptr[i + 1]].tolist()),
+                                 indices[indptr[i]:indptr[i + 1]].tolist())
+                self.assertTrue(np.allclose(dense_vector, vector))
+
+    def test_query_vector(self):
+        measure = relevance.CosineRelevanceMeasure(consts.VectorSpace.WORDS)
+        measure.terms, measure.term_index, measure.idf, measure.vectors = (
+            measure._tf_idf(self.tokens_in_texts))
+        indices, data = measure._query_vector(["DOG", "UNKNOWN", "DAY", "DOG"])
+        self.assertEqual(sorted([measure.term_index["DOG"], measure.term_index["DAY"]]),
+                         indices.tolist())
+        self.assertAlmostEqual(1.0, np.dot(data, data))
+        self.assertEqual(0, len(measure._query_vector(["UNKNOWN"])[0]))
+
+    def test_score_texts_many(self):
+        # NOTE(msdubov): The NLTK stopwords are not needed for the texts here.
+        self.patch(utils, "tokenize_and_filter",
+                   functools.partial(utils.tokenize_and_filter, stopwords=set(["THE"])))
+        texts = ["Well, what a sunny day! The dog is happy.",
+                 "Rainy weather again, it is raining cats and dogs.",
+                 "", "Nothing to see here, dog."]
+        keyphrases = ["SUNNY DAY", "DOG", "RAINY DOGS WEATHER", "THE", ""]
+        for term_weighting in (consts.TermWeighting.TF, consts.TermWeighting.TF_IDF):
+            measure = relevance.CosineRelevanceMeasure(term_weighting=term_weighting)
+            measure.set_text_collection(texts)
+            scores = measure.score_texts_many(keyphrases)
+            self.assertEqual((len(keyphrases), len(texts)), scores.shape)
+            for i, keyphrase in enumerate(keyphrases):
+                for j in xrange(len(texts)):
+                    self.assertAlmostEqual(measure.relevance(keyphrase, j), scores[i, j])
+                    self.assertAlmostEqual(measure.relevance_many(keyphrases, j)[i],
+                                           scores[i, j])
+            self.assertEqual(0.0, scores[3:].max())
+            self.assertEqual(0.0, scores[:, 2].max())
+            self.assertEqual([[(text, scores[1, text])
+                               for text in sorted(xrange(len(texts)),
+                                                  key=lambda text: (-scores[1, text], text))[:2]]],
+                             measure.top_texts_many(["DOG"], 2))
+
+    def test_score_cache(self):
+        self.patch(utils, "tokenize_and_filter",
+                   functools.partial(utils.tokenize_and_filter, stopwords=set(["THE"])))
+        texts = ["Well, what a sunny day! The dog is happy.",
+                 "Rainy weather again, it is raining cats and dogs.", "Nothing to see here."]
+        keyphrases = ["SUNNY DAY", "DOG", "RAINY WEATHER"]
+        measure = relevance.CosineRelevanceMeasure()
+        measure.set_text_collection(texts)
+        scores = [measure.relevance_many(keyphrases, j) for j in xrange(len(texts))]
+        score_cache = cache.ScoreCache()
+        measure = relevance.CosineRelevanceMeasure(score_cache=score_cache)
+        measure.set_text_collection(texts)
+        text_keys = []
+        text_key = measure._text_key
+
+        def record_text_key(text):
+            text_keys.append(text)
+            return text_key(text)
+
+        self.patch(measure, "_text_key", record_text_key)
+        for _ in xrange(2):
+            for j in xrange(len(texts)):
+                self.assertEqual(scores[j].tolist(),
+                                 measure.relevance_many(keyphrases, j).tolist())
+        self.assertEqual(len(keyphrases) * len(texts), score_cache.hits)
+        # NOTE(msdubov): The digest of the collection does not get recomputed for every key
+        #                (the keys get computed to look up all the scores twice and to put
+        #                the missing ones once).
+        self.assertEqual(3 * len(keyphrases) * len(texts), len(text_keys))
+
+    def test_score_texts_many_texts(self):
+        self.patch(utils, "tokenize_and_filter",
+                   functools.partial(utils.tokenize_and_filter, stopwords=set(["THE"])))
+        texts = ["Well, what a sunny day! The dog is happy.",
+                 "Rainy weather again, it is raining cats and dogs.",
+                 "", "Nothing to see here, dog.", "Dog, dog, dog and a dog again."]
+        keyphrases = ["SUNNY DAY", "DOG", "RAINY DOGS WEATHER", "THE"]
+        measure = relevance.CosineRelevanceMeasure()
+        measure.set_text_collection(texts)
+        scores = measure.score_texts_many(keyphrases)
+        # NOTE(msdubov): A few texts get scored through their vectors, the other ones
+        #                through the postings of the query terms.
+        for block in ([3], [4, 0], [1, 2, 3], range(len(texts))):
+            self.assertEqual(scores[:, block].tolist(),
+                             measure.score_texts_many(keyphrases, block).tolist())
+            self.assertEqual(scores[:, block].tolist(),
+                             measure.relevance_table(keyphrases, block).tolist())
+            self.assertIsNone(measure._scores)
+        self.assertEqual((0, 2), measure.score_texts_many([], [0, 1]).shape)
+
+    def test_top_texts_max_score(self):
+        self.patch(utils, "tokenize_and_filter",
+                   functools.partial(utils.tokenize_and_filter, stopwords=set(["THE"])))
+        texts = ["dog dog cat", "dog bird", "cat cat cat cat", "fish", "dog cat fish", "bird",
+                 "dog dog cat"]
+        keyphrases = ["DOG", "CAT FISH", "DOG CAT BIRD FISH", "BIRD", "COW"]
+        measure = relevance.CosineRelevanceMeasure(consts.VectorSpace.WORDS)
+        measure.set_text_collection(texts)
+        scores = measure.score_texts_many(keyphrases)
+        for k in (1, 2, 3, 10):
+            self.assertEqual(relevance._top_texts(scores, k),
+                             measure.top_texts_many(keyphrases, k))
+
+    def test_top_texts_max_score_pruning(self):
+        self.patch(utils, "tokenize_and_filter",
+                   functools.partial(utils.tokenize_and_filter, stopwords=set(["THE"])))
+        texts = ["common rare"] + ["common filler%d" % i for i in xrange(20)]
+        measure = relevance.CosineRelevanceMeasure(consts.VectorSpace.WORDS)
+        measure.set_text_collection(texts)
+        looked_up = []
+        score_texts = measure._score_texts
+
+        def record_score_texts(query_indices, query_data, texts):
+            looked_up.append(len(texts))
+            return score_texts(query_indices, query_data, texts)
+
+        self.patch(measure, "_score_texts", record_score_texts)
+        self.assertEqual(0, measure.top_texts_many(["RARE COMMON"], 1)[0][0][0])
+        # NOTE(msdubov): The postings of the common term never get scanned as a whole.
+        self.assertEqual([1, 1], looked_up)
+
+    def test_preprocess_tokens(self):
+        tokens_in_texts = [["DOGS", "RUNNING", "DOGS", "RUNS"], [], ["RUNNING", "CATS"]]
+        stemmer = snowball.SnowballStemmer(consts.Language.ENGLISH)
+        stems = [[stemmer.stem(token) for token in tokens] for tokens in tokens_in_texts]
+        for workers in (1, 2):
+            self.patch(relevance, "PARALLEL_PREPROCESSING_MIN_TOKENS", 2)
+            measure = relevance.CosineRelevanceMeasure(consts.VectorSpace.STEMS, workers=workers)
+            measure.language, measure.stemmer = consts.Language.ENGLISH, stemmer
+            self.assertEqual(stems, measure._preprocess_tokens(tokens_in_texts))
+            self.assertEqual(4, len(measure._terms))
+            self.assertEqual([[stemmer.stem("CATS"), stemmer.stem("BIRDS")]],
+                             measure._preprocess_tokens([["CATS", "BIRDS"]]))
+            self.assertEqual(5, len(measure._terms))
+            self.assertEqual([[stemmer.stem("DOGS"), stemmer.stem("FISH")]],
+                             measure._preprocess_tokens([["DOGS", "FISH"]], memoize=False))
+            self.assertEqual(5, len(measure._terms))
+
+    def test_query_tokens_not_memoized(self):
+        self.patch(utils, "tokenize_and_filter",
+                   functools.partial(utils.tokenize_and_filter, stopwords=set(["THE"])))
+        measure = relevance.CosineRelevanceMeasure(consts.VectorSpace.STEMS)
+        measure.set_text_collection(["Dogs are running", "Cats are sleeping"])
+        terms = dict(measure._terms)
+        scores = measure.score_texts_many(["RUNNING DOGS", "FLYING BIRDS"])
+        self.assertEqual(terms, measure._terms)
+        self.assertTrue(scores[0][0] > 0)
+        self.assertEqual([0, 0], list(scores[1]))
+
+    def test_preprocess_tokens_lemmata(self):
+        lemmatized = []
+
+        def lemmatize(lemmatizer, word, pos="n"):
+            lemmatized.append(word)
+            return word.rstrip("s")
+
+        self.patch(wordnet.WordNetLemmatizer, "lemmatize", lemmatize)
+        measure = relevance.CosineRelevanceMeasure(consts.VectorSpace.LEMMATA)
+        measure.stemmer = relevance._get_stemmer(consts.VectorSpace.LEMMATA,
+                                                 consts.Language.ENGLISH)
+        self.assertEqual([["dog", "cat", "dog"]],
+                         measure._preprocess_tokens([["DOGS", "CAT", "DOGS"]]))
+        self.assertEqual(["cat", "dogs"], sorted(lemmatized))
+
+    def test_lemmata_not_english(self):
+        measure = relevance.CosineRelevanceMeasure(consts.VectorSpace.LEMMATA)
+        self.assertRaises(exceptions.LemmataNotSupportedException, measure.set_text_collection,
+                          [u"Собаки бегут"], consts.Language.RUSSIAN)
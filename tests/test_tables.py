@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*
+
+import numpy as np
+import testtools
+
+from east import tables
+
+
+class KeyphrasesTableTestCase(testtools.TestCase):
+
+    def setUp(self):
+        super(KeyphrasesTableTestCase, self).setUp()
+        self.table = {
+            "dog": {"first": 0.25, "second": 1.0, "third": 0.0},
+            "sunny day": {"first": 0.5, "second": 0.125, "third": 0.0}
+        }
+        self.dense = tables.KeyphrasesTable(["dog", "sunny day"], ["first", "second", "third"],
+                                            [[0.25, 1.0, 0.0], [0.5, 0.125, 0.0]])
+
+    def test_dict_view(self):
+        self.assertEqual(np.float32, self.dense.scores.dtype)
+        self.assertEqual(self.table, self.dense)
+        self.assertEqual(self.table, self.dense.to_dict())
+        self.assertEqual(["dog", "sunny day"], sorted(self.dense.keys()))
+        self.assertEqual(0.125, self.dense["sunny day"]["second"])
+        self.assertEqual(3, len(self.dense["dog"]))
+        self.assertIn("third", self.dense["dog"])
+        self.assertRaises(KeyError, lambda: self.dense["cat"])
+        self.assertRaises(KeyError, lambda: self.dense["dog"]["fourth"])
+
+    def test_rows(self):
+        self.assertEqual(sorted(self.table.items()), list(self.dense.rows()))
+        self.assertEqual([(text, {keyphrase: self.table[keyphrase][text]
+                                  for keyphrase in self.table})
+                          for text in ("first", "second", "third")],
+                         list(self.dense.rows(by_texts=True)))
+
+    def test_threshold(self):
+        sparse = self.dense.threshold(0.25)
+        self.assertEqual(3, sparse.nnz())
+        self.assertEqual([0, 2, 3], sparse.indptr.tolist())
+        self.assertEqual([0, 1, 0], sparse.indices.tolist())
+        expected = {"dog": {"first": 0.25, "second": 1.0}, "sunny day": {"first": 0.5}}
+        self.assertEqual(expected, sparse)
+        self.assertEqual(sorted(expected.items()), list(sparse.rows()))
+        self.assertEqual([("first", {"dog": 0.25, "sunny day": 0.5}),
+                          ("second", {"dog": 1.0}), ("third", {})],
+                         list(sparse.rows(by_texts=True)))
+        dense = sparse.to_dense()
+        self.assertEqual({"dog": {"first": 0.25, "second": 1.0, "third": 0.0},
+                          "sunny day": {"first": 0.5, "second": 0.0, "third": 0.0}}, dense)
+        self.assertEqual(0, self.dense.threshold(2).nnz())